@@ -34,6 +34,10 @@ class Settings(BaseSettings):
     # Redis (per Celery/cache)
     REDIS_URL: str = "redis://localhost:6379/0"
     
+    # Cache token OAuth (in-process, opzionalmente condivisa via Redis tra i worker)
+    TOKEN_CACHE_REDIS_ENABLED: bool = False
+    TOKEN_CACHE_REFRESH_MARGIN_SECONDS: int = 300  # Rinnova N secondi prima della scadenza
+    
     # Supabase
     SUPABASE_URL: str = "http://localhost:54321"
     SUPABASE_ANON_KEY: Optional[str] = None
@@ -47,15 +51,50 @@ class Settings(BaseSettings):
     DYNAMICS_BC_CLIENT_ID: Optional[str] = None
     DYNAMICS_BC_CLIENT_SECRET: Optional[str] = None
     DYNAMICS_BC_BASE_URL: Optional[str] = None  # es: https://api.businesscentral.dynamics.com/v2.0/{tenant}/{environment}/api/v2.0
+    DYNAMICS_BC_TOKEN_URL: Optional[str] = None  # Override endpoint OAuth, es: http://localhost:8100/{tenant}/oauth2/v2.0/token
+    DYNAMICS_BC_MULTI_COMPANY: bool = False  # Sincronizza tutte le company dell'ambiente
+    DYNAMICS_BC_COMPANY_CACHE_TTL_SECONDS: int = 3600  # Cache elenco company
+    DYNAMICS_BC_PAGE_SIZE: int = 1000  # Record per pagina ($top) nelle liste
+    DYNAMICS_BC_PREFETCH_PAGES: int = 4  # Pagine richieste in parallelo (1 = sequenziale)
+    DYNAMICS_BC_RATE_LIMIT_PER_SECOND: float = 10.0  # Token bucket verso BC
+    DYNAMICS_BC_RATE_LIMIT_BURST: int = 20
+    DYNAMICS_BC_MAX_CONCURRENCY: int = 5  # Tetto concorrenza adattiva (AIMD)
+    DYNAMICS_BC_MAX_RETRIES: int = 5  # Retry su 429/503 e errori transitori
+    
+    # Pool HTTP condiviso per connettori esterni
+    HTTP_POOL_HTTP2: bool = True  # Richiede httpx[http2]
+    HTTP_POOL_MAX_CONNECTIONS: int = 100
+    HTTP_POOL_MAX_KEEPALIVE: int = 20
+    HTTP_POOL_KEEPALIVE_EXPIRY: float = 60.0  # Secondi prima di chiudere connessioni idle
+    HTTP_POOL_TIMEOUT_SECONDS: float = 60.0
+    HTTP_POOL_CONNECT_TIMEOUT_SECONDS: float = 10.0
     
     # Webhook Security
     WEBHOOK_SECRET: Optional[str] = None
     
     # Sync Settings
     SYNC_BATCH_SIZE: int = 100
+    SYNC_BULK_COPY_BATCH_SIZE: int = 10000  # Righe per COPY nello staging (load_mode=bulk)
+    SYNC_LINK_CACHE_SIZE: int = 100000  # Link external_id → CRM id tenuti in memoria (LRU)
+    SYNC_PIPELINE_QUEUE_SIZE: int = 5000  # Righe max per coda tra stadi (backpressure)
+    SYNC_PIPELINE_TRANSFORM_WORKERS: int = 1
+    SYNC_PIPELINE_WRITE_WORKERS: int = 2  # Writer concorrenti (una sessione DB per batch)
+    SYNC_WATERMARK_OVERLAP_SECONDS: int = 300  # Finestra riletta prima dell'high-water mark
+    SYNC_COMPANY_RESOLUTION_ENABLED: bool = True  # Collega i contatti alle aziende (IVA, dominio, nome)
+    SYNC_DEDUP_MODE: str = "link"  # Duplicati per email/telefono/nome: off | report | link | merge
+    SYNC_DRY_RUN_SAMPLE_SIZE: int = 20  # Righe con le differenze riportate da un dry_run
+    SYNC_RECONCILE_BUCKETS: int = 4096  # Bucket di hash della riconciliazione (filters.reconcile)
+    SYNC_RECONCILE_DELETED: str = "archive"  # Record eliminati in BC: archive | delete | report
+    SYNC_OUTBOX_BATCH_SIZE: int = 100  # Modifiche CRM inviate a BC per $batch
+    SYNC_OUTBOX_MAX_ATTEMPTS: int = 5  # Poi la modifica resta in sync_outbox per ispezione
+    SYNC_OUTBOX_CLAIM_TIMEOUT_SECONDS: int = 300  # Righe prese da un worker morto: di nuovo disponibili
+    SYNC_OUTBOX_LISTENER_ENABLED: bool = False  # LISTEN sync_outbox: invio quasi in tempo reale
+    SYNC_OUTBOX_POLL_SECONDS: int = 30
     SYNC_TIMEOUT_SECONDS: int = 300
     AUTO_SYNC_ENABLED: bool = False
     AUTO_SYNC_CRON: str = "0 */6 * * *"  # Ogni 6 ore di default
+    AUTO_RECONCILE_ENABLED: bool = False
+    AUTO_RECONCILE_CRON: str = "0 3 * * 0"  # Domenica alle 3 di default
     
     # Logging
     LOG_LEVEL: str = "INFO"
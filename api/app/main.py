@@ -16,11 +16,16 @@ Documentazione automatica:
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
+import asyncio
 import structlog
 
 from app.config import get_settings
+from app.database import AsyncSessionLocal, async_engine
 from app.routers import health, sync, webhooks
+from app.services.http_pool import init_http_pool, close_http_pool
+from app.services.outbox import listen_outbox
+from app.services.sync_engine import SyncEngine
 
 # Configura logging
 structlog.configure(
@@ -45,6 +50,8 @@ logger = structlog.get_logger()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Gestisce startup e shutdown"""
+    settings = get_settings()
+    
     # Startup
     logger.info(
         "api.starting",
@@ -53,15 +60,34 @@ async def lifespan(app: FastAPI):
         debug=settings.DEBUG,
     )
     
+    # Pool HTTP condiviso dai connettori esterni
+    await init_http_pool()
+    
     # Verifica connessioni
-    settings = get_settings()
     if settings.DYNAMICS_BC_ENABLED:
         logger.info("dynamics_bc.enabled")
     
+    # Sync in uscita quasi in tempo reale: le modifiche ai contatti vengono
+    # inviate a BC alla notifica dei trigger su sync_outbox
+    outbox_listener = None
+    if settings.DYNAMICS_BC_ENABLED and settings.SYNC_OUTBOX_LISTENER_ENABLED:
+        async def push_changes():
+            async with AsyncSessionLocal() as db:
+                await SyncEngine(db).push_contact_changes()
+        
+        outbox_listener = asyncio.create_task(
+            listen_outbox(async_engine, push_changes, settings.SYNC_OUTBOX_POLL_SECONDS)
+        )
+    
     yield
     
     # Shutdown
     logger.info("api.shutting_down")
+    if outbox_listener:
+        outbox_listener.cancel()
+        with suppress(asyncio.CancelledError):
+            await outbox_listener
+    await close_http_pool()
 
 
 # Istanzia app
@@ -55,12 +55,27 @@ class HealthResponse(BaseModel):
     checks: Dict[str, Any] = Field(default_factory=dict)
 
 
+class LoadMode(str, Enum):
+    """Modalità di scrittura nel CRM"""
+    INCREMENTAL = "incremental"  # Upsert per batch (sync giornaliere)
+    BULK = "bulk"  # COPY in staging + MERGE (import iniziali)
+
+
+class DedupMode(str, Enum):
+    """Gestione dei duplicati CRM dei record esterni senza link"""
+    OFF = "off"
+    REPORT = "report"  # Solo segnalati nel risultato della sync
+    LINK = "link"  # Il contatto esistente viene collegato e aggiornato
+    MERGE = "merge"  # Unito con merge_contacts al contatto sincronizzato
+
+
 class SyncJobBase(BaseModel):
     """Base per job di sincronizzazione"""
     source: SyncSource
     direction: SyncDirection = SyncDirection.BIDIRECTIONAL
     entity_types: List[EntityType] = Field(default_factory=lambda: [EntityType.CONTACT, EntityType.COMPANY])
     dry_run: bool = False  # Se True, simula senza modificare
+    load_mode: LoadMode = LoadMode.INCREMENTAL
     filters: Optional[Dict[str, Any]] = None  # Filtri per la sync (es: data ultima modifica)
 
 
@@ -89,6 +104,24 @@ class SyncJobResponse(SyncJobBase):
     errors: List[Dict[str, Any]] = Field(default_factory=list)
 
 
+class SyncWatermark(BaseModel):
+    """High-water mark di una sync incrementale"""
+    source: str
+    company_id: str = ""
+    entity_type: str
+    high_water: datetime
+    updated_at: Optional[datetime] = None
+
+
+class SyncMapping(BaseModel):
+    """Mapping campi di una source/entità: regole custom e di default"""
+    source: SyncSource
+    entity_type: EntityType
+    fields: List[Dict[str, Any]] = Field(default_factory=list)  # Regole custom (sync_mappings)
+    defaults: List[Dict[str, Any]] = Field(default_factory=list)
+    select: List[str] = Field(default_factory=list)  # Campi esterni scaricati
+
+
 # ============== DYNAMICS BC MODELS ==============
 
 class DynamicsBCConfig(BaseModel):
@@ -101,6 +134,24 @@ class DynamicsBCConfig(BaseModel):
     base_url: Optional[str] = None
 
 
+# Proprietà delle entità BC API v2.0: BC risponde 400 ("Could not find a
+# property named ...") se $select nomina un campo diverso, quindi gli alias
+# dei modelli, i $select e le righe dell'emulatore restano dentro queste liste
+BC_CUSTOMER_PROPERTIES = frozenset({
+    "id", "number", "displayName", "type", "addressLine1", "addressLine2", "city", "state",
+    "country", "postalCode", "phoneNumber", "email", "website", "salespersonCode",
+    "balanceDue", "creditLimit", "taxLiable", "taxAreaId", "taxAreaDisplayName",
+    "taxRegistrationNumber", "currencyId", "currencyCode", "paymentTermsId",
+    "shipmentMethodId", "paymentMethodId", "blocked", "lastModifiedDateTime",
+})
+BC_VENDOR_PROPERTIES = frozenset({
+    "id", "number", "displayName", "addressLine1", "addressLine2", "city", "state",
+    "country", "postalCode", "phoneNumber", "email", "website", "taxRegistrationNumber",
+    "currencyId", "currencyCode", "irs1099Code", "paymentTermsId", "paymentMethodId",
+    "taxLiable", "blocked", "balance", "lastModifiedDateTime",
+})
+
+
 class DynamicsBCCustomer(BaseModel):
     """Modello cliente Dynamics BC"""
     model_config = ConfigDict(populate_by_name=True)
@@ -110,12 +161,16 @@ class DynamicsBCCustomer(BaseModel):
     display_name: str = Field(..., alias="displayName")
     email: Optional[str] = Field(None, alias="email")
     phone: Optional[str] = Field(None, alias="phoneNumber")
-    address: Optional[str] = Field(None, alias="address")
+    address_line1: Optional[str] = Field(None, alias="addressLine1")
+    address_line2: Optional[str] = Field(None, alias="addressLine2")
     city: Optional[str] = Field(None, alias="city")
     country: Optional[str] = Field(None, alias="country")
-    vat_registration_no: Optional[str] = Field(None, alias="taxRegistrationNo")
+    website: Optional[str] = None
+    vat_registration_no: Optional[str] = Field(None, alias="taxRegistrationNumber")
+    type: Optional[str] = None  # "Company" | "Person"
     blocked: Optional[str] = None
     last_modified: Optional[datetime] = Field(None, alias="lastModifiedDateTime")
+    etag: Optional[str] = Field(None, alias="@odata.etag")
 
 
 class DynamicsBCVendor(BaseModel):
@@ -127,12 +182,54 @@ class DynamicsBCVendor(BaseModel):
     display_name: str = Field(..., alias="displayName")
     email: Optional[str] = None
     phone: Optional[str] = Field(None, alias="phoneNumber")
-    address: Optional[str] = None
+    address_line1: Optional[str] = Field(None, alias="addressLine1")
+    address_line2: Optional[str] = Field(None, alias="addressLine2")
     city: Optional[str] = None
     country: Optional[str] = None
-    vat_registration_no: Optional[str] = Field(None, alias="taxRegistrationNo")
+    website: Optional[str] = None
+    vat_registration_no: Optional[str] = Field(None, alias="taxRegistrationNumber")
     blocked: Optional[str] = None
     last_modified: Optional[datetime] = Field(None, alias="lastModifiedDateTime")
+    etag: Optional[str] = Field(None, alias="@odata.etag")
+
+
+class DynamicsBCRecordVersion(BaseModel):
+    """Solo id, tipo ed ETag di un record BC (elenco leggero per la riconciliazione)"""
+    model_config = ConfigDict(populate_by_name=True)
+    
+    id: str
+    type: Optional[str] = None  # Clienti: "Company" | "Person"
+    etag: Optional[str] = Field(None, alias="@odata.etag")
+
+
+class DynamicsBCCustomerWrite(BaseModel):
+    """Cliente da creare/aggiornare in BC via $batch"""
+    ref: str  # Riferimento lato CRM per correlare il risultato
+    customer_id: Optional[str] = None  # Se presente: PATCH, altrimenti POST
+    etag: Optional[str] = None  # Ultimo ETag letto, per If-Match
+    company_id: Optional[str] = None  # Company BC, default quella del client
+    data: Dict[str, Any]
+
+
+class DynamicsBCBatchOperation(BaseModel):
+    """Singola operazione di una richiesta OData $batch"""
+    id: str
+    method: Literal["GET", "POST", "PATCH", "PUT", "DELETE"]
+    url: str  # Relativo alla base URL, es: companies({id})/customers
+    body: Optional[Dict[str, Any]] = None
+    etag: Optional[str] = None  # Header If-Match
+    atomicity_group: Optional[str] = None  # Change set (tutto o niente)
+
+
+class DynamicsBCBatchResult(BaseModel):
+    """Esito di una operazione $batch"""
+    id: str
+    status: int
+    success: bool
+    conflict: bool = False  # 412: record modificato in BC dopo l'ultima lettura
+    etag: Optional[str] = None  # Nuovo ETag da salvare per il prossimo update
+    body: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
 
 
 # ============== WEBHOOK MODELS ==============
@@ -176,7 +273,8 @@ class ContactSync(BaseModel):
     company_name: Optional[str] = None
     
     # Indirizzo
-    address: Optional[str] = None
+    address_line1: Optional[str] = Field(None, alias="addressLine1")
+    address_line2: Optional[str] = Field(None, alias="addressLine2")
     city: Optional[str] = None
     country: Optional[str] = None
     
@@ -206,7 +304,8 @@ class CompanySync(BaseModel):
     linkedin_url: Optional[str] = None
     
     # Indirizzo
-    address: Optional[str] = None
+    address_line1: Optional[str] = Field(None, alias="addressLine1")
+    address_line2: Optional[str] = Field(None, alias="addressLine2")
     city: Optional[str] = None
     zipcode: Optional[str] = None
     state: Optional[str] = None
@@ -0,0 +1,120 @@
+"""
+Tabelle CRM (SQLAlchemy Core) usate dal motore di sync.
+
+Lo schema è gestito dalle migrazioni Supabase (supabase/migrations):
+qui sono dichiarate solo le colonne lette o scritte dalla sync.
+"""
+
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Integer, MetaData, SmallInteger, Table, Text
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+
+metadata = MetaData()
+
+contacts = Table(
+    "contacts",
+    metadata,
+    Column("id", BigInteger, primary_key=True),
+    Column("first_name", Text),
+    Column("last_name", Text),
+    Column("title", Text),
+    Column("gender", Text),
+    Column("email_jsonb", JSONB),
+    Column("phone_jsonb", JSONB),
+    Column("background", Text),
+    Column("first_seen", DateTime(timezone=True)),
+    Column("last_seen", DateTime(timezone=True)),
+    Column("status", Text),
+    Column("has_newsletter", Boolean),
+    Column("tags", ARRAY(BigInteger)),
+    Column("company_id", BigInteger),
+    Column("sales_id", BigInteger),
+    Column("linkedin_url", Text),
+    # Riferimento al sistema esterno (unique su external_source, external_id)
+    Column("external_source", Text),
+    Column("external_id", Text),
+    Column("external_data", JSONB),
+    Column("last_synced_at", DateTime(timezone=True)),
+)
+
+companies = Table(
+    "companies",
+    metadata,
+    Column("id", BigInteger, primary_key=True),
+    Column("created_at", DateTime(timezone=True)),
+    Column("name", Text, nullable=False),
+    Column("sector", Text),
+    Column("size", SmallInteger),
+    Column("linkedin_url", Text),
+    Column("website", Text),
+    Column("phone_number", Text),
+    Column("address", Text),
+    Column("zipcode", Text),
+    Column("city", Text),
+    Column("state_abbr", Text),
+    Column("sales_id", BigInteger),
+    Column("country", Text),
+    Column("description", Text),
+    Column("revenue", Text),
+    Column("tax_identifier", Text),
+)
+
+# Link record esterno → riga CRM (unique su source, entity_type, external_id)
+sync_links = Table(
+    "sync_links",
+    metadata,
+    Column("id", BigInteger, primary_key=True),
+    Column("source", Text, nullable=False),
+    Column("entity_type", Text, nullable=False),
+    Column("external_id", Text, nullable=False),
+    Column("crm_id", BigInteger, nullable=False),
+    Column("version", Text),
+    Column("hash", Text),
+    Column("synced_at", DateTime(timezone=True)),
+)
+
+# High-water mark delle sync incrementali (PK source, company_id, entity_type)
+sync_watermarks = Table(
+    "sync_watermarks",
+    metadata,
+    Column("source", Text, primary_key=True),
+    Column("company_id", Text, primary_key=True),
+    Column("entity_type", Text, primary_key=True),
+    Column("high_water", DateTime(timezone=True), nullable=False),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+# Checkpoint dei job di sync (PK job_key, source, entity_type)
+sync_checkpoints = Table(
+    "sync_checkpoints",
+    metadata,
+    Column("job_key", Text, primary_key=True),
+    Column("source", Text, primary_key=True),
+    Column("entity_type", Text, primary_key=True),
+    Column("state", JSONB, nullable=False),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+# Outbox delle modifiche CRM da inviare ai sistemi esterni (trigger su contacts)
+sync_outbox = Table(
+    "sync_outbox",
+    metadata,
+    Column("id", BigInteger, primary_key=True),
+    Column("entity_type", Text, nullable=False),
+    Column("record_id", BigInteger, nullable=False),
+    Column("operation", Text, nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("last_error", Text),
+    Column("created_at", DateTime(timezone=True)),
+    # Presa da un worker (invio a BC in corso), NULL se libera
+    Column("claimed_at", DateTime(timezone=True)),
+)
+
+# Mapping campi custom per source/entità (regole in spec.fields)
+sync_mappings = Table(
+    "sync_mappings",
+    metadata,
+    Column("source", Text, primary_key=True),
+    Column("entity_type", Text, primary_key=True),
+    Column("spec", JSONB, nullable=False),
+    Column("updated_at", DateTime(timezone=True)),
+)
@@ -10,6 +10,7 @@ from typing import Dict, Any
 
 from app.database import get_db
 from app.config import get_settings
+from app.services.http_pool import http_pool_stats
 
 router = APIRouter(tags=["Health"])
 
@@ -26,6 +27,7 @@ async def health_check(db: AsyncSession = Depends(get_db)):
     checks = {
         "api": {"status": "ok", "version": settings.APP_VERSION},
         "database": {"status": "unknown"},
+        "http_pool": http_pool_stats(),
         "timestamp": datetime.utcnow().isoformat(),
     }
     
@@ -70,6 +72,12 @@ async def liveness_probe():
     return {"alive": True}
 
 
+@router.get("/health/http-pool")
+async def http_pool_status():
+    """Statistiche del pool HTTP condiviso dai connettori"""
+    return http_pool_stats()
+
+
 @router.get("/version")
 async def version():
     """Restituisce versione e info build"""
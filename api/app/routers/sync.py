@@ -9,7 +9,7 @@ from typing import List, Optional
 import uuid
 from datetime import datetime
 
-from app.database import get_db
+from app.database import AsyncSessionLocal, get_db
 from app.models.schemas import (
     SyncJobCreate, 
     SyncJobResponse, 
@@ -18,8 +18,12 @@ from app.models.schemas import (
     EntityType,
     ContactSync,
     CompanySync,
+    SyncWatermark,
+    SyncMapping,
 )
-from app.services.sync_engine import SyncEngine
+from app.services.field_mapping import MappingError, delete_mapping, load_mapping, normalize_spec, save_mapping
+from app.services.sync_engine import MAPPING_TARGETS, SyncEngine
+from app.services.watermarks import list_watermarks, reset_watermarks
 from app.config import get_settings
 
 router = APIRouter(prefix="/sync", tags=["Synchronization"])
@@ -64,6 +68,7 @@ async def trigger_sync(
         direction=job.direction,
         entity_types=job.entity_types,
         dry_run=job.dry_run,
+        load_mode=job.load_mode,
         filters=job.filters,
         status=SyncStatus.PENDING,
         created_at=datetime.utcnow(),
@@ -147,20 +152,22 @@ async def preview_sync(
 async def validate_field_mapping(
     source: SyncSource,
     mapping: dict,
+    entity_type: EntityType = EntityType.CONTACT,
     db: AsyncSession = Depends(get_db),
 ):
     """
-    Valida un mapping di campi personalizzato.
-    Utile per configurare la sincronizzazione.
+    Valida un mapping di campi personalizzato ({"fields": [regole]} o
+    {campo esterno: campo CRM}). Utile per configurare la sincronizzazione.
     """
     engine = SyncEngine(db)
     
     try:
-        validation = await engine.validate_mapping(source, mapping)
+        validation = await engine.validate_mapping(source, mapping, entity_type)
         return {
             "valid": validation.get("valid", False),
             "errors": validation.get("errors", []),
             "warnings": validation.get("warnings", []),
+            "select": validation.get("select", []),
         }
     except Exception as e:
         raise HTTPException(
@@ -169,6 +176,117 @@ async def validate_field_mapping(
         )
 
 
+@router.get("/mappings/{source}/{entity_type}", response_model=SyncMapping)
+async def get_field_mapping(
+    source: SyncSource,
+    entity_type: EntityType,
+    db: AsyncSession = Depends(get_db),
+):
+    """Regole di mapping custom salvate e di default per source/entità"""
+    if (source, entity_type) not in MAPPING_TARGETS:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No configurable mapping for {source.value} {entity_type.value}"
+        )
+    
+    engine = SyncEngine(db)
+    _, _, defaults = MAPPING_TARGETS[(source, entity_type)]
+    try:
+        compiled = await engine.active_mapping(source, entity_type)
+    except MappingError as e:
+        # Regole salvate non più valide (es. colonna rimossa)
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"message": "Stored mapping is invalid", "errors": e.errors}
+        )
+    return SyncMapping(
+        source=source,
+        entity_type=entity_type,
+        fields=await load_mapping(db, source.value, entity_type.value) or [],
+        defaults=defaults,
+        select=engine.mapping_select(entity_type, compiled),
+    )
+
+
+@router.put("/mappings/{source}/{entity_type}", response_model=SyncMapping)
+async def put_field_mapping(
+    source: SyncSource,
+    entity_type: EntityType,
+    mapping: dict,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Salva le regole di mapping custom ({"fields": [regole]}): compilate e
+    validate contro le colonne reali prima del salvataggio, usate dalle
+    sync successive al posto delle regole di default sulle stesse colonne.
+    """
+    engine = SyncEngine(db)
+    try:
+        rules = normalize_spec(mapping)
+        compiled = engine.compile_mapping(source, entity_type, rules)
+    except MappingError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"message": "Invalid mapping", "errors": e.errors}
+        )
+    
+    await save_mapping(db, source.value, entity_type.value, rules)
+    _, _, defaults = MAPPING_TARGETS[(source, entity_type)]
+    return SyncMapping(
+        source=source,
+        entity_type=entity_type,
+        fields=rules,
+        defaults=defaults,
+        select=engine.mapping_select(entity_type, compiled),
+    )
+
+
+@router.delete("/mappings/{source}/{entity_type}")
+async def delete_field_mapping(
+    source: SyncSource,
+    entity_type: EntityType,
+    db: AsyncSession = Depends(get_db),
+):
+    """Elimina le regole custom: le sync tornano al mapping di default"""
+    deleted = await delete_mapping(db, source.value, entity_type.value)
+    return {"deleted": deleted}
+
+
+@router.get("/watermarks", response_model=List[SyncWatermark])
+async def get_sync_watermarks(
+    source: Optional[SyncSource] = None,
+    entity_type: Optional[EntityType] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    High-water mark delle sync incrementali (per source, company, entità).
+    Le sync senza filters.last_sync partono da qui, meno la finestra di overlap.
+    """
+    rows = await list_watermarks(
+        db,
+        source=source.value if source else None,
+        entity_type=entity_type.value if entity_type else None,
+    )
+    return [SyncWatermark(**row) for row in rows]
+
+
+@router.delete("/watermarks/{source}")
+async def reset_sync_watermarks(
+    source: SyncSource,
+    entity_type: Optional[EntityType] = None,
+    company_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """Azzera gli high-water mark: la prossima sync scarica tutto"""
+    deleted = await reset_watermarks(
+        db,
+        source=source.value,
+        entity_type=entity_type.value if entity_type else None,
+        company_id=company_id,
+    )
+    return {"deleted": deleted}
+
+
 # ============== BACKGROUND TASK ==============
 
 async def _run_sync_job(job_id: str, job: SyncJobCreate, db: AsyncSession):
@@ -179,7 +297,9 @@ async def _run_sync_job(job_id: str, job: SyncJobCreate, db: AsyncSession):
     job_response.status = SyncStatus.RUNNING
     job_response.started_at = datetime.utcnow()
     
-    engine = SyncEngine(db)
+    # Sessione per batch: la sessione della request può essere già chiusa
+    # quando parte il background task, e servono più writer concorrenti
+    engine = SyncEngine(db, session_factory=AsyncSessionLocal)
     
     try:
         # Esegui sync
@@ -189,6 +309,7 @@ async def _run_sync_job(job_id: str, job: SyncJobCreate, db: AsyncSession):
             entity_types=job.entity_types,
             dry_run=job.dry_run,
             filters=job.filters,
+            load_mode=job.load_mode,
         )
         
         # Aggiorna risultati
@@ -0,0 +1,410 @@
+"""
+Caricamento massivo via COPY + MERGE.
+
+Per gli import iniziali (intere company BC) le righe trasformate vengono
+copiate con asyncpg `copy_records_to_table` in una tabella di staging
+UNLOGGED e applicate alla tabella CRM con un solo MERGE, invece di un
+upsert per batch. Le righe di staging sono separate per run_id, così più
+job possono caricare in parallelo.
+
+Con `link_entity_type` il MERGE aggiorna solo le righe il cui hash
+differisce da quello in sync_links, e i link vengono poi aggiornati con
+un solo INSERT ... SELECT dallo staging.
+
+DryRunDiff usa la stessa struttura per l'anteprima di un dry_run: staging
+in una tabella temporanea e conteggi calcolati nel database, senza MERGE.
+"""
+
+import json
+import uuid
+from dataclasses import dataclass, replace
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import structlog
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.services.contact_writer import LINK_ENTITY_TYPE, LINK_FIELDS, SYNC_UPDATE_COLUMNS, UNION_COLUMNS, UPSERT_UPDATE_COLUMNS
+
+logger = structlog.get_logger()
+
+
+@dataclass(frozen=True)
+class MergeSpec:
+    """Tabella destinazione, staging e colonne del MERGE"""
+    target: str
+    staging: str
+    key_columns: Tuple[str, ...]
+    columns: Tuple[str, ...]
+    update_columns: Tuple[str, ...]
+    json_columns: Tuple[str, ...] = ()
+    # Link in sync_links: chiavi (external_source, external_id) e colonne
+    # di staging external_hash/external_version non copiate nel target
+    link_entity_type: Optional[str] = None
+    link_columns: Tuple[str, ...] = ()
+    # Colonne aggiornate solo se lo staging ha un valore (COALESCE)
+    fill_columns: Tuple[str, ...] = ()
+    # Righe presenti nel target ma senza link (adottate dalla deduplica):
+    # colonne di sync sempre scritte, (colonna, funzione SQL) unite, le altre
+    # aggiornate solo se vuote nel target
+    sync_columns: Tuple[str, ...] = ()
+    union_columns: Tuple[Tuple[str, str], ...] = ()
+    
+    def with_columns(self, columns: Iterable[str], fill: Iterable[str] = ()) -> "MergeSpec":
+        """
+        Stesso MERGE con altre colonne copiate e aggiornate (es. target del
+        mapping custom) e colonne `fill` copiate e aggiornate solo se non NULL
+        """
+        columns = tuple(dict.fromkeys(columns))
+        fill = tuple(column for column in dict.fromkeys(fill) if column not in columns)
+        extra = tuple(column for column in (*columns, *fill) if column not in self.columns)
+        updates = tuple(column for column in columns if column not in self.update_columns)
+        return replace(
+            self,
+            columns=self.columns + extra,
+            update_columns=updates + self.update_columns,
+            fill_columns=self.fill_columns + fill,
+        )
+
+
+CONTACTS_MERGE = MergeSpec(
+    target="contacts",
+    staging="sync_staging_contacts",
+    key_columns=("external_source", "external_id"),
+    columns=(
+        "first_name",
+        "last_name",
+        "email_jsonb",
+        "phone_jsonb",
+        "first_seen",
+        "last_seen",
+        "external_source",
+        "external_id",
+        "external_data",
+        "last_synced_at",
+    ),
+    update_columns=UPSERT_UPDATE_COLUMNS,
+    json_columns=("email_jsonb", "phone_jsonb", "external_data"),
+    link_entity_type=LINK_ENTITY_TYPE,
+    link_columns=LINK_FIELDS,
+    sync_columns=SYNC_UPDATE_COLUMNS,
+    union_columns=tuple((column, f"public.{function}") for column, function in UNION_COLUMNS.items()),
+)
+
+
+class StagedMerge:
+    """
+    Staging di un run e MERGE finale.
+    
+    Uso:
+        loader = StagedMerge(db, CONTACTS_MERGE)
+        await loader.stage(rows)      # N volte, COPY per chunk
+        created, updated = await loader.merge()
+    """
+    
+    def __init__(
+        self,
+        db: AsyncSession,
+        spec: MergeSpec,
+        run_id: Optional[uuid.UUID] = None,
+        staged: int = 0,
+    ):
+        # run_id/staged di un run precedente per riprenderne lo staging
+        self.db = db
+        self.spec = spec
+        self.run_id = run_id or uuid.uuid4()
+        self.staged = staged
+    
+    async def stage(self, rows: List[Dict[str, Any]]):
+        """Copia un chunk di righe nello staging (COPY binario)"""
+        if not rows:
+            return
+        
+        columns = (*self.spec.columns, *self.spec.link_columns)
+        json_columns = set(self.spec.json_columns)
+        records = [
+            (self.run_id, *(
+                json.dumps(row.get(column), default=str) if column in json_columns else row.get(column)
+                for column in columns
+            ))
+            for row in rows
+        ]
+        
+        connection = await self._driver_connection()
+        await connection.copy_records_to_table(
+            self.spec.staging,
+            records=records,
+            columns=("run_id", *columns),
+        )
+        self.staged += len(records)
+    
+    async def merge(self) -> Tuple[int, int, int]:
+        """
+        Applica lo staging alla tabella destinazione con un solo MERGE
+        e rimuove le righe del run.
+        
+        Returns:
+            (creati, aggiornati, invariati)
+        """
+        if not self.staged:
+            return 0, 0, 0
+        
+        params = {"run_id": self.run_id, "entity_type": self.spec.link_entity_type}
+        
+        # MERGE su Postgres 15 non ha RETURNING: conteggi dal join prima del MERGE
+        counts = (await self.db.execute(text(self._count_sql()), params)).one()
+        await self.db.execute(text(self._merge_sql()), params)
+        if self.spec.link_entity_type:
+            await self.db.execute(text(self._links_sql()), params)
+        await self.discard()
+        
+        logger.info(
+            "bulk_load.merged",
+            target=self.spec.target,
+            staged=self.staged,
+            created=counts.created,
+            updated=counts.updated,
+            unchanged=counts.unchanged,
+        )
+        return counts.created, counts.updated, counts.unchanged
+    
+    async def discard(self):
+        """Elimina le righe di staging del run"""
+        await self.db.execute(
+            text(f"DELETE FROM {self.spec.staging} WHERE run_id = :run_id"),
+            {"run_id": self.run_id},
+        )
+    
+    async def count_staged(self) -> int:
+        """Righe del run presenti nello staging (tabella UNLOGGED: svuotata dopo un crash di Postgres)"""
+        result = await self.db.execute(
+            text(f"SELECT count(*) FROM {self.spec.staging} WHERE run_id = :run_id"),
+            {"run_id": self.run_id},
+        )
+        return result.scalar_one()
+    
+    async def _driver_connection(self):
+        """Connessione asyncpg sottostante (stessa transazione della sessione)"""
+        connection = await self.db.connection()
+        raw = await connection.get_raw_connection()
+        return raw.driver_connection
+    
+    def _source_sql(self) -> str:
+        """Righe del run, una per chiave (vince l'ultima copiata), con id, versione e hash del link"""
+        keys = ", ".join(self.spec.key_columns)
+        latest = (
+            f"SELECT DISTINCT ON ({keys}) * FROM {self.spec.staging} "
+            f"WHERE run_id = :run_id ORDER BY {keys}, seq DESC"
+        )
+        if not self.spec.link_entity_type:
+            return latest
+        return (
+            f"SELECT r.*, l.crm_id AS link_crm_id, l.version AS link_version, l.hash AS link_hash FROM ({latest}) r "
+            f"LEFT JOIN sync_links l ON l.source = r.external_source "
+            f"AND l.entity_type = :entity_type AND l.external_id = r.external_id"
+        )
+    
+    def _join_condition(self) -> str:
+        return " AND ".join(f"t.{column} = s.{column}" for column in self.spec.key_columns)
+    
+    def _changed_condition(self) -> str:
+        """Condizione di aggiornamento per le righe già presenti"""
+        if self.spec.link_entity_type:
+            return "s.link_hash IS DISTINCT FROM s.external_hash"
+        return "true"
+    
+    def _count_sql(self) -> str:
+        first_key = self.spec.key_columns[0]
+        changed = self._changed_condition()
+        return (
+            f"SELECT count(*) FILTER (WHERE t.{first_key} IS NULL) AS created, "
+            f"count(*) FILTER (WHERE t.{first_key} IS NOT NULL AND {changed}) AS updated, "
+            f"count(*) FILTER (WHERE t.{first_key} IS NOT NULL AND NOT ({changed})) AS unchanged "
+            f"FROM ({self._source_sql()}) s "
+            f"LEFT JOIN {self.spec.target} t ON {self._join_condition()}"
+        )
+    
+    def _merge_sql(self) -> str:
+        columns: Sequence[str] = self.spec.columns
+        updates = ", ".join([
+            *(f"{column} = s.{column}" for column in self.spec.update_columns),
+            *(f"{column} = COALESCE(s.{column}, t.{column})" for column in self.spec.fill_columns),
+        ])
+        adopt = ""
+        if self.spec.link_entity_type:
+            # Prima clausola che corrisponde: le righe senza link adottano il target
+            adopt = f"WHEN MATCHED AND s.link_crm_id IS NULL THEN UPDATE SET {self._adopt_updates()} "
+        return (
+            f"MERGE INTO {self.spec.target} t "
+            f"USING ({self._source_sql()}) s ON {self._join_condition()} "
+            f"{adopt}"
+            f"WHEN MATCHED AND {self._changed_condition()} THEN UPDATE SET {updates} "
+            f"WHEN NOT MATCHED THEN INSERT ({', '.join(columns)}) "
+            f"VALUES ({', '.join('s.' + column for column in columns)})"
+        )
+    
+    def _adopt_updates(self) -> str:
+        """SET per le righe adottate: vince il target, colonne di sync e unite a parte"""
+        unions = dict(self.spec.union_columns)
+        updates = []
+        for column in (*self.spec.update_columns, *self.spec.fill_columns):
+            if column in self.spec.sync_columns:
+                updates.append(f"{column} = s.{column}")
+            elif column in unions:
+                updates.append(f"{column} = {unions[column]}(t.{column}, s.{column})")
+            else:
+                updates.append(f"{column} = COALESCE(t.{column}, s.{column})")
+        return ", ".join(updates)
+    
+    def _links_sql(self) -> str:
+        """
+        Upsert in sync_links delle righe create o aggiornate dal MERGE e di
+        quelle con contenuto invariato ma nuovo ETag (solo la versione
+        cambia, usata per If-Match e riconciliazione)
+        """
+        stale = "s.external_version IS NOT NULL AND s.external_version IS DISTINCT FROM s.link_version"
+        return (
+            f"INSERT INTO sync_links (source, entity_type, external_id, crm_id, version, hash) "
+            f"SELECT s.external_source, :entity_type, s.external_id, t.id, s.external_version, s.external_hash "
+            f"FROM ({self._source_sql()}) s "
+            f"JOIN {self.spec.target} t ON {self._join_condition()} "
+            f"WHERE {self._changed_condition()} OR ({stale}) "
+            f"ON CONFLICT (source, entity_type, external_id) DO UPDATE SET "
+            f"crm_id = EXCLUDED.crm_id, version = EXCLUDED.version, "
+            f"hash = EXCLUDED.hash, synced_at = now()"
+        )
+
+
+@dataclass
+class DiffReport:
+    """Esito previsto di una sync (dry_run), calcolato dal database"""
+    created: int
+    updated: int
+    unchanged: int
+    # Colonna → righe aggiornate in cui cambierebbe
+    fields: Dict[str, int]
+    # Alcune righe con le colonne che cambierebbero ({"old", "new"})
+    sample: List[Dict[str, Any]]
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {"fields": self.fields, "sample": self.sample}
+
+
+class DryRunDiff(StagedMerge):
+    """
+    Anteprima di un caricamento (dry_run): le righe trasformate vengono
+    copiate in una tabella temporanea con la struttura dello staging e
+    confrontate con la destinazione con una query aggregata, come farebbe
+    il MERGE. Le tabelle reali non vengono toccate.
+    
+    Uso:
+        preview = DryRunDiff(db, CONTACTS_MERGE, ignore=SYNC_UPDATE_COLUMNS)
+        await preview.create()
+        await preview.stage(rows)     # N volte
+        report = await preview.diff()
+        await preview.drop()
+    """
+    
+    def __init__(
+        self,
+        db: AsyncSession,
+        spec: MergeSpec,
+        ignore: Iterable[str] = (),
+        sample_size: int = 20,
+    ):
+        # Tabella temporanea propria del run (visibile solo alla sessione)
+        run_id = uuid.uuid4()
+        super().__init__(db, replace(spec, staging=f"dry_run_{run_id.hex}"), run_id=run_id)
+        self.template = spec.staging
+        self.sample_size = sample_size
+        # Colonne confrontate campo per campo (non quelle di servizio, sempre diverse)
+        ignore = set(ignore)
+        self.compare_columns = tuple(column for column in spec.update_columns if column not in ignore)
+        self.fill_columns = tuple(column for column in spec.fill_columns if column not in ignore)
+    
+    async def create(self):
+        """Crea la tabella temporanea (stesse colonne e seq dello staging)"""
+        await self.db.execute(text(
+            f"CREATE TEMP TABLE {self.spec.staging} "
+            f"(LIKE {self.template} INCLUDING DEFAULTS INCLUDING IDENTITY)"
+        ))
+    
+    async def drop(self):
+        await self.db.execute(text(f"DROP TABLE IF EXISTS {self.spec.staging}"))
+    
+    async def diff(self) -> DiffReport:
+        """
+        Righe che verrebbero create, aggiornate o lasciate invariate, cambi
+        per colonna e un campione di differenze (due query sulla tabella
+        temporanea, nessuna riga trasferita oltre al campione)
+        """
+        params = {"run_id": self.run_id, "entity_type": self.spec.link_entity_type}
+        if not self.staged:
+            return DiffReport(0, 0, 0, {}, [])
+        
+        counts = (await self.db.execute(text(self._diff_sql()), params)).one()._mapping
+        sample = await self.db.execute(text(self._sample_sql()), {**params, "limit": self.sample_size})
+        columns = (*self.compare_columns, *self.fill_columns)
+        report = DiffReport(
+            created=counts["created"],
+            updated=counts["updated"],
+            unchanged=counts["unchanged"],
+            fields={
+                column: counts[f"changed_{index}"]
+                for index, column in enumerate(columns) if counts[f"changed_{index}"]
+            },
+            sample=[
+                {"external_id": row.external_id, "crm_id": row.crm_id, "changes": row.changes or {}}
+                for row in sample
+            ],
+        )
+        logger.info(
+            "bulk_load.dry_run_diff",
+            target=self.spec.target,
+            staged=self.staged,
+            created=report.created,
+            updated=report.updated,
+            unchanged=report.unchanged,
+        )
+        return report
+    
+    def _field_changed(self, column: str) -> str:
+        """La colonna cambierebbe (le colonne fill solo con un valore nuovo)"""
+        if column in self.fill_columns:
+            return f"(s.{column} IS NOT NULL AND t.{column} IS DISTINCT FROM s.{column})"
+        return f"(t.{column} IS DISTINCT FROM s.{column})"
+    
+    def _diff_sql(self) -> str:
+        """Conteggi di _count_sql più una colonna changed_N per ogni colonna confrontata"""
+        first_key = self.spec.key_columns[0]
+        changed = self._changed_condition()
+        updated = f"t.{first_key} IS NOT NULL AND {changed}"
+        fields = "".join(
+            f", count(*) FILTER (WHERE {updated} AND {self._field_changed(column)}) AS changed_{index}"
+            for index, column in enumerate((*self.compare_columns, *self.fill_columns))
+        )
+        return (
+            f"SELECT count(*) FILTER (WHERE t.{first_key} IS NULL) AS created, "
+            f"count(*) FILTER (WHERE {updated}) AS updated, "
+            f"count(*) FILTER (WHERE t.{first_key} IS NOT NULL AND NOT ({changed})) AS unchanged"
+            f"{fields} "
+            f"FROM ({self._source_sql()}) s "
+            f"LEFT JOIN {self.spec.target} t ON {self._join_condition()}"
+        )
+    
+    def _sample_sql(self) -> str:
+        """Prima le righe aggiornate (solo le colonne che cambiano), poi quelle nuove"""
+        first_key = self.spec.key_columns[0]
+        changes = ", ".join(
+            f"'{column}', CASE WHEN {self._field_changed(column)} "
+            f"THEN jsonb_build_object('old', to_jsonb(t.{column}), 'new', to_jsonb(s.{column})) END"
+            for column in (*self.compare_columns, *self.fill_columns)
+        )
+        return (
+            f"SELECT s.external_id, t.id AS crm_id, jsonb_strip_nulls(jsonb_build_object({changes})) AS changes "
+            f"FROM ({self._source_sql()}) s "
+            f"LEFT JOIN {self.spec.target} t ON {self._join_condition()} "
+            f"WHERE t.{first_key} IS NULL OR {self._changed_condition()} "
+            f"ORDER BY t.{first_key} IS NULL, s.external_id "
+            f"LIMIT :limit"
+        )
@@ -0,0 +1,176 @@
+"""
+Checkpoint e ripresa delle sync di lunga durata.
+
+Ogni riga scaricata riceve uno slot progressivo per company; dopo ogni
+batch applicato si salva in sync_checkpoints la posizione (slot
+completati senza buchi dall'inizio dello stream, quindi mai oltre una
+riga ancora in volo nella pipeline), il filtro lastModifiedDateTime in
+uso e i contatori. Un job rilanciato con la stessa chiave (retry Celery:
+stesso task id) riparte da lì con $skip invece che da capo.
+
+La posizione è un offset nello stream filtrato: righe cancellate in BC
+durante il job spostano gli offset, per questo alla ripresa si torna
+indietro di una pagina (le righe rilette vengono scartate dal confronto
+hash).
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import sync_checkpoints
+from app.services.watermarks import parse_timestamp
+
+
+@dataclass
+class CompanyProgress:
+    """Stato dello stream di una company"""
+    since: Optional[datetime] = None  # Filtro lastModifiedDateTime (fisso per tutto il job)
+    position: int = 0  # Slot completati senza buchi
+    next_slot: int = 0  # Prossimo slot da assegnare
+    high_water: Optional[datetime] = None
+    exhausted: bool = False  # Stream letto fino in fondo
+    pending: Set[int] = field(default_factory=set)  # Slot completati oltre position
+    
+    @property
+    def done(self) -> bool:
+        """Company letta per intero e tutte le righe applicate"""
+        return self.exhausted and self.position == self.next_slot
+
+
+class StreamProgress:
+    """Posizione applicata degli stream per company"""
+    
+    def __init__(self):
+        self.companies: Dict[str, CompanyProgress] = {}
+    
+    def start(self, company_id: str, since: Optional[datetime]) -> CompanyProgress:
+        self.companies[company_id] = CompanyProgress(since=since)
+        return self.companies[company_id]
+    
+    def next_slot(self, company_id: str) -> int:
+        progress = self.companies[company_id]
+        slot = progress.next_slot
+        progress.next_slot += 1
+        return slot
+    
+    def skip(self, company_id: str, count: int):
+        """Consuma `count` slot già completati (righe scartate in decodifica)"""
+        for _ in range(count):
+            self.complete([(company_id, self.next_slot(company_id))])
+    
+    def complete(self, slots: Iterable[Tuple[str, int]]):
+        """Segna gli slot come applicati (o falliti) e avanza le posizioni"""
+        for company_id, slot in slots:
+            progress = self.companies[company_id]
+            progress.pending.add(slot)
+            while progress.position in progress.pending:
+                progress.pending.remove(progress.position)
+                progress.position += 1
+    
+    def observe(self, company_id: str, last_modified: Optional[datetime]):
+        """Aggiorna il massimo lastModifiedDateTime scaricato"""
+        progress = self.companies[company_id]
+        if last_modified and (progress.high_water is None or last_modified > progress.high_water):
+            progress.high_water = last_modified
+    
+    def completed_high_water(self) -> Dict[str, datetime]:
+        """High-water mark delle company completate"""
+        return {
+            company_id: progress.high_water
+            for company_id, progress in self.companies.items()
+            if progress.done and progress.high_water
+        }
+    
+    def state(self) -> Dict[str, Dict[str, Any]]:
+        """Stato serializzabile in JSON per il checkpoint"""
+        return {
+            company_id: {
+                "since": progress.since.isoformat() if progress.since else None,
+                "position": progress.position,
+                "done": progress.done,
+                "high_water": progress.high_water.isoformat() if progress.high_water else None,
+            }
+            for company_id, progress in self.companies.items()
+        }
+    
+    @classmethod
+    def from_state(cls, state: Dict[str, Dict[str, Any]], rewind: int = 0) -> "StreamProgress":
+        """Ricostruisce le posizioni da un checkpoint, arretrando di `rewind` le company non completate"""
+        stream = cls()
+        for company_id, saved in state.items():
+            position = saved["position"] if saved["done"] else max(saved["position"] - rewind, 0)
+            stream.companies[company_id] = CompanyProgress(
+                since=parse_timestamp(saved.get("since")),
+                position=position,
+                next_slot=position,
+                high_water=parse_timestamp(saved.get("high_water")),
+                exhausted=saved["done"],
+            )
+        return stream
+
+
+async def load_checkpoint(
+    db: AsyncSession,
+    job_key: str,
+    source: str,
+    entity_type: str,
+) -> Optional[Dict[str, Any]]:
+    """Stato salvato del job per source/entità, se presente"""
+    result = await db.execute(
+        select(sync_checkpoints.c.state).where(
+            sync_checkpoints.c.job_key == job_key,
+            sync_checkpoints.c.source == source,
+            sync_checkpoints.c.entity_type == entity_type,
+        )
+    )
+    return result.scalar_one_or_none()
+
+
+async def save_checkpoint(
+    db: AsyncSession,
+    job_key: str,
+    source: str,
+    entity_type: str,
+    state: Dict[str, Any],
+):
+    """Salva (sovrascrive) lo stato del job; il commit è del chiamante"""
+    stmt = pg_insert(sync_checkpoints).values(
+        job_key=job_key,
+        source=source,
+        entity_type=entity_type,
+        state=state,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[sync_checkpoints.c.job_key, sync_checkpoints.c.source, sync_checkpoints.c.entity_type],
+        set_={"state": stmt.excluded.state, "updated_at": func.now()},
+    )
+    await db.execute(stmt)
+
+
+async def clear_checkpoint(
+    db: AsyncSession,
+    job_key: str,
+    source: Optional[str] = None,
+    entity_type: Optional[str] = None,
+) -> int:
+    """Elimina i checkpoint del job (tutti, o di una source/entità)"""
+    query = delete(sync_checkpoints).where(sync_checkpoints.c.job_key == job_key)
+    if source:
+        query = query.where(sync_checkpoints.c.source == source)
+    if entity_type:
+        query = query.where(sync_checkpoints.c.entity_type == entity_type)
+    result = await db.execute(query)
+    return result.rowcount
+
+
+async def has_checkpoint(db: AsyncSession, job_key: str) -> bool:
+    """True se il job ha lasciato checkpoint da cui riprendere"""
+    result = await db.execute(
+        select(sync_checkpoints.c.job_key).where(sync_checkpoints.c.job_key == job_key).limit(1)
+    )
+    return result.first() is not None
@@ -0,0 +1,206 @@
+"""
+Indice in memoria delle aziende CRM per collegare i contatti sincronizzati.
+
+Caricato una volta per run con una sola query (stream a partizioni) e
+aggiornato con `add` quando la sync scrive aziende: ogni batch di
+contatti risolve company_id senza query aggiuntive.
+
+Chiavi, in ordine di affidabilità:
+- partita IVA / codice fiscale normalizzati (companies.tax_identifier)
+- dominio del sito (companies.website) confrontato col dominio email del
+  contatto, esclusi i provider di posta generici
+- nome normalizzato (minuscolo, senza accenti, punteggiatura e forma
+  giuridica: "ACME S.r.l." == "Acme srl" == "acme")
+
+Una chiave condivisa da più aziende è ambigua e non risolve nulla: meglio
+un contatto senza azienda che collegato a quella sbagliata.
+"""
+
+import re
+import unicodedata
+from typing import Dict, Optional, Set, Tuple, Union
+from urllib.parse import urlsplit
+
+import structlog
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import companies
+
+logger = structlog.get_logger()
+
+# Forme giuridiche ignorate nel confronto dei nomi (dopo la normalizzazione)
+LEGAL_FORMS = frozenset({
+    "srl", "srls", "spa", "sapa", "snc", "sas", "scarl", "scrl", "coop", "onlus",
+    "gmbh", "ag", "kg", "ltd", "limited", "plc", "llc", "inc", "corp", "co",
+    "sa", "sl", "sarl", "bv", "nv",
+})
+
+# Domini email che non identificano un'azienda
+FREE_MAIL_DOMAINS = frozenset({
+    "gmail.com", "googlemail.com", "outlook.com", "hotmail.com", "hotmail.it",
+    "live.com", "live.it", "msn.com", "yahoo.com", "yahoo.it", "icloud.com",
+    "me.com", "aol.com", "libero.it", "virgilio.it", "tiscali.it", "alice.it",
+    "tim.it", "fastwebnet.it", "email.it", "pec.it", "legalmail.it", "gmx.com",
+    "gmx.net", "proton.me", "protonmail.com",
+})
+
+# Prefisso paese delle partite IVA UE (IT01234567890 == 01234567890)
+_VAT_COUNTRY_PREFIX = re.compile(r"^[A-Z]{2}(?=\d)")
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+CompanyIds = Union[int, Set[int]]
+
+
+def normalize_company_name(name: Optional[str]) -> Optional[str]:
+    """Nome confrontabile: minuscolo, senza accenti, punteggiatura e forma giuridica"""
+    if not name:
+        return None
+    ascii_name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode().lower()
+    # "s.r.l." → "srl" prima di separare le parole
+    ascii_name = ascii_name.replace(".", "")
+    words = [word for word in _NON_ALNUM.split(ascii_name) if word]
+    while len(words) > 1 and words[-1] in LEGAL_FORMS:
+        words.pop()
+    return " ".join(words) or None
+
+
+def normalize_vat(value: Optional[str]) -> Optional[str]:
+    """Partita IVA / codice fiscale senza spazi, punteggiatura e prefisso paese"""
+    if not value:
+        return None
+    vat = re.sub(r"[^0-9A-Z]", "", value.upper())
+    return _VAT_COUNTRY_PREFIX.sub("", vat) or None
+
+
+def website_domain(url: Optional[str]) -> Optional[str]:
+    """Dominio di un sito ("https://www.acme.it/contatti" → "acme.it")"""
+    if not url:
+        return None
+    url = url.strip().lower()
+    host = urlsplit(url if "//" in url else f"//{url}").hostname
+    if not host or "." not in host:
+        return None
+    return host[4:] if host.startswith("www.") else host
+
+
+def email_domain(email: Optional[str]) -> Optional[str]:
+    """Dominio aziendale di un indirizzo email (None per i provider generici)"""
+    if not email or "@" not in email:
+        return None
+    domain = email.rsplit("@", 1)[1].strip().lower()
+    if not domain or domain in FREE_MAIL_DOMAINS:
+        return None
+    return domain
+
+
+class CompanyIndex:
+    """
+    Chiavi normalizzate → companies.id.
+    
+    Uso:
+        index = await CompanyIndex.load(db)
+        company_id = index.resolve(vat=..., email=..., name=...)
+        index.add(company_id, name, website, tax_identifier)  # dopo un upsert
+    """
+    
+    KINDS = ("vat", "domain", "name")
+    
+    def __init__(self):
+        # Un id per chiave; un set solo per le chiavi ambigue (poche)
+        self._keys: Dict[str, Dict[str, CompanyIds]] = {kind: {} for kind in self.KINDS}
+        # Chiavi attuali di ogni azienda, per sostituirle quando cambia
+        self._companies: Dict[int, Tuple[Optional[str], ...]] = {}
+        self.stats = {"resolved": 0, "unresolved": 0, **{f"by_{kind}": 0 for kind in self.KINDS}}
+    
+    @classmethod
+    async def load(cls, db: AsyncSession, partition_size: int = 10000) -> "CompanyIndex":
+        """Carica tutte le aziende con una query (cursore lato server, a partizioni)"""
+        index = cls()
+        result = await db.stream(
+            select(companies.c.id, companies.c.name, companies.c.website, companies.c.tax_identifier)
+            .execution_options(yield_per=partition_size)
+        )
+        async for rows in result.partitions():
+            for row in rows:
+                index.add(row.id, row.name, row.website, row.tax_identifier)
+        logger.info("company_index.loaded", companies=len(index), **index.key_counts())
+        return index
+    
+    def __len__(self) -> int:
+        return len(self._companies)
+    
+    def key_counts(self) -> Dict[str, int]:
+        return {f"{kind}_keys": len(self._keys[kind]) for kind in self.KINDS}
+    
+    def add(
+        self,
+        company_id: int,
+        name: Optional[str] = None,
+        website: Optional[str] = None,
+        tax_identifier: Optional[str] = None,
+    ):
+        """Indicizza (o reindicizza) un'azienda appena letta o scritta"""
+        self.remove(company_id)
+        keys = (normalize_vat(tax_identifier), website_domain(website), normalize_company_name(name))
+        self._companies[company_id] = keys
+        for kind, key in zip(self.KINDS, keys):
+            if key:
+                self._put(self._keys[kind], key, company_id)
+    
+    def remove(self, company_id: int):
+        """Toglie un'azienda dall'indice (eliminata o unita a un'altra)"""
+        keys = self._companies.pop(company_id, None)
+        if keys is None:
+            return
+        for kind, key in zip(self.KINDS, keys):
+            if key:
+                self._drop(self._keys[kind], key, company_id)
+    
+    def resolve(
+        self,
+        vat: Optional[str] = None,
+        email: Optional[str] = None,
+        name: Optional[str] = None,
+    ) -> Optional[int]:
+        """Azienda della prima chiave non ambigua (IVA, dominio email, nome), se esiste"""
+        keys = (normalize_vat(vat), email_domain(email), normalize_company_name(name))
+        for kind, key in zip(self.KINDS, keys):
+            match = self._keys[kind].get(key) if key else None
+            if isinstance(match, int):
+                self.stats["resolved"] += 1
+                self.stats[f"by_{kind}"] += 1
+                return match
+        self.stats["unresolved"] += 1
+        return None
+    
+    def by_vat(self, vat: Optional[str]) -> Optional[int]:
+        """
+        Azienda con la partita IVA (sync aziende): la stessa IVA è lo stesso
+        soggetto, quindi con più aziende CRM vince la più vecchia (id minore)
+        """
+        key = normalize_vat(vat)
+        match = self._keys["vat"].get(key) if key else None
+        if isinstance(match, set):
+            return min(match)
+        return match
+    
+    @staticmethod
+    def _put(keys: Dict[str, CompanyIds], key: str, company_id: int):
+        current = keys.get(key)
+        if current is None or current == company_id:
+            keys[key] = company_id
+        elif isinstance(current, set):
+            current.add(company_id)
+        else:
+            keys[key] = {current, company_id}
+    
+    @staticmethod
+    def _drop(keys: Dict[str, CompanyIds], key: str, company_id: int):
+        current = keys.get(key)
+        if isinstance(current, set):
+            current.discard(company_id)
+            if len(current) == 1:
+                keys[key] = next(iter(current))
+        elif current == company_id:
+            del keys[key]
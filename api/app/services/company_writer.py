@@ -0,0 +1,209 @@
+"""
+Scrittura batch delle aziende sincronizzate (fornitori e clienti BC di
+tipo Company).
+
+companies non ha una chiave esterna: i record BC sono collegati alle
+aziende CRM tramite sync_links (entity_type "company") e la partita IVA
+identifica il soggetto, così un fornitore che è anche cliente, o presente
+in più company BC, finisce su una sola azienda. Per batch:
+
+1. link caricati con una query (cache del motore), righe con hash
+   invariato scartate
+2. righe senza link risolte per partita IVA su CompanyIndex (aziende CRM
+   esistenti e create nei batch precedenti), le altre raggruppate per IVA
+3. un INSERT per le aziende nuove (id presi prima dalla sequence), un
+   UPDATE ... FROM unnest per quelle esistenti, un upsert dei link
+
+Le colonne scritte sono i target del mapping attivo (entità "company",
+vedi app.services.field_mapping). I valori BC non azzerano mai i campi CRM
+(COALESCE): un record senza telefono non cancella quello inserito a mano o
+arrivato da un altro record.
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import companies as companies_table
+from app.services.company_index import CompanyIndex, normalize_vat
+from app.services.link_cache import SyncLink, SyncLinkCache
+
+LINK_ENTITY_TYPE = "company"
+
+
+@dataclass
+class CompanyPlan:
+    """Cosa farebbe un batch: aziende da creare, da aggiornare, link da salvare"""
+    # Gruppi di righe (stessa IVA) → una nuova azienda ciascuno
+    inserts: List[List[Dict[str, Any]]] = field(default_factory=list)
+    # Azienda CRM → righe da applicare
+    updates: Dict[int, List[Dict[str, Any]]] = field(default_factory=dict)
+    unchanged: int = 0
+    # Righe senza link collegate a un'azienda per partita IVA
+    vat_matches: int = 0
+    # Contenuto invariato ma nuovo ETag: si aggiorna solo la versione del link
+    stale: Dict[str, SyncLink] = field(default_factory=dict)
+    
+    @property
+    def created(self) -> int:
+        return len(self.inserts)
+    
+    @property
+    def updated(self) -> int:
+        return sum(len(group) for group in self.updates.values())
+
+
+def _dedupe(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Una riga per record esterno (vince l'ultima)"""
+    return list({row["external_id"]: row for row in rows}.values())
+
+
+def _merge_values(rows: Sequence[Dict[str, Any]], columns: Sequence[str]) -> Dict[str, Any]:
+    """Valori di più record per la stessa azienda: per colonna l'ultimo non vuoto"""
+    merged: Dict[str, Any] = {column: None for column in columns}
+    for row in rows:
+        for column in columns:
+            if row.get(column) is not None:
+                merged[column] = row[column]
+    return merged
+
+
+async def plan_companies(
+    db: AsyncSession,
+    rows: List[Dict[str, Any]],
+    links: SyncLinkCache,
+    index: CompanyIndex,
+) -> CompanyPlan:
+    """
+    Confronta un batch con link e indice aziende (una query per i link,
+    nessuna scrittura): usato anche dal dry_run.
+    
+    Args:
+        rows: righe con le colonne mappate (tax_identifier per la
+            deduplica), external_source, external_id, external_hash ed
+            external_version, tutte dello stesso external_source
+    """
+    plan = CompanyPlan()
+    rows = _dedupe(rows)
+    if not rows:
+        return plan
+    
+    source = rows[0]["external_source"]
+    await links.warm(db, source, LINK_ENTITY_TYPE, (row["external_id"] for row in rows))
+    
+    new_groups: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        link = links.get(source, LINK_ENTITY_TYPE, row["external_id"])
+        if link is not None and link.hash == row["external_hash"]:
+            plan.unchanged += 1
+            if row["external_version"] and link.version != row["external_version"]:
+                plan.stale[row["external_id"]] = SyncLink(link.crm_id, row["external_version"], link.hash)
+            continue
+        if link is not None:
+            plan.updates.setdefault(link.crm_id, []).append(row)
+            continue
+        
+        vat = normalize_vat(row.get("tax_identifier"))
+        crm_id = index.by_vat(vat)
+        if crm_id is not None:
+            plan.vat_matches += 1
+            plan.updates.setdefault(crm_id, []).append(row)
+        elif vat:
+            if vat in new_groups:
+                plan.vat_matches += 1
+            new_groups.setdefault(vat, []).append(row)
+        else:
+            new_groups[f"id:{row['external_id']}"] = [row]
+    
+    plan.inserts = list(new_groups.values())
+    return plan
+
+
+async def apply_companies(
+    db: AsyncSession,
+    plan: CompanyPlan,
+    links: SyncLinkCache,
+    source: str,
+    columns: Sequence[str],
+) -> List[Any]:
+    """
+    Scrive un piano: nuove aziende, aggiornamenti e link.
+    
+    Args:
+        columns: colonne di companies scritte (target del mapping attivo)
+    
+    Returns:
+        Aziende scritte (id, name, website, tax_identifier), da aggiungere
+        a CompanyIndex dopo il commit
+    """
+    written: Dict[int, List[Dict[str, Any]]] = {}
+    companies: List[Any] = []
+    
+    if plan.inserts:
+        # id assegnati prima dell'INSERT: ogni gruppo sa subito la sua azienda
+        ids = (await db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('public.companies', 'id')) FROM generate_series(1, :count)"),
+            {"count": len(plan.inserts)},
+        )).scalars().all()
+        inserts = dict(zip(ids, plan.inserts))
+        written.update(inserts)
+        companies.extend(await _insert(db, {
+            company_id: _merge_values(group, columns) for company_id, group in inserts.items()
+        }, columns))
+    if plan.updates:
+        written.update(plan.updates)
+        companies.extend(await _update(db, {
+            company_id: _merge_values(group, columns) for company_id, group in plan.updates.items()
+        }, columns))
+    
+    await links.save(db, source, LINK_ENTITY_TYPE, {
+        **plan.stale,
+        **{
+            row["external_id"]: SyncLink(crm_id=company_id, version=row["external_version"], hash=row["external_hash"])
+            for company_id, group in written.items()
+            for row in group
+        },
+    })
+    return companies
+
+
+def _unnest(values: Dict[int, Dict[str, Any]], columns: Sequence[str]) -> Tuple[str, Dict[str, Any]]:
+    """FROM unnest(...) AS v(id, colonne...) con un array per colonna (tipo della colonna)"""
+    dialect = postgresql.dialect()
+    arrays = ", ".join(
+        f"CAST(:{column} AS {companies_table.c[column].type.compile(dialect=dialect)}[])" for column in columns
+    )
+    sql = f"unnest(CAST(:ids AS bigint[]), {arrays}) AS v(id, {', '.join(columns)})"
+    params: Dict[str, Any] = {"ids": list(values)}
+    for column in columns:
+        params[column] = [row[column] for row in values.values()]
+    return sql, params
+
+
+async def _insert(db: AsyncSession, values: Dict[int, Dict[str, Any]], columns: Sequence[str]) -> List[Any]:
+    source, params = _unnest(values, columns)
+    names = ", ".join(("id", *columns))
+    result = await db.execute(
+        text(
+            f"INSERT INTO companies ({names}) SELECT {names} FROM {source} "
+            f"RETURNING id, name, website, tax_identifier"
+        ),
+        params,
+    )
+    return result.all()
+
+
+async def _update(db: AsyncSession, values: Dict[int, Dict[str, Any]], columns: Sequence[str]) -> List[Any]:
+    source, params = _unnest(values, columns)
+    updates = ", ".join(f"{column} = COALESCE(v.{column}, c.{column})" for column in columns)
+    result = await db.execute(
+        text(
+            f"UPDATE companies c SET {updates} FROM {source} WHERE c.id = v.id "
+            f"RETURNING c.id, c.name, c.website, c.tax_identifier"
+        ),
+        params,
+    )
+    return result.all()
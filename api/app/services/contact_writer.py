@@ -0,0 +1,178 @@
+"""
+Scrittura batch dei contatti sincronizzati.
+
+Un'unica INSERT ... ON CONFLICT (external_source, external_id) DO UPDATE
+per batch al posto di lookup + INSERT/UPDATE per riga: RETURNING
+(xmax = 0) distingue le righe inserite da quelle aggiornate.
+
+I link external_id → contacts.id (con hash e versione) stanno in
+sync_links: la cache del motore li carica con una query per batch, le
+righe con hash invariato vengono scartate prima dell'upsert e i link
+delle righe scritte aggiornati con un solo statement.
+
+Le righe senza link che trovano un contatto (external_id assegnato dalla
+deduplica) lo adottano senza sovrascriverlo: i campi CRM già valorizzati
+restano, email e telefoni vengono uniti (public.union_email_jsonb /
+union_phone_jsonb). Dal link in poi valgono le colonne del mapping.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, literal_column
+from sqlalchemy.dialects.postgresql import JSONB, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import contacts
+from app.services.link_cache import SyncLink, SyncLinkCache
+
+# Colonne di sync sempre aggiornate insieme a quelle del mapping
+SYNC_UPDATE_COLUMNS = ("external_data", "last_synced_at")
+
+# Colonne sovrascritte quando il contatto esiste già (mapping di default):
+# i campi non mappati, gestiti solo nel CRM (tags, status, background, ...),
+# non vengono toccati
+UPSERT_UPDATE_COLUMNS = (
+    "first_name",
+    "last_name",
+    "email_jsonb",
+    "phone_jsonb",
+    *SYNC_UPDATE_COLUMNS,
+)
+
+# Colonne risolte dalla sync (company_id dall'indice aziende): sui
+# contatti esistenti vengono scritte solo se risolte, mai azzerate
+FILL_COLUMNS = ("company_id",)
+
+# Colonne jsonb unite (non sostituite) quando la sync adotta un contatto CRM
+UNION_COLUMNS = {
+    "email_jsonb": "union_email_jsonb",
+    "phone_jsonb": "union_phone_jsonb",
+}
+
+# Campi della riga salvati in sync_links e non in contacts
+LINK_FIELDS = ("external_hash", "external_version")
+LINK_ENTITY_TYPE = "contact"
+
+
+def _dedupe(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Una riga per chiave esterna (vince l'ultima): ON CONFLICT DO UPDATE
+    non può aggiornare la stessa riga due volte nello stesso statement.
+    """
+    by_key = {(row["external_source"], row["external_id"]): row for row in rows}
+    return list(by_key.values())
+
+
+async def upsert_contacts(
+    db: AsyncSession,
+    rows: List[Dict[str, Any]],
+    links: SyncLinkCache,
+    update_columns: Sequence[str] = UPSERT_UPDATE_COLUMNS,
+    fill_columns: Sequence[str] = (),
+    before_insert: Optional[Callable[[List[Dict[str, Any]]], Awaitable[Any]]] = None,
+) -> Tuple[int, int, int]:
+    """
+    Inserisce o aggiorna un batch di contatti per (external_source, external_id),
+    saltando quelli con hash invariato in sync_links.
+    
+    Args:
+        rows: righe con le colonne di `contacts` più external_hash ed
+            external_version, tutte con le stesse chiavi e lo stesso external_source
+        links: cache dei link, caricata con una query per batch
+        update_columns: colonne aggiornate sui contatti esistenti (quelle mappate)
+        fill_columns: colonne aggiornate solo con un valore non NULL
+        before_insert: chiamato prima dell'upsert con le righe senza link
+            (es. per collegarle a contatti CRM già esistenti)
+    
+    Returns:
+        (creati, aggiornati, invariati)
+    """
+    rows = _dedupe(rows)
+    if not rows:
+        return 0, 0, 0
+    
+    source = rows[0]["external_source"]
+    await links.warm(db, source, LINK_ENTITY_TYPE, (row["external_id"] for row in rows))
+    
+    changed = []
+    unlinked = []
+    # Contenuto invariato ma nuovo ETag (campi non scaricati): si aggiorna
+    # solo la versione del link, usata per If-Match e riconciliazione
+    stale: Dict[str, SyncLink] = {}
+    for row in rows:
+        link = links.get(source, LINK_ENTITY_TYPE, row["external_id"])
+        if link is None:
+            unlinked.append(row)
+        if link is None or link.hash != row["external_hash"]:
+            changed.append(row)
+        elif row["external_version"] and link.version != row["external_version"]:
+            stale[row["external_id"]] = SyncLink(crm_id=link.crm_id, version=row["external_version"], hash=link.hash)
+    if not changed:
+        await links.save(db, source, LINK_ENTITY_TYPE, stale)
+        return 0, 0, len(rows)
+    if unlinked and before_insert:
+        await before_insert(unlinked)
+    
+    # Con link: aggiornamento dal mapping; senza link un conflitto è un
+    # contatto CRM adottato (deduplica), scritto senza perdere dati
+    linked_ids = {row["external_id"] for row in changed} - {row["external_id"] for row in unlinked}
+    result = []
+    for adopt in (False, True):
+        batch = [row for row in changed if (row["external_id"] not in linked_ids) == adopt]
+        if batch:
+            stmt = _upsert_statement(batch, update_columns, fill_columns, adopt)
+            result.extend((await db.execute(stmt)).all())
+    created = sum(1 for row in result if row.inserted)
+    
+    by_external_id = {row["external_id"]: row for row in changed}
+    await links.save(db, source, LINK_ENTITY_TYPE, {
+        **stale,
+        **{
+            row.external_id: SyncLink(
+                crm_id=row.id,
+                version=by_external_id[row.external_id]["external_version"],
+                hash=by_external_id[row.external_id]["external_hash"],
+            )
+            for row in result
+        },
+    })
+    
+    return created, len(result) - created, len(rows) - len(changed)
+
+
+def _upsert_statement(
+    rows: List[Dict[str, Any]],
+    update_columns: Sequence[str],
+    fill_columns: Sequence[str],
+    adopt: bool,
+):
+    """INSERT ... ON CONFLICT DO UPDATE del batch (RETURNING id, external_id, inserted)"""
+    stmt = pg_insert(contacts).values([
+        {key: value for key, value in row.items() if key not in LINK_FIELDS}
+        for row in rows
+    ])
+    if adopt:
+        set_ = {column: _adopt_value(stmt, column) for column in (*update_columns, *fill_columns)}
+    else:
+        set_ = {
+            **{column: stmt.excluded[column] for column in update_columns},
+            **{column: func.coalesce(stmt.excluded[column], contacts.c[column]) for column in fill_columns},
+        }
+    return stmt.on_conflict_do_update(
+        index_elements=[contacts.c.external_source, contacts.c.external_id],
+        set_=set_,
+    ).returning(
+        contacts.c.id,
+        contacts.c.external_id,
+        literal_column("(xmax = 0)").label("inserted"),
+    )
+
+
+def _adopt_value(stmt, column: str):
+    """Valore di una colonna per un contatto CRM adottato: vince il CRM, email e telefoni uniti"""
+    if column in SYNC_UPDATE_COLUMNS:
+        return stmt.excluded[column]
+    if column in UNION_COLUMNS:
+        union = getattr(func.public, UNION_COLUMNS[column])
+        return union(contacts.c[column], stmt.excluded[column], type_=JSONB)
+    return func.coalesce(contacts.c[column], stmt.excluded[column])
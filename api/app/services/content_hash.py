@@ -0,0 +1,30 @@
+"""
+Hash del contenuto dei record sincronizzati.
+
+Il hash (sha256 del JSON canonico dei campi mappati) viene salvato con
+il record: se alla sync successiva coincide, la scrittura viene saltata.
+Si usa sempre json della stdlib con chiavi ordinate, così il hash non
+cambia a seconda che orjson sia installato o meno.
+"""
+
+import hashlib
+import json
+from typing import Any, Iterable, Mapping
+
+
+def canonical_json(value: Any) -> str:
+    """JSON deterministico: chiavi ordinate, separatori compatti"""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def content_hash(values: Mapping[str, Any], exclude: Iterable[str] = ()) -> str:
+    """
+    Hash stabile di un record.
+    
+    Args:
+        values: campi mappati del record
+        exclude: chiavi da ignorare (timestamp di sync, ETag, ...)
+    """
+    excluded = set(exclude)
+    payload = {key: value for key, value in values.items() if key not in excluded}
+    return hashlib.sha256(canonical_json(payload).encode()).hexdigest()
@@ -0,0 +1,216 @@
+"""
+Rilevamento duplicati per chiavi di blocking durante la sync in ingresso.
+
+I record esterni senza link vengono confrontati solo con i contatti CRM
+che condividono almeno una chiave (email normalizzata, telefono E.164,
+nome + azienda), non con tutti: una query per batch sugli indici di
+espressione di 20261017170000_contacts_dedup_keys.sql (&& sugli array di
+chiavi, = ANY sulla chiave nome), poi il confronto avviene in memoria. Il
+costo cresce con le righe sincronizzate, non con i contatti esistenti.
+
+Le normalizzazioni replicano le funzioni SQL (normalize_email,
+normalize_phone, contact_name_key): devono restare allineate.
+
+Modalità (DedupMode):
+- link: il contatto esistente riceve external_source/external_id e
+  l'upsert lo aggiorna invece di crearne uno nuovo
+- merge: il contatto sincronizzato viene creato e il duplicato CRM vi
+  viene unito con merge_contacts (task, note, deal, email, tag)
+- report: i candidati finiscono solo nel risultato della sync
+"""
+
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import structlog
+from sqlalchemy import Text, any_, bindparam, func, or_, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import contacts
+
+logger = structlog.get_logger()
+
+# Prefisso dei numeri senza '+'/'00' (come in public.normalize_phone)
+DEFAULT_PHONE_PREFIX = "+39"
+MIN_PHONE_DIGITS = 6
+
+# Candidati riportati nel risultato della sync (modalità report)
+REPORT_LIMIT = 1000
+
+_NON_DIGITS = re.compile(r"[^0-9]")
+
+# Funzioni SQL delle chiavi (stesse espressioni degli indici)
+_email_keys = func.public.contact_email_keys(contacts.c.email_jsonb)
+_phone_keys = func.public.contact_phone_keys(contacts.c.phone_jsonb)
+_name_key = func.public.contact_name_key(contacts.c.first_name, contacts.c.last_name, contacts.c.company_id)
+
+KEY_KINDS = ("email", "phone", "name")
+
+
+def normalize_email(email: Optional[str]) -> Optional[str]:
+    """Come public.normalize_email"""
+    return (email or "").strip(" ").lower() or None
+
+
+def normalize_phone(number: Optional[str]) -> Optional[str]:
+    """Come public.normalize_phone: E.164, prefisso italiano di default"""
+    digits = _NON_DIGITS.sub("", number or "")
+    if len(digits) < MIN_PHONE_DIGITS:
+        return None
+    if (number or "").strip(" ").startswith("+"):
+        return f"+{digits}"
+    if digits.startswith("00"):
+        return f"+{digits[2:]}"
+    return f"{DEFAULT_PHONE_PREFIX}{digits}"
+
+
+def name_key(first_name: Optional[str], last_name: Optional[str], company_id: Optional[int]) -> Optional[str]:
+    """Come public.contact_name_key: nome e cognome nella stessa azienda"""
+    first = (first_name or "").strip(" ")
+    last = (last_name or "").strip(" ")
+    if company_id is None or not (first or last):
+        return None
+    return f"{first.lower()}|{last.lower()}|{company_id}"
+
+
+def blocking_keys(row: Dict[str, Any]) -> Tuple[Set[str], Set[str], Optional[str]]:
+    """Chiavi di blocking di una riga contacts (email, telefoni, nome)"""
+    emails = {normalize_email(item.get("email")) for item in row.get("email_jsonb") or []} - {None}
+    phones = {normalize_phone(item.get("number")) for item in row.get("phone_jsonb") or []} - {None}
+    return emails, phones, name_key(row.get("first_name"), row.get("last_name"), row.get("company_id"))
+
+
+@dataclass(frozen=True)
+class DuplicateMatch:
+    """Contatto CRM esistente che corrisponde a un record esterno"""
+    external_id: str
+    contact_id: int
+    key: str  # email | phone | name
+    
+    def as_dict(self) -> Dict[str, Any]:
+        return {"external_id": self.external_id, "contact_id": self.contact_id, "key": self.key}
+
+
+async def find_duplicates(
+    db: AsyncSession,
+    rows: Sequence[Dict[str, Any]],
+    stats: Dict[str, int],
+    lock: bool = False,
+) -> List[DuplicateMatch]:
+    """
+    Contatti CRM non collegati che corrispondono alle righe (una query).
+    
+    Per ogni riga vince la chiave più affidabile (email, poi telefono, poi
+    nome + azienda); una chiave condivisa da più contatti è ambigua e non
+    produce match, e ogni contatto viene assegnato a una sola riga.
+    
+    Args:
+        rows: righe contacts senza link (external_id, email_jsonb, ...)
+        stats: contatori candidates/matched/ambiguous aggiornati
+        lock: blocca i candidati fino al commit (FOR UPDATE SKIP LOCKED):
+            batch concorrenti non collegano né uniscono lo stesso contatto
+    """
+    keys = {row["external_id"]: blocking_keys(row) for row in rows}
+    emails = sorted({key for row_keys in keys.values() for key in row_keys[0]})
+    phones = sorted({key for row_keys in keys.values() for key in row_keys[1]})
+    names = sorted({row_keys[2] for row_keys in keys.values() if row_keys[2]})
+    if not (emails or phones or names):
+        return []
+    
+    conditions = []
+    if emails:
+        conditions.append(_email_keys.op("&&")(bindparam("emails", emails, type_=ARRAY(Text))))
+    if phones:
+        conditions.append(_phone_keys.op("&&")(bindparam("phones", phones, type_=ARRAY(Text))))
+    if names:
+        conditions.append(_name_key == any_(bindparam("names", names, type_=ARRAY(Text))))
+    query = select(
+        contacts.c.id,
+        _email_keys.label("emails"),
+        _phone_keys.label("phones"),
+        _name_key.label("name_key"),
+    ).where(contacts.c.external_id.is_(None), or_(*conditions))
+    if lock:
+        query = query.with_for_update(skip_locked=True)
+    result = await db.execute(query)
+    
+    # Chiave → contatti candidati, in memoria
+    index: Dict[str, Dict[str, Set[int]]] = {kind: {} for kind in KEY_KINDS}
+    for candidate in result:
+        stats["candidates"] += 1
+        for kind, values in zip(KEY_KINDS, (candidate.emails or (), candidate.phones or (), (candidate.name_key,))):
+            for value in values:
+                if value:
+                    index[kind].setdefault(value, set()).add(candidate.id)
+    
+    matches: List[DuplicateMatch] = []
+    claimed: Set[int] = set()
+    for external_id, row_keys in keys.items():
+        match = _best_match(external_id, row_keys, index, claimed, stats)
+        if match:
+            claimed.add(match.contact_id)
+            matches.append(match)
+    stats["matched"] += len(matches)
+    return matches
+
+
+def _best_match(
+    external_id: str,
+    row_keys: Tuple[Set[str], Set[str], Optional[str]],
+    index: Dict[str, Dict[str, Set[int]]],
+    claimed: Set[int],
+    stats: Dict[str, int],
+) -> Optional[DuplicateMatch]:
+    """Primo tipo di chiave con un solo contatto candidato"""
+    emails, phones, name = row_keys
+    for kind, values in zip(KEY_KINDS, (emails, phones, (name,) if name else ())):
+        found: Set[int] = set()
+        for value in values:
+            found |= index[kind].get(value, set())
+        found -= claimed
+        if len(found) == 1:
+            return DuplicateMatch(external_id, found.pop(), kind)
+        if len(found) > 1:
+            stats["ambiguous"] += 1
+            return None
+    return None
+
+
+async def link_duplicates(db: AsyncSession, source: str, matches: Iterable[DuplicateMatch]) -> int:
+    """Assegna ai contatti esistenti la chiave esterna: l'upsert li aggiornerà"""
+    params = [
+        {"contact_id": match.contact_id, "link_source": source, "link_external_id": match.external_id}
+        for match in matches
+    ]
+    if not params:
+        return 0
+    await db.execute(
+        update(contacts)
+        .where(contacts.c.id == bindparam("contact_id"), contacts.c.external_id.is_(None))
+        .values(external_source=bindparam("link_source"), external_id=bindparam("link_external_id")),
+        params,
+    )
+    return len(params)
+
+
+async def merge_duplicates(db: AsyncSession, pairs: Sequence[Tuple[int, int]]) -> int:
+    """
+    Unisce i duplicati CRM nei contatti sincronizzati con merge_contacts
+    (una chiamata per coppia, nello stesso statement).
+    
+    Args:
+        pairs: (duplicato CRM eliminato, contatto sincronizzato che resta)
+    """
+    if not pairs:
+        return 0
+    losers, winners = zip(*pairs)
+    await db.execute(
+        text(
+            "SELECT public.merge_contacts(m.loser_id, m.winner_id) "
+            "FROM unnest(CAST(:losers AS bigint[]), CAST(:winners AS bigint[])) AS m(loser_id, winner_id)"
+        ),
+        {"losers": list(losers), "winners": list(winners)},
+    )
+    return len(pairs)
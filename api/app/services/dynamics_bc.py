@@ -6,23 +6,128 @@ Documentazione:
 https://learn.microsoft.com/en-us/dynamics365/business-central/dev-itpro/api-reference/v2.0/
 """
 
+import asyncio
 import httpx
-from typing import Optional, List, Dict, Any, AsyncGenerator
-from datetime import datetime
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+from pydantic import BaseModel
+from typing import Optional, List, Dict, Any, AsyncGenerator, Iterable, Tuple, Type, TypeVar
+from datetime import datetime, timezone
+import time
 import base64
 import structlog
 
 from app.config import get_settings
-from app.models.schemas import DynamicsBCCustomer, DynamicsBCVendor
+from app.models.schemas import (
+    BC_CUSTOMER_PROPERTIES, BC_VENDOR_PROPERTIES,
+    DynamicsBCCustomer, DynamicsBCVendor, DynamicsBCRecordVersion,
+    DynamicsBCCustomerWrite, DynamicsBCBatchOperation, DynamicsBCBatchResult,
+)
+from app.services.odata import DecodedPage, get_page_decoder
+from app.services.http_pool import build_http_client, get_http_pool
+from app.services.rate_limit import get_rate_limiter, parse_retry_after
+from app.services.token_cache import TokenCache, get_token_cache
 
 logger = structlog.get_logger()
 
+BC_OAUTH_SCOPE = "https://api.businesscentral.dynamics.com/.default"
+DEFAULT_TOKEN_URL = "https://login.microsoftonline.com/{tenant}/oauth2/v2.0/token"
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+THROTTLE_STATUS_CODES = {429, 503}
+TRANSIENT_STATUS_CODES = {500, 502, 504}
+
+# Limite operazioni per richiesta $batch imposto da BC
+BC_BATCH_MAX_OPERATIONS = 100
+
+# Righe non valide conservate per il report del job (le altre sono solo contate)
+MAX_KEPT_PARSE_ERRORS = 100
+
+T = TypeVar("T", DynamicsBCCustomer, DynamicsBCVendor, DynamicsBCRecordVersion)
+
 
 class DynamicsBCError(Exception):
     """Errore API Dynamics BC"""
     pass
 
 
+class DynamicsBCTransientError(DynamicsBCError):
+    """Errore temporaneo lato BC (5xx), ripetibile per richieste idempotenti"""
+    pass
+
+
+class DynamicsBCConnectionError(DynamicsBCTransientError):
+    """Errore di rete (connessione, timeout, TLS) prima di una risposta BC"""
+    pass
+
+
+class DynamicsBCThrottled(DynamicsBCError):
+    """BC ha rifiutato la richiesta per throttling (429/503)"""
+    
+    def __init__(self, status_code: int, retry_after: Optional[float], message: str = ""):
+        super().__init__(f"Throttled ({status_code}), retry after {retry_after}s: {message}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+# Campi sempre necessari: chiavi, watermark incrementale
+BC_SYSTEM_FIELDS = ("id", "number", "lastModifiedDateTime")
+
+# Proprietà BC ammesse in $select per modello
+BC_MODEL_PROPERTIES: Dict[Type[BaseModel], frozenset] = {
+    DynamicsBCCustomer: BC_CUSTOMER_PROPERTIES,
+    DynamicsBCVendor: BC_VENDOR_PROPERTIES,
+}
+
+
+def model_aliases(model: Type[BaseModel]) -> List[str]:
+    """Nomi campo BC (alias) di un modello"""
+    return [f.alias or name for name, f in model.model_fields.items() if not (f.alias or "").startswith("@")]
+
+
+def select_fields(model: Type[BaseModel], fields: Iterable[str]) -> List[str]:
+    """
+    Lista $select per `model`: campi di sistema, campi obbligatori del
+    modello e i campi BC richiesti (es. dal mapping attivo).
+    L'@odata.etag viene restituito da BC anche con $select.
+    
+    Raises:
+        DynamicsBCError: campi che non sono proprietà dell'entità BC (BC
+            rifiuterebbe l'intera richiesta con 400)
+    """
+    required = [f.alias or name for name, f in model.model_fields.items() if f.is_required()]
+    selected: List[str] = []
+    for field in (*BC_SYSTEM_FIELDS, *required, *fields):
+        if field and not field.startswith("@") and field not in selected:
+            selected.append(field)
+    properties = BC_MODEL_PROPERTIES.get(model)
+    unknown = [field for field in selected if properties is not None and field not in properties]
+    if unknown:
+        raise DynamicsBCError(f"Unknown {model.__name__} properties in $select: {', '.join(unknown)}")
+    return selected
+
+
+class CompanyDirectory:
+    """Cache TTL delle company BC per ambiente, condivisa tra i client"""
+    
+    def __init__(self):
+        self._entries: Dict[str, Tuple[float, List[Dict[str, Any]]]] = {}
+    
+    def get(self, key: str, ttl: int) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] < ttl:
+            return entry[1]
+        return None
+    
+    def set(self, key: str, companies: List[Dict[str, Any]]):
+        self._entries[key] = (time.monotonic(), companies)
+    
+    def clear(self):
+        self._entries.clear()
+
+
+_company_directory = CompanyDirectory()
+
+
 class DynamicsBCClient:
     """Client per API Dynamics 365 Business Central"""
     
@@ -34,6 +139,7 @@ class DynamicsBCClient:
         client_id: Optional[str] = None,
         client_secret: Optional[str] = None,
         base_url: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
     ):
         settings = get_settings()
         
@@ -56,8 +162,18 @@ class DynamicsBCClient:
             )
         
         self._access_token: Optional[str] = None
-        self._token_expires: Optional[datetime] = None
-        self._http_client: Optional[httpx.AsyncClient] = None
+        self._token_key = TokenCache.make_key(self.tenant_id, self.client_id, BC_OAUTH_SCOPE)
+        # Client HTTP iniettato (pool condiviso); altrimenti ne crea uno proprio
+        self._http_client: Optional[httpx.AsyncClient] = http_client
+        self._owns_http_client = False
+        
+        self._limiter = None
+        self._backoff = wait_random_exponential(multiplier=0.5, max=60)
+        # Contatori esposti nelle statistiche del job
+        self.stats: Dict[str, int] = {
+            "requests": 0, "throttled": 0, "retries": 0, "token_refreshes": 0, "connection_errors": 0, "parse_errors": 0,
+        }
+        self.parse_errors: List[Dict[str, Any]] = []
     
     async def __aenter__(self):
         """Async context manager"""
@@ -70,30 +186,30 @@ class DynamicsBCClient:
     
     async def connect(self):
         """Inizializza connessione e ottiene token OAuth"""
-        self._http_client = httpx.AsyncClient(
-            timeout=60.0,
-            headers={"Accept": "application/json"}
-        )
-        await self._refresh_token()
+        if self._http_client is None:
+            self._http_client = get_http_pool()
+        if self._http_client is None:
+            # Fuori dal lifespan FastAPI (es. worker Celery)
+            self._http_client = build_http_client()
+            self._owns_http_client = True
+        await self._ensure_token()
     
     async def close(self):
-        """Chiudi connessione"""
-        if self._http_client:
+        """Chiudi connessione (il pool condiviso resta aperto)"""
+        if self._http_client and self._owns_http_client:
             await self._http_client.aclose()
-            self._http_client = None
+        self._http_client = None
+        self._owns_http_client = False
     
-    async def _refresh_token(self):
-        """Ottiene/aggiorna token OAuth2 da Microsoft"""
-        if not all([self.tenant_id, self.client_id, self.client_secret]):
-            raise DynamicsBCError("Missing credentials for Dynamics BC")
-        
-        token_url = f"https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token"
+    async def _fetch_token(self):
+        """Richiede un nuovo token OAuth2 a Microsoft (client credentials)"""
+        token_url = (get_settings().DYNAMICS_BC_TOKEN_URL or DEFAULT_TOKEN_URL).format(tenant=self.tenant_id)
         
         data = {
             "grant_type": "client_credentials",
             "client_id": self.client_id,
             "client_secret": self.client_secret,
-            "scope": "https://api.businesscentral.dynamics.com/.default",
+            "scope": BC_OAUTH_SCOPE,
         }
         
         try:
@@ -101,15 +217,9 @@ class DynamicsBCClient:
             response.raise_for_status()
             
             token_data = response.json()
-            self._access_token = token_data["access_token"]
-            expires_in = token_data.get("expires_in", 3600)
-            self._token_expires = datetime.utcnow().timestamp() + expires_in - 300  # 5min buffer
-            
-            # Aggiorna header
-            self._http_client.headers["Authorization"] = f"Bearer {self._access_token}"
-            
             logger.info("dynamics_bc.token_refreshed", tenant=self.tenant_id)
-            
+            return token_data["access_token"], token_data.get("expires_in", 3600)
+        
         except httpx.HTTPStatusError as e:
             logger.error(
                 "dynamics_bc.token_error",
@@ -117,11 +227,68 @@ class DynamicsBCClient:
                 error=e.response.text
             )
             raise DynamicsBCError(f"OAuth failed: {e.response.text}")
+        except httpx.TransportError as e:
+            logger.error("dynamics_bc.token_error", error=str(e))
+            raise DynamicsBCConnectionError(f"OAuth request failed: {e!r}") from e
     
     async def _ensure_token(self):
-        """Verifica token valido"""
-        if not self._access_token or datetime.utcnow().timestamp() > self._token_expires:
-            await self._refresh_token()
+        """Verifica token valido (cache di processo condivisa tra i client)"""
+        if not all([self.tenant_id, self.client_id, self.client_secret]):
+            raise DynamicsBCError("Missing credentials for Dynamics BC")
+        
+        self._access_token = await get_token_cache().get_token(self._token_key, self._fetch_token)
+    
+    async def _refresh_token(self):
+        """Forza il rinnovo del token (es. dopo un 401)"""
+        await get_token_cache().invalidate(self._token_key, self._access_token)
+        await self._ensure_token()
+    
+    def _rate_limiter(self):
+        """Limiter condiviso da tutti i client dello stesso tenant/ambiente"""
+        if self._limiter is None:
+            settings = get_settings()
+            self._limiter = get_rate_limiter(
+                self.base_url,
+                rate=settings.DYNAMICS_BC_RATE_LIMIT_PER_SECOND,
+                burst=settings.DYNAMICS_BC_RATE_LIMIT_BURST,
+                max_concurrency=settings.DYNAMICS_BC_MAX_CONCURRENCY,
+            )
+        return self._limiter
+    
+    @property
+    def http_stats(self) -> Dict[str, Any]:
+        """Contatori richieste/throttling più stato della concorrenza adattiva"""
+        return {**self.stats, **(self._limiter.snapshot() if self._limiter else {})}
+    
+    def _url(self, endpoint: str) -> str:
+        # I nextLink OData sono URL assoluti
+        if endpoint.startswith(("http://", "https://")):
+            return endpoint
+        return f"{self.base_url}/{endpoint.lstrip('/')}"
+    
+    def _is_retryable(self, method: str, exc: BaseException) -> bool:
+        """429 è sempre ripetibile (richiesta rifiutata), il resto solo se idempotente"""
+        if isinstance(exc, DynamicsBCThrottled):
+            return exc.status_code == 429 or method in IDEMPOTENT_METHODS
+        if isinstance(exc, DynamicsBCTransientError):
+            return method in IDEMPOTENT_METHODS
+        return False
+    
+    def _retry_wait(self, retry_state) -> float:
+        """Backoff esponenziale con jitter, mai meno del Retry-After ricevuto"""
+        backoff = self._backoff(retry_state)
+        exc = retry_state.outcome.exception() if retry_state.outcome else None
+        retry_after = getattr(exc, "retry_after", None)
+        return max(backoff, retry_after) if retry_after else backoff
+    
+    def _before_retry(self, retry_state):
+        self.stats["retries"] += 1
+        exc = retry_state.outcome.exception() if retry_state.outcome else None
+        logger.warning(
+            "dynamics_bc.retrying",
+            attempt=retry_state.attempt_number,
+            error=str(exc),
+        )
     
     async def _request(
         self,
@@ -129,79 +296,403 @@ class DynamicsBCClient:
         endpoint: str,
         **kwargs
     ) -> Dict[str, Any]:
-        """Esegue richiesta API"""
+        """Esegue richiesta API e restituisce il body JSON"""
+        response = await self._request_response(method, endpoint, **kwargs)
+        return response.json() if response.content else {}
+    
+    async def _request_response(
+        self,
+        method: str,
+        endpoint: str,
+        **kwargs
+    ) -> httpx.Response:
+        """Esegue richiesta API con rate limiting e retry su throttling/errori transitori"""
+        url = self._url(endpoint)
+        method = method.upper()
+        
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(get_settings().DYNAMICS_BC_MAX_RETRIES + 1),
+            wait=self._retry_wait,
+            retry=retry_if_exception(lambda e: self._is_retryable(method, e)),
+            before_sleep=self._before_retry,
+            reraise=True,
+        )
+        async for attempt in retrying:
+            with attempt:
+                response = await self._send(method, url, **kwargs)
+        
+        return response
+    
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Singolo tentativo HTTP dentro uno slot del rate limiter"""
         await self._ensure_token()
         
-        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        # Il client può essere condiviso: l'Authorization va per richiesta
+        headers = kwargs.pop("headers", None) or {}
         
-        try:
-            response = await self._http_client.request(method, url, **kwargs)
-            response.raise_for_status()
-            return response.json() if response.content else {}
+        async with self._rate_limiter().slot() as slot:
+            response = await self._send_once(method, url, headers, **kwargs)
+            if response.status_code == 401:
+                # Token revocato/scaduto lato server: rinnova e riprova una volta
+                self.stats["token_refreshes"] += 1
+                await self._refresh_token()
+                response = await self._send_once(method, url, headers, **kwargs)
             
-        except httpx.HTTPStatusError as e:
+            if response.status_code in THROTTLE_STATUS_CODES:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                slot.mark_throttled(retry_after)
+                self.stats["throttled"] += 1
+                raise DynamicsBCThrottled(response.status_code, retry_after, response.text)
+        
+        if response.is_error:
             logger.error(
                 "dynamics_bc.api_error",
                 method=method,
                 url=url,
-                status=e.response.status_code,
-                error=e.response.text
+                status=response.status_code,
+                error=response.text
             )
-            raise DynamicsBCError(f"API error {e.response.status_code}: {e.response.text}")
+            error_class = DynamicsBCTransientError if response.status_code in TRANSIENT_STATUS_CODES else DynamicsBCError
+            raise error_class(f"API error {response.status_code}: {response.text}")
+        
+        return response
     
-    # ============== CUSTOMERS ==============
+    async def _send_once(self, method: str, url: str, headers: Dict[str, str], **kwargs) -> httpx.Response:
+        """Una richiesta HTTP (contata in stats); errori di rete come DynamicsBCConnectionError"""
+        self.stats["requests"] += 1
+        try:
+            return await self._http_client.request(
+                method, url, headers={**headers, "Authorization": f"Bearer {self._access_token}"}, **kwargs
+            )
+        except httpx.TransportError as e:
+            self.stats["connection_errors"] += 1
+            logger.warning("dynamics_bc.connection_error", method=method, url=url, error=repr(e))
+            raise DynamicsBCConnectionError(f"Connection error on {method} {url}: {e!r}") from e
     
-    async def get_customers(
+    # ============== PAGINAZIONE ==============
+    
+    def _list_params(
         self,
         modified_since: Optional[datetime] = None,
-        top: int = 1000,
+        top: Optional[int] = None,
         skip: int = 0,
-    ) -> List[DynamicsBCCustomer]:
-        """
-        Ottiene lista clienti da BC.
-        
-        Args:
-            modified_since: Filtro per data ultima modifica
-            top: Numero massimo risultati
-            skip: Offset per paginazione
-        """
+        select: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """Costruisce parametri OData per liste ($filter, $top, $skip, $select)"""
         filters = []
         if modified_since:
-            # OData filter
+            # OData filter (sempre in UTC; naive = UTC)
+            if modified_since.tzinfo is not None:
+                modified_since = modified_since.astimezone(timezone.utc)
             iso_date = modified_since.strftime("%Y-%m-%dT%H:%M:%SZ")
             filters.append(f"lastModifiedDateTime gt {iso_date}")
         
-        params = {
-            "$top": top,
-            "$skip": skip,
+        params: Dict[str, Any] = {
+            "$top": top or get_settings().DYNAMICS_BC_PAGE_SIZE,
         }
+        if skip:
+            params["$skip"] = skip
         if filters:
             params["$filter"] = " and ".join(filters)
+        if select:
+            params["$select"] = ",".join(select)
+        
+        return params
+    
+    async def _fetch_page(
+        self,
+        url: str,
+        params: Optional[Dict[str, Any]],
+        model: Type[T],
+    ) -> DecodedPage[T]:
+        """Scarica e decodifica una pagina (validazione in un'unica chiamata)"""
+        response = await self._request_response("GET", url, params=params)
+        try:
+            page = get_page_decoder(model).decode(response.content)
+        except ValueError as e:
+            raise DynamicsBCError(f"Invalid OData page from {url}: {e}")
+        
+        if page.errors:
+            self._record_parse_errors(page.errors)
+        return page
+    
+    def _record_parse_errors(self, errors: List[Dict[str, Any]]):
+        """Conta e conserva (fino a un limite) le righe scartate"""
+        self.stats["parse_errors"] += len(errors)
+        room = MAX_KEPT_PARSE_ERRORS - len(self.parse_errors)
+        if room > 0:
+            self.parse_errors.extend(errors[:room])
+        logger.warning(
+            "dynamics_bc.parse_errors",
+            count=len(errors),
+            sample=errors[0],
+        )
+    
+    async def _iter_pages(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        model: Type[T],
+        next_link: Optional[str] = None,
+    ) -> AsyncGenerator[DecodedPage[T], None]:
+        """
+        Itera le pagine di una collection OData, opzionalmente ripartendo
+        da un nextLink già ricevuto.
+        
+        Segue @odata.nextLink quando presente (server-driven paging),
+        altrimenti avanza con $skip finché BC restituisce una pagina piena.
+        """
+        page_size = params["$top"]
+        skip = params.get("$skip", 0)
+        server_paging = next_link is not None
+        next_url: Optional[str] = next_link or endpoint
+        next_params: Optional[Dict[str, Any]] = None if next_link else params
+        
+        while next_url:
+            page = await self._fetch_page(next_url, next_params, model)
+            if page.row_count:
+                yield page
+            
+            if page.next_link:
+                # Il nextLink contiene già tutti i parametri della query
+                server_paging = True
+                next_url, next_params = page.next_link, None
+            elif not server_paging and page.row_count >= page_size:
+                skip += page.row_count
+                next_url, next_params = endpoint, {**params, "$skip": skip}
+            else:
+                next_url = None
+    
+    async def _iter_pages_prefetch(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        model: Type[T],
+        concurrency: int,
+    ) -> AsyncGenerator[DecodedPage[T], None]:
+        """
+        Itera le pagine tenendo fino a `concurrency` richieste $skip in volo.
+        
+        Le pagine vengono restituite nell'ordine degli offset, indipendentemente
+        dall'ordine di completamento. Se BC limita la dimensione pagina sotto
+        $top (pagina corta con nextLink) si prosegue in modo sequenziale.
+        """
+        page_size = params["$top"]
+        start = params.get("$skip", 0)
+        pending: Dict[int, asyncio.Task] = {}
+        cancelled: List[asyncio.Task] = []
+        next_index = 0
+        last_index: Optional[int] = None
+        
+        def schedule():
+            nonlocal next_index
+            while len(pending) < concurrency and (last_index is None or next_index <= last_index):
+                page_params = {**params, "$skip": start + next_index * page_size}
+                pending[next_index] = asyncio.create_task(
+                    self._fetch_page(endpoint, page_params, model)
+                )
+                next_index += 1
+        
+        try:
+            schedule()
+            index = 0
+            while index in pending:
+                page = await pending.pop(index)
+                
+                if page.row_count < page_size:
+                    # Ultima pagina: annulla le richieste oltre la fine
+                    last_index = index
+                    for later in [i for i in pending if i > index]:
+                        cancelled.append(pending.pop(later))
+                        cancelled[-1].cancel()
+                
+                if page.row_count:
+                    yield page
+                
+                if last_index == index and page.next_link:
+                    # Server-driven paging con pagine più piccole di $top
+                    logger.warning(
+                        "dynamics_bc.prefetch_fallback",
+                        endpoint=endpoint,
+                        page_size=page.row_count,
+                    )
+                    async for more in self._iter_pages(endpoint, params, model, next_link=page.next_link):
+                        yield more
+                    return
+                
+                index += 1
+                schedule()
+        finally:
+            cancelled.extend(pending.values())
+            for task in cancelled:
+                task.cancel()
+            if cancelled:
+                await asyncio.gather(*cancelled, return_exceptions=True)
+    
+    def _iter_collection(
+        self,
+        endpoint: str,
+        params: Dict[str, Any],
+        model: Type[T],
+        prefetch: Optional[int] = None,
+    ) -> AsyncGenerator[DecodedPage[T], None]:
+        """Sceglie paginazione sequenziale (nextLink) o con prefetch concorrente"""
+        concurrency = prefetch if prefetch is not None else get_settings().DYNAMICS_BC_PREFETCH_PAGES
+        if concurrency > 1:
+            return self._iter_pages_prefetch(endpoint, params, model, concurrency)
+        return self._iter_pages(endpoint, params, model)
+    
+    # ============== COMPANIES ==============
+    
+    async def get_companies(self, refresh: bool = False) -> List[Dict[str, Any]]:
+        """
+        Restituisce le company BC dell'ambiente.
+        Il risultato è cachato (TTL) e condiviso tra le istanze del client.
+        """
+        ttl = get_settings().DYNAMICS_BC_COMPANY_CACHE_TTL_SECONDS
+        if not refresh:
+            cached = _company_directory.get(self.base_url, ttl)
+            if cached is not None:
+                return cached
+        
+        data = await self._request("GET", "/companies")
+        companies = data.get("value", [])
+        _company_directory.set(self.base_url, companies)
+        logger.info("dynamics_bc.companies_resolved", count=len(companies))
+        return companies
+    
+    async def resolve_company_id(self) -> Optional[str]:
+        """Restituisce company ID configurato o la prima company disponibile"""
+        if self.company_id:
+            return self.company_id
+        
+        companies = await self.get_companies()
+        return companies[0]["id"] if companies else None
+    
+    async def get_company_ids(self) -> List[str]:
+        """
+        Company da sincronizzare: tutte in modalità multi-company
+        (DYNAMICS_BC_MULTI_COMPANY), altrimenti quella configurata/di default.
+        """
+        if get_settings().DYNAMICS_BC_MULTI_COMPANY:
+            return [c["id"] for c in await self.get_companies()]
+        
+        company_id = await self.resolve_company_id()
+        return [company_id] if company_id else []
+    
+    async def _require_company_id(self, company_id: Optional[str]) -> str:
+        company_id = company_id or await self.resolve_company_id()
+        if not company_id:
+            raise DynamicsBCError("Company ID required")
+        return company_id
+    
+    # ============== CUSTOMERS ==============
+    
+    async def iter_customers(
+        self,
+        modified_since: Optional[datetime] = None,
+        page_size: Optional[int] = None,
+        prefetch: Optional[int] = None,
+        company_id: Optional[str] = None,
+        select: Optional[List[str]] = None,
+        skip: int = 0,
+    ) -> AsyncGenerator[DynamicsBCCustomer, None]:
+        """
+        Itera tutti i clienti BC pagina per pagina.
         
-        data = await self._request("GET", "/companies", params=params)
+        Args:
+            modified_since: Filtro per data ultima modifica
+            page_size: Record per pagina ($top), default DYNAMICS_BC_PAGE_SIZE
+            prefetch: Pagine in volo, default DYNAMICS_BC_PREFETCH_PAGES (1 = sequenziale)
+            company_id: Company BC, default quella configurata/di default
+            select: Campi BC da scaricare ($select), vedi select_fields
+            skip: Righe da saltare (ripresa da checkpoint)
+        """
+        company_id = company_id or await self.resolve_company_id()
+        if not company_id:
+            return
         
-        # Ottieni company ID se non specificato
-        company_id = self.company_id
-        if not company_id and data.get("value"):
-            company_id = data["value"][0]["id"]
+        params = self._list_params(modified_since, top=page_size, skip=skip, select=select)
+        endpoint = f"/companies({company_id})/customers"
+        async for page in self._iter_collection(endpoint, params, DynamicsBCCustomer, prefetch):
+            for customer in page.items:
+                yield customer
+    
+    async def get_customers(
+        self,
+        modified_since: Optional[datetime] = None,
+        top: int = 1000,
+        skip: int = 0,
+        company_id: Optional[str] = None,
+        select: Optional[List[str]] = None,
+    ) -> List[DynamicsBCCustomer]:
+        """
+        Ottiene una singola pagina di clienti da BC.
+        Per fetch completi usare iter_customers.
         
+        Args:
+            modified_since: Filtro per data ultima modifica
+            top: Numero massimo risultati
+            skip: Offset per paginazione
+            company_id: Company BC, default quella configurata/di default
+            select: Campi BC da scaricare ($select)
+        """
+        company_id = company_id or await self.resolve_company_id()
         if not company_id:
             return []
         
-        # Ora fetch customers
-        customers_data = await self._request(
-            "GET", 
+        page = await self._fetch_page(
             f"/companies({company_id})/customers",
-            params=params
+            self._list_params(modified_since, top=top, skip=skip, select=select),
+            DynamicsBCCustomer,
         )
         
-        customers = []
-        for item in customers_data.get("value", []):
-            try:
-                customers.append(DynamicsBCCustomer.model_validate(item))
-            except Exception as e:
-                logger.warning("dynamics_bc.parse_error", item=item, error=str(e))
+        return page.items
+    
+    async def iter_customer_versions(
+        self,
+        company_id: str,
+        page_size: Optional[int] = None,
+        prefetch: Optional[int] = None,
+    ) -> AsyncGenerator[DynamicsBCRecordVersion, None]:
+        """Itera solo id, tipo ed ETag di tutti i clienti: pagine leggere per la riconciliazione"""
+        params = self._list_params(top=page_size, select=["id", "type"])
+        endpoint = f"/companies({company_id})/customers"
+        async for page in self._iter_collection(endpoint, params, DynamicsBCRecordVersion, prefetch):
+            for version in page.items:
+                yield version
+    
+    async def fetch_customers(
+        self,
+        customer_ids: Iterable[str],
+        company_id: str,
+        select: Optional[List[str]] = None,
+    ) -> Dict[str, Optional[DynamicsBCCustomer]]:
+        """
+        Legge clienti per id con GET raggruppate in $batch.
         
+        Returns:
+            id → cliente, oppure None se BC risponde 404 (eliminato);
+            gli id con altri errori non compaiono nel risultato
+        """
+        query = f"?$select={','.join(select)}" if select else ""
+        operations = [
+            DynamicsBCBatchOperation(
+                id=customer_id,
+                method="GET",
+                url=f"companies({company_id})/customers({customer_id}){query}",
+            )
+            for customer_id in customer_ids
+        ]
+        customers: Dict[str, Optional[DynamicsBCCustomer]] = {}
+        for result in await self.execute_batch(operations) if operations else []:
+            if result.success and result.body:
+                try:
+                    customers[result.id] = DynamicsBCCustomer.model_validate(result.body)
+                except ValueError as e:
+                    self._record_parse_errors([{"external_id": result.id, "error": str(e)}])
+            elif result.status == 404:
+                customers[result.id] = None
         return customers
     
     async def get_customer(self, customer_id: str) -> Optional[DynamicsBCCustomer]:
@@ -232,9 +723,15 @@ class DynamicsBCClient:
     async def update_customer(
         self, 
         customer_id: str, 
-        customer_data: Dict[str, Any]
+        customer_data: Dict[str, Any],
+        etag: Optional[str] = None,
     ) -> DynamicsBCCustomer:
-        """Aggiorna cliente esistente"""
+        """
+        Aggiorna cliente esistente.
+        
+        Con `etag` l'update fallisce (412) se il record è cambiato in BC
+        dall'ultima lettura; senza, sovrascrive (If-Match: *).
+        """
         if not self.company_id:
             raise DynamicsBCError("Company ID required")
         
@@ -243,58 +740,180 @@ class DynamicsBCClient:
             "PATCH",
             f"/companies({self.company_id})/customers({customer_id})",
             json=customer_data,
-            headers={"If-Match": "*"}  # Ottimistic concurrency
+            headers={"If-Match": etag or "*"}  # Optimistic concurrency
         )
         
         return DynamicsBCCustomer.model_validate(data)
     
+    async def push_customers(
+        self,
+        writes: List[DynamicsBCCustomerWrite],
+        change_set_size: Optional[int] = None,
+    ) -> List[DynamicsBCBatchResult]:
+        """
+        Crea/aggiorna clienti in blocco tramite $batch.
+        
+        I record con customer_id diventano PATCH condizionati sull'ETag
+        (If-Match), gli altri POST. Ogni record va nella propria company
+        (write.company_id, default quella del client): un solo $batch anche
+        con più company. I risultati sono indicizzati per `ref`.
+        """
+        operations = []
+        for write in writes:
+            company_id = write.company_id or self.company_id
+            if not company_id:
+                raise DynamicsBCError("Company ID required")
+            collection = f"companies({company_id})/customers"
+            if write.customer_id:
+                operations.append(DynamicsBCBatchOperation(
+                    id=write.ref,
+                    method="PATCH",
+                    url=f"{collection}({write.customer_id})",
+                    body=write.data,
+                    etag=write.etag or "*",
+                ))
+            else:
+                operations.append(DynamicsBCBatchOperation(
+                    id=write.ref,
+                    method="POST",
+                    url=collection,
+                    body=write.data,
+                ))
+        
+        return await self.execute_batch(operations, change_set_size=change_set_size)
+    
+    # ============== BATCH ==============
+    
+    async def execute_batch(
+        self,
+        operations: List[DynamicsBCBatchOperation],
+        change_set_size: Optional[int] = None,
+    ) -> List[DynamicsBCBatchResult]:
+        """
+        Esegue operazioni tramite OData JSON $batch.
+        
+        Le operazioni sono inviate in richieste da al massimo
+        BC_BATCH_MAX_OPERATIONS. Con change_set_size le operazioni senza
+        atomicity_group esplicito sono raggruppate in change set atomici
+        (tutto o niente) di quella dimensione.
+        
+        Returns:
+            Un risultato per operazione, nello stesso ordine
+        """
+        results: List[DynamicsBCBatchResult] = []
+        
+        for start in range(0, len(operations), BC_BATCH_MAX_OPERATIONS):
+            chunk = operations[start:start + BC_BATCH_MAX_OPERATIONS]
+            requests = []
+            for offset, op in enumerate(chunk):
+                headers = {"Content-Type": "application/json"}
+                if op.etag:
+                    headers["If-Match"] = op.etag
+                
+                request: Dict[str, Any] = {
+                    "id": op.id,
+                    "method": op.method,
+                    "url": op.url.lstrip("/"),
+                    "headers": headers,
+                }
+                if op.body is not None:
+                    request["body"] = op.body
+                
+                group = op.atomicity_group
+                if not group and change_set_size:
+                    group = f"cs{(start + offset) // change_set_size}"
+                if group:
+                    request["atomicityGroup"] = group
+                requests.append(request)
+            
+            data = await self._request("POST", "/$batch", json={"requests": requests})
+            
+            by_id = {r.get("id"): r for r in data.get("responses", [])}
+            for op in chunk:
+                results.append(self._parse_batch_response(op, by_id.get(op.id)))
+        
+        failed = sum(1 for r in results if not r.success)
+        logger.info(
+            "dynamics_bc.batch_executed",
+            operations=len(operations),
+            requests=-(-len(operations) // BC_BATCH_MAX_OPERATIONS),
+            failed=failed,
+        )
+        return results
+    
+    def _parse_batch_response(
+        self,
+        op: DynamicsBCBatchOperation,
+        response: Optional[Dict[str, Any]],
+    ) -> DynamicsBCBatchResult:
+        """Converte una risposta del $batch in risultato per record"""
+        if response is None:
+            return DynamicsBCBatchResult(id=op.id, status=0, success=False, error="Missing batch response")
+        
+        status = response.get("status", 0)
+        body = response.get("body") if isinstance(response.get("body"), dict) else None
+        headers = {k.lower(): v for k, v in (response.get("headers") or {}).items()}
+        success = 200 <= status < 300
+        
+        error = None
+        if not success:
+            error = ((body or {}).get("error") or {}).get("message") or f"HTTP {status}"
+        
+        return DynamicsBCBatchResult(
+            id=op.id,
+            status=status,
+            success=success,
+            conflict=status == 412,
+            etag=headers.get("etag") or (body or {}).get("@odata.etag"),
+            body=body if success else None,
+            error=error,
+        )
+    
     # ============== VENDORS ==============
     
+    async def iter_vendors(
+        self,
+        modified_since: Optional[datetime] = None,
+        page_size: Optional[int] = None,
+        prefetch: Optional[int] = None,
+        company_id: Optional[str] = None,
+        select: Optional[List[str]] = None,
+    ) -> AsyncGenerator[DynamicsBCVendor, None]:
+        """Itera tutti i fornitori BC pagina per pagina"""
+        company_id = await self._require_company_id(company_id)
+        
+        params = self._list_params(modified_since, top=page_size, select=select)
+        endpoint = f"/companies({company_id})/vendors"
+        async for page in self._iter_collection(endpoint, params, DynamicsBCVendor, prefetch):
+            for vendor in page.items:
+                yield vendor
+    
     async def get_vendors(
         self,
         modified_since: Optional[datetime] = None,
         top: int = 1000,
         skip: int = 0,
+        company_id: Optional[str] = None,
+        select: Optional[List[str]] = None,
     ) -> List[DynamicsBCVendor]:
-        """Ottiene lista fornitori"""
-        if not self.company_id:
-            raise DynamicsBCError("Company ID required")
-        
-        filters = []
-        if modified_since:
-            iso_date = modified_since.strftime("%Y-%m-%dT%H:%M:%SZ")
-            filters.append(f"lastModifiedDateTime gt {iso_date}")
+        """Ottiene una singola pagina di fornitori (per fetch completi usare iter_vendors)"""
+        company_id = await self._require_company_id(company_id)
         
-        params = {
-            "$top": top,
-            "$skip": skip,
-        }
-        if filters:
-            params["$filter"] = " and ".join(filters)
-        
-        data = await self._request(
-            "GET",
-            f"/companies({self.company_id})/vendors",
-            params=params
+        page = await self._fetch_page(
+            f"/companies({company_id})/vendors",
+            self._list_params(modified_since, top=top, skip=skip, select=select),
+            DynamicsBCVendor,
         )
         
-        vendors = []
-        for item in data.get("value", []):
-            try:
-                vendors.append(DynamicsBCVendor.model_validate(item))
-            except Exception as e:
-                logger.warning("dynamics_bc.parse_error", item=item, error=str(e))
-        
-        return vendors
+        return page.items
     
     # ============== UTILITIES ==============
     
     async def test_connection(self) -> Dict[str, Any]:
         """Testa connessione e restituisce info base"""
         try:
-            # Ottieni lista companies
-            data = await self._request("GET", "/companies")
-            companies = data.get("value", [])
+            # Ottieni lista companies (sempre fresca, aggiorna anche la cache)
+            companies = await self.get_companies(refresh=True)
             
             return {
                 "connected": True,
@@ -0,0 +1,397 @@
+"""
+Mapping campi dichiarativo, compilato una volta per job.
+
+Un mapping è una lista di regole (per source ed entità, salvata in
+sync_mappings), ognuna con la colonna CRM di destinazione e un campo
+esterno (`source`) oppure una costante (`value`):
+
+    {"target": "first_name", "source": "displayName", "split": "first"}
+    {"target": "background", "source": "addressLine1", "normalize": ["strip", "empty_to_none"]}
+    {"target": "email_jsonb", "source": "email", "type": "Work"}
+    {"target": "status", "value": "cold"}
+    {"target": "title", "source": "country", "lookup": {"IT": "Italia"}, "default": null}
+
+Per le colonne email_jsonb/phone_jsonb ogni regola produce un elemento
+della lista ({"email"|"number": valore, "type": ...}); più regole sulla
+stessa colonna si sommano.
+
+`compile_mapping` valida le regole contro le colonne reali della tabella
+(app.models.tables) e i campi del modello esterno e restituisce un
+CompiledMapping fatto di closure già risolte: a runtime non si
+interpreta più lo spec riga per riga.
+"""
+
+import operator
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
+
+from pydantic import BaseModel
+from sqlalchemy import BigInteger, Boolean, Integer, SmallInteger, Table, Text, delete, func, select
+from sqlalchemy.dialects.postgresql import ARRAY, JSON, JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import sync_mappings
+
+Rule = Dict[str, Any]
+Getter = Callable[[Any], Any]
+# Modello esterno, o più modelli mappati sulla stessa tabella (es. fornitori e clienti BC)
+SourceModels = Union[Type[BaseModel], Sequence[Type[BaseModel]]]
+
+
+class MappingError(ValueError):
+    """Mapping non valido: un messaggio per regola errata"""
+    
+    def __init__(self, errors: List[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+# Colonne gestite dal motore di sync, non mappabili
+RESERVED_COLUMNS = frozenset({
+    "id",
+    "created_at",
+    "first_seen",
+    "last_seen",
+    "external_source",
+    "external_id",
+    "external_data",
+    "last_synced_at",
+})
+
+# Colonne JSONB lista del CRM: chiave del valore e tipi ammessi
+JSONB_LISTS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "email_jsonb": ("email", ("Work", "Home", "Other")),
+    "phone_jsonb": ("number", ("Work", "Home", "Other")),
+}
+
+
+def _digits(value: str) -> str:
+    """Solo cifre, con l'eventuale + iniziale (numeri di telefono)"""
+    digits = "".join(char for char in value if char.isdigit())
+    return f"+{digits}" if value.lstrip().startswith("+") else digits
+
+
+NORMALIZERS: Dict[str, Callable[[Any], Any]] = {
+    "strip": lambda value: value.strip() if isinstance(value, str) else value,
+    "lower": lambda value: value.lower() if isinstance(value, str) else value,
+    "upper": lambda value: value.upper() if isinstance(value, str) else value,
+    "title": lambda value: value.title() if isinstance(value, str) else value,
+    "collapse_spaces": lambda value: " ".join(value.split()) if isinstance(value, str) else value,
+    "digits": lambda value: _digits(value) if isinstance(value, str) else value,
+    "empty_to_none": lambda value: None if value == "" else value,
+}
+
+
+def _splitter(split: Any, separator: Optional[str]) -> Optional[Callable[[Any], Any]]:
+    """
+    Divisione di un campo: "first" (prima parola), "rest" (il resto, "" se
+    assente) o indice della parte; come lo split del displayName BC.
+    """
+    if split == "first":
+        def first(value):
+            parts = str(value).split(separator, 1)
+            return parts[0] if parts else value
+        return first
+    if split == "rest":
+        def rest(value):
+            parts = str(value).split(separator, 1)
+            return parts[1] if len(parts) > 1 else ""
+        return rest
+    if isinstance(split, int) and not isinstance(split, bool):
+        def part(value):
+            parts = str(value).split(separator)
+            return parts[split] if -len(parts) <= split < len(parts) else None
+        return part
+    return None
+
+
+def _to_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in ("true", "1", "yes", "y"):
+        return True
+    if text in ("false", "0", "no", "n", ""):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+
+def _coercer(column) -> Callable[[Any], Any]:
+    """Conversione verso il tipo della colonna (ValueError/TypeError se impossibile)"""
+    column_type = column.type
+    if isinstance(column_type, (BigInteger, Integer, SmallInteger)):
+        return int
+    if isinstance(column_type, Boolean):
+        return _to_bool
+    if isinstance(column_type, Text):
+        return lambda value: value if isinstance(value, str) else str(value)
+    if isinstance(column_type, ARRAY):
+        return lambda value: list(value) if isinstance(value, (list, tuple)) else [value]
+    if isinstance(column_type, (JSON, JSONB)):
+        return lambda value: value
+    return lambda value: value
+
+
+class CompiledMapping:
+    """Mapping compilato: record esterno → riga della tabella CRM"""
+    
+    def __init__(
+        self,
+        table: Table,
+        scalars: List[Tuple[str, Getter]],
+        lists: List[Tuple[str, List[Getter]]],
+        source_fields: List[str],
+    ):
+        self.table = table
+        self._scalars = tuple(scalars)
+        self._lists = tuple((target, tuple(getters)) for target, getters in lists)
+        self.source_fields = source_fields  # Campi esterni letti (per $select)
+        self.targets = tuple([target for target, _ in scalars] + [target for target, _ in lists])
+    
+    def __call__(self, record: Any) -> Dict[str, Any]:
+        row = {target: getter(record) for target, getter in self._scalars}
+        for target, getters in self._lists:
+            row[target] = [item for getter in getters if (item := getter(record)) is not None]
+        return row
+
+
+def merge_rules(defaults: Sequence[Rule], custom: Sequence[Rule]) -> List[Rule]:
+    """Regole di default più quelle custom: una colonna custom sostituisce le regole di default sulla stessa colonna"""
+    overridden = {rule.get("target") for rule in custom}
+    return [rule for rule in defaults if rule.get("target") not in overridden] + list(custom)
+
+
+def rules_from_flat(mapping: Dict[str, str]) -> List[Rule]:
+    """
+    Converte il vecchio mapping {campo esterno: campo CRM} in regole di
+    rinomina; "email"/"phone" diventano elementi di email_jsonb/phone_jsonb.
+    """
+    legacy_targets = {"email": "email_jsonb", "phone": "phone_jsonb"}
+    return [
+        {"source": source, "target": legacy_targets.get(target, target)}
+        for source, target in mapping.items()
+    ]
+
+
+def normalize_spec(mapping: Any) -> List[Rule]:
+    """Accetta {"fields": [...]}, una lista di regole o il vecchio dict piatto"""
+    if isinstance(mapping, dict) and "fields" in mapping:
+        mapping = mapping["fields"]
+    if isinstance(mapping, dict):
+        return rules_from_flat(mapping)
+    if isinstance(mapping, list):
+        return mapping
+    raise MappingError(["Mapping must be a list of rules or {\"fields\": [...]}"])
+
+
+def _source_attributes(model: SourceModels) -> Dict[str, str]:
+    """Campo esterno (alias) → attributo, solo i campi presenti in tutti i modelli"""
+    models = [model] if isinstance(model, type) else list(model)
+    attributes = {field.alias or name: name for name, field in models[0].model_fields.items()}
+    for other in models[1:]:
+        fields = {field.alias or name: name for name, field in other.model_fields.items()}
+        attributes = {alias: name for alias, name in attributes.items() if fields.get(alias) == name}
+    return attributes
+
+
+def compile_mapping(
+    rules: Sequence[Rule],
+    table: Table,
+    model: SourceModels,
+) -> CompiledMapping:
+    """
+    Valida e compila le regole per `table` e il modello esterno `model`
+    (con più modelli sono ammessi solo i campi comuni a tutti).
+    
+    Raises:
+        MappingError: con tutti gli errori trovati
+    """
+    attributes = _source_attributes(model)
+    errors: List[str] = []
+    scalars: Dict[str, Getter] = {}
+    lists: Dict[str, List[Getter]] = {}
+    source_fields: List[str] = []
+    
+    for index, rule in enumerate(rules):
+        where = f"Rule {index}"
+        if not isinstance(rule, dict) or not isinstance(rule.get("target"), str):
+            errors.append(f"{where}: 'target' is required")
+            continue
+        target = rule["target"]
+        where = f"Rule {index} ({target})"
+        
+        unknown_keys = set(rule) - {"target", "source", "value", "split", "separator", "normalize", "lookup", "default", "strict", "type"}
+        if unknown_keys:
+            errors.append(f"{where}: unknown keys {sorted(unknown_keys)}")
+        if target not in table.c:
+            errors.append(f"{where}: '{target}' is not a column of {table.name}")
+            continue
+        if target in RESERVED_COLUMNS:
+            errors.append(f"{where}: '{target}' is managed by the sync engine")
+            continue
+        if ("source" in rule) == ("value" in rule):
+            errors.append(f"{where}: exactly one of 'source' or 'value' is required")
+            continue
+        if target in scalars:
+            errors.append(f"{where}: '{target}' is mapped twice")
+            continue
+        
+        rule_errors: List[str] = []
+        getter = _compile_rule(rule, table.c[target], attributes, rule_errors)
+        errors.extend(f"{where}: {error}" for error in rule_errors)
+        if getter is None:
+            continue
+        
+        if "source" in rule and rule["source"] not in source_fields:
+            source_fields.append(rule["source"])
+        if target in JSONB_LISTS:
+            lists.setdefault(target, []).append(getter)
+        else:
+            scalars[target] = getter
+    
+    mapped = set(scalars) | set(lists)
+    for column in table.c:
+        if not column.nullable and column.name not in mapped and column.name not in RESERVED_COLUMNS and not column.primary_key:
+            errors.append(f"Required column '{column.name}' of {table.name} is not mapped")
+    
+    if errors:
+        raise MappingError(errors)
+    return CompiledMapping(table, list(scalars.items()), list(lists.items()), source_fields)
+
+
+def _compile_rule(
+    rule: Rule,
+    column,
+    attributes: Dict[str, str],
+    errors: List[str],
+) -> Optional[Getter]:
+    """Getter di una regola: lettura, split, normalizzatori, lookup, conversione"""
+    target = column.name
+    
+    steps: List[Callable[[Any], Any]] = []
+    if "split" in rule:
+        splitter = _splitter(rule["split"], rule.get("separator"))
+        if splitter is None:
+            errors.append("'split' must be 'first', 'rest' or an index")
+        else:
+            steps.append(splitter)
+    normalize = rule.get("normalize", [])
+    if isinstance(normalize, str):
+        normalize = [normalize]
+    for name in normalize:
+        if name not in NORMALIZERS:
+            errors.append(f"unknown normalizer '{name}' (available: {', '.join(NORMALIZERS)})")
+        else:
+            steps.append(NORMALIZERS[name])
+    
+    lookup = rule.get("lookup")
+    if lookup is not None and not isinstance(lookup, dict):
+        errors.append("'lookup' must be an object")
+    
+    # Colonne lista JSONB: il valore diventa un elemento {chiave: valore, type}
+    if target in JSONB_LISTS:
+        key, types = JSONB_LISTS[target]
+        item_type = rule.get("type", types[0])
+        if item_type not in types:
+            errors.append(f"'type' must be one of {', '.join(types)}")
+        
+        def coerce(value, key=key, item_type=item_type):
+            return {key: str(value), "type": item_type} if value not in (None, "") else None
+    else:
+        if "type" in rule:
+            errors.append(f"'type' only applies to {', '.join(JSONB_LISTS)}")
+        coerce = _coercer(column)
+    
+    # Costanti e valori del lookup convertiti subito: errori a compile time
+    if "value" in rule:
+        try:
+            constant = coerce(rule["value"]) if rule["value"] is not None else None
+        except (TypeError, ValueError) as e:
+            errors.append(f"value {rule['value']!r} not valid for {target}: {e}")
+            return None
+        if errors:
+            return None
+        return lambda record: constant
+    
+    if rule["source"] not in attributes:
+        errors.append(f"unknown source field '{rule['source']}'")
+    if errors:
+        return None
+    
+    get = operator.attrgetter(attributes[rule["source"]])
+    
+    if lookup is not None:
+        try:
+            values = {key: coerce(value) if value is not None else None for key, value in lookup.items()}
+            default = coerce(rule["default"]) if rule.get("default") is not None else None
+        except (TypeError, ValueError) as e:
+            errors.append(f"lookup values not valid for {target}: {e}")
+            return None
+        strict = bool(rule.get("strict"))
+        
+        def getter(record):
+            value = get(record)
+            for step in steps:
+                if value is None:
+                    break
+                value = step(value)
+            if value in values:
+                return values[value]
+            if strict:
+                raise ValueError(f"{rule['source']}={value!r} not in lookup for {target}")
+            return default
+        return getter
+    
+    if not steps:
+        def getter(record):
+            value = get(record)
+            return None if value is None else coerce(value)
+        return getter
+    
+    def getter(record):
+        value = get(record)
+        for step in steps:
+            if value is None:
+                return None
+            value = step(value)
+        return None if value is None else coerce(value)
+    return getter
+
+
+# ============== STORAGE ==============
+
+async def load_mapping(db: AsyncSession, source: str, entity_type: str) -> Optional[List[Rule]]:
+    """Regole custom salvate per source/entità"""
+    result = await db.execute(
+        select(sync_mappings.c.spec).where(
+            sync_mappings.c.source == source,
+            sync_mappings.c.entity_type == entity_type,
+        )
+    )
+    spec = result.scalar_one_or_none()
+    return normalize_spec(spec) if spec is not None else None
+
+
+async def save_mapping(db: AsyncSession, source: str, entity_type: str, rules: List[Rule]):
+    """Salva le regole custom (già validate con compile_mapping)"""
+    stmt = pg_insert(sync_mappings).values(
+        source=source,
+        entity_type=entity_type,
+        spec={"fields": rules},
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[sync_mappings.c.source, sync_mappings.c.entity_type],
+        set_={"spec": stmt.excluded.spec, "updated_at": func.now()},
+    )
+    await db.execute(stmt)
+
+
+async def delete_mapping(db: AsyncSession, source: str, entity_type: str) -> int:
+    """Elimina le regole custom: si torna al mapping di default"""
+    result = await db.execute(
+        delete(sync_mappings).where(
+            sync_mappings.c.source == source,
+            sync_mappings.c.entity_type == entity_type,
+        )
+    )
+    return result.rowcount
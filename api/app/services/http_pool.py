@@ -0,0 +1,114 @@
+"""
+Pool HTTP condiviso per i connettori esterni.
+
+Il client viene creato nel lifespan FastAPI e iniettato nei client dei
+connettori, così le chiamate a regime riusano connessioni keep-alive
+già aperte (HTTP/2 se il pacchetto h2 è installato) invece di pagare
+handshake TLS e setup ad ogni sync/preview.
+"""
+
+from typing import Any, Dict, Optional
+
+import httpx
+import structlog
+
+from app.config import get_settings
+
+logger = structlog.get_logger()
+
+_shared_client: Optional[httpx.AsyncClient] = None
+_stats: Dict[str, int] = {"requests": 0, "responses": 0}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+async def _on_request(request: httpx.Request):
+    _stats["requests"] += 1
+
+
+async def _on_response(response: httpx.Response):
+    _stats["responses"] += 1
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """Crea un AsyncClient con limiti di pool e keep-alive da Settings"""
+    settings = get_settings()
+    
+    http2 = settings.HTTP_POOL_HTTP2 and _http2_available()
+    if settings.HTTP_POOL_HTTP2 and not http2:
+        logger.warning("http_pool.http2_unavailable", hint="pip install httpx[http2]")
+    
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_POOL_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            settings.HTTP_POOL_TIMEOUT_SECONDS,
+            connect=settings.HTTP_POOL_CONNECT_TIMEOUT_SECONDS,
+        ),
+        headers={"Accept": "application/json"},
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+
+
+async def init_http_pool() -> httpx.AsyncClient:
+    """Crea il pool condiviso (startup)"""
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = build_http_client()
+        settings = get_settings()
+        logger.info(
+            "http_pool.started",
+            http2=settings.HTTP_POOL_HTTP2 and _http2_available(),
+            max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive=settings.HTTP_POOL_MAX_KEEPALIVE,
+        )
+    return _shared_client
+
+
+async def close_http_pool():
+    """Chiude il pool condiviso (shutdown)"""
+    global _shared_client
+    if _shared_client is not None:
+        await _shared_client.aclose()
+        _shared_client = None
+        logger.info("http_pool.closed", **_stats)
+
+
+def get_http_pool() -> Optional[httpx.AsyncClient]:
+    """Restituisce il pool condiviso, None fuori dal lifespan (es. Celery)"""
+    return _shared_client
+
+
+def http_pool_stats() -> Dict[str, Any]:
+    """Statistiche del pool: richieste e connessioni aperte/idle"""
+    settings = get_settings()
+    stats: Dict[str, Any] = {
+        "active": _shared_client is not None,
+        "http2_enabled": settings.HTTP_POOL_HTTP2 and _http2_available(),
+        "max_connections": settings.HTTP_POOL_MAX_CONNECTIONS,
+        "max_keepalive": settings.HTTP_POOL_MAX_KEEPALIVE,
+        "requests": _stats["requests"],
+        "responses": _stats["responses"],
+    }
+    
+    # httpcore non espone API pubbliche per lo stato del pool: best effort
+    pool = getattr(getattr(_shared_client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is not None:
+        stats["connections"] = len(connections)
+        stats["connections_idle"] = sum(1 for c in connections if c.is_idle())
+        stats["connections_http2"] = sum(
+            1 for c in connections if "HTTP/2" in c.info()
+        )
+    
+    return stats
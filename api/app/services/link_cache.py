@@ -0,0 +1,138 @@
+"""
+Cache LRU dei link sync_links (record esterno → riga CRM).
+
+Il motore risolve gli external_id di un batch con una sola query
+indicizzata (`warm`) e poi legge dalla cache, invece di una lookup per
+record. La cache è per istanza di SyncEngine: i link vengono aggiornati
+dopo ogni scrittura, quindi restano coerenti per tutta la durata del job.
+
+`save` aggiorna la cache prima del commit (il resto del batch legge i link
+appena scritti): se la transazione viene annullata il chiamante deve
+invalidare le chiavi del batch con `invalidate`, altrimenti la cache
+conterrebbe link e hash mai salvati.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import sync_links
+
+LinkKey = Tuple[str, str, str]  # (source, entity_type, external_id)
+
+
+@dataclass(frozen=True)
+class SyncLink:
+    """Riga CRM collegata a un record esterno"""
+    crm_id: int
+    version: Optional[str] = None  # ETag del record esterno
+    hash: Optional[str] = None  # Hash del contenuto mappato
+
+
+class SyncLinkCache:
+    """LRU di SyncLink con caricamento in blocco per batch"""
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._links: "OrderedDict[LinkKey, SyncLink]" = OrderedDict()
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "queries": 0}
+    
+    def __len__(self) -> int:
+        return len(self._links)
+    
+    def get(self, source: str, entity_type: str, external_id: str) -> Optional[SyncLink]:
+        key = (source, entity_type, external_id)
+        link = self._links.get(key)
+        if link is not None:
+            self._links.move_to_end(key)
+        return link
+    
+    def discard(self, source: str, entity_type: str, external_id: str):
+        self._links.pop((source, entity_type, external_id), None)
+    
+    def invalidate(self, source: str, entity_type: str, external_ids: Iterable[str]):
+        """Rimuove i link di un batch annullato (rollback): il prossimo warm li rilegge"""
+        for external_id in external_ids:
+            self.discard(source, entity_type, external_id)
+    
+    def put(self, source: str, entity_type: str, external_id: str, link: SyncLink):
+        key = (source, entity_type, external_id)
+        self._links[key] = link
+        self._links.move_to_end(key)
+        while len(self._links) > self.max_size:
+            self._links.popitem(last=False)
+    
+    async def warm(
+        self,
+        db: AsyncSession,
+        source: str,
+        entity_type: str,
+        external_ids: Iterable[str],
+    ):
+        """Carica con una sola query i link del batch non ancora in cache"""
+        missing = []
+        for external_id in set(external_ids):
+            if (source, entity_type, external_id) in self._links:
+                self.stats["hits"] += 1
+            else:
+                missing.append(external_id)
+        
+        self.stats["misses"] += len(missing)
+        if not missing:
+            return
+        
+        self.stats["queries"] += 1
+        result = await db.execute(
+            select(
+                sync_links.c.external_id,
+                sync_links.c.crm_id,
+                sync_links.c.version,
+                sync_links.c.hash,
+            ).where(
+                sync_links.c.source == source,
+                sync_links.c.entity_type == entity_type,
+                sync_links.c.external_id.in_(missing),
+            )
+        )
+        for row in result:
+            self.put(source, entity_type, row.external_id, SyncLink(row.crm_id, row.version, row.hash))
+    
+    async def save(
+        self,
+        db: AsyncSession,
+        source: str,
+        entity_type: str,
+        links: Dict[str, SyncLink],
+    ):
+        """Upsert dei link scritti nel batch (un solo statement) e aggiornamento cache"""
+        if not links:
+            return
+        
+        stmt = pg_insert(sync_links).values([
+            {
+                "source": source,
+                "entity_type": entity_type,
+                "external_id": external_id,
+                "crm_id": link.crm_id,
+                "version": link.version,
+                "hash": link.hash,
+            }
+            for external_id, link in links.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[sync_links.c.source, sync_links.c.entity_type, sync_links.c.external_id],
+            set_={
+                "crm_id": stmt.excluded.crm_id,
+                "version": stmt.excluded.version,
+                "hash": stmt.excluded.hash,
+                "synced_at": func.now(),
+            },
+        )
+        await db.execute(stmt)
+        
+        for external_id, link in links.items():
+            self.put(source, entity_type, external_id, link)
@@ -0,0 +1,113 @@
+"""
+Decodifica delle pagine OData (collection BC).
+
+Il body viene decodificato con orjson (se installato, altrimenti json
+della stdlib) e l'intera pagina validata in un'unica chiamata
+TypeAdapter, senza try/except per riga. Solo se qualche riga non è
+valida si rivalidano le righe buone, raccogliendo gli errori per riga.
+"""
+
+import json
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, Generic, List, Optional, Type, TypeVar
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
+
+try:
+    import orjson
+    _loads = orjson.loads
+    JSONDecodeError = (orjson.JSONDecodeError,)
+except ImportError:  # orjson opzionale
+    _loads = json.loads
+    JSONDecodeError = (json.JSONDecodeError,)
+
+M = TypeVar("M", bound=BaseModel)
+
+
+class ODataPage(BaseModel, Generic[M]):
+    """Pagina di una collection OData"""
+    model_config = ConfigDict(populate_by_name=True)
+    
+    value: List[M] = Field(default_factory=list)
+    next_link: Optional[str] = Field(None, alias="@odata.nextLink")
+
+
+@dataclass
+class DecodedPage(Generic[M]):
+    """Risultato della decodifica: righe valide, errori per riga e nextLink"""
+    items: List[M]
+    next_link: Optional[str] = None
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    
+    @property
+    def row_count(self) -> int:
+        """Righe restituite da BC (valide + scartate)"""
+        return len(self.items) + len(self.errors)
+
+
+class PageDecoder(Generic[M]):
+    """Decoder di pagine OData per un modello"""
+    
+    def __init__(self, model: Type[M]):
+        self.model = model
+        self._page_adapter = TypeAdapter(ODataPage[model])
+        self._items_adapter = TypeAdapter(List[model])
+    
+    def decode(self, content: bytes) -> DecodedPage[M]:
+        """
+        Decodifica il body JSON di una pagina.
+        
+        Raises:
+            ValueError: se il body non è una pagina OData valida
+        """
+        try:
+            data = _loads(content)
+        except JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        
+        try:
+            page = self._page_adapter.validate_python(data)
+            return DecodedPage(items=page.value, next_link=page.next_link)
+        except ValidationError as e:
+            bad_rows = self._row_errors(e)
+            if not bad_rows:
+                # Errore a livello di pagina (value mancante o non lista...)
+                raise ValueError(str(e))
+        
+        rows = data["value"]
+        good_rows = [row for i, row in enumerate(rows) if i not in bad_rows]
+        
+        errors = []
+        for index, messages in sorted(bad_rows.items()):
+            row = rows[index] if isinstance(rows[index], dict) else {}
+            errors.append({
+                "index": index,
+                "external_id": row.get("id") or row.get("number"),
+                "error": "; ".join(messages),
+            })
+        
+        return DecodedPage(
+            items=self._items_adapter.validate_python(good_rows),
+            next_link=data.get("@odata.nextLink"),
+            errors=errors,
+        )
+    
+    @staticmethod
+    def _row_errors(error: ValidationError) -> Dict[int, List[str]]:
+        """Raggruppa gli errori di validazione per indice di riga in `value`"""
+        rows: Dict[int, List[str]] = {}
+        for err in error.errors(include_url=False):
+            loc = err["loc"]
+            if len(loc) < 2 or loc[0] != "value" or not isinstance(loc[1], int):
+                return {}
+            field_path = ".".join(str(p) for p in loc[2:]) or "row"
+            rows.setdefault(loc[1], []).append(f"{field_path}: {err['msg']}")
+        return rows
+
+
+@lru_cache()
+def get_page_decoder(model: Type[M]) -> PageDecoder[M]:
+    """Decoder cachato per modello (la costruzione degli adapter è costosa)"""
+    return PageDecoder(model)
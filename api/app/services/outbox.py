@@ -0,0 +1,382 @@
+"""
+Sync in uscita (CRM → BC) guidata dalla change capture.
+
+I trigger su contacts accodano in sync_outbox l'id delle righe modificate
+dagli utenti e notificano il canale 'sync_outbox'. L'outbox viene
+svuotata a batch: le righe vengono prese con FOR UPDATE SKIP LOCKED e
+marcate (claimed_at) in una transazione breve, così più worker non
+inviano mai la stessa riga e nessun lock resta aperto durante la chiamata
+a BC. Si legge lo stato attuale dei contatti e lo si invia con un $batch,
+quindi il costo segue il numero di modifiche e non la dimensione della
+tabella.
+
+Echo suppression: le scritture della sync in ingresso marcano la
+transazione con `mark_sync_source` e i trigger non le accodano, così i
+record appena ricevuti da BC non vi vengono rimandati.
+"""
+
+import asyncio
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import structlog
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from app.models.schemas import DynamicsBCBatchResult, DynamicsBCCustomerWrite, SyncSource
+from app.models.tables import contacts, sync_links, sync_outbox
+from app.services.contact_writer import LINK_ENTITY_TYPE
+from app.services.dynamics_bc import DynamicsBCClient, DynamicsBCError
+from app.services.link_cache import SyncLink, SyncLinkCache
+
+logger = structlog.get_logger()
+
+OUTBOX_CHANNEL = "sync_outbox"
+SYNC_SOURCE_SETTING = "atomic.sync_source"
+
+BC_SOURCE = SyncSource.DYNAMICS_BC.value
+
+# Attesa prima di riaprire la connessione LISTEN caduta (raddoppia a ogni errore)
+LISTEN_RETRY_MIN_SECONDS = 1.0
+LISTEN_RETRY_MAX_SECONDS = 60.0
+
+# Company BC del cliente, salvata in contacts.external_data dalla sync in ingresso
+BC_COMPANY_KEY = "bc_company_id"
+
+# (cliente BC restituito da un invio, company) → hash in ingresso (None se non calcolabile)
+PushedHash = Callable[[Dict[str, Any], str], Optional[str]]
+
+
+async def mark_sync_source(db: AsyncSession, source: str):
+    """Marca la transazione corrente come scrittura della sync: i trigger non la accodano"""
+    await db.execute(select(func.set_config(SYNC_SOURCE_SETTING, source, True)))
+
+
+def contact_to_bc(contact) -> Dict[str, Any]:
+    """Contatto CRM → campi BC customer (gli stessi mappati in ingresso)"""
+    emails = contact.email_jsonb or []
+    phones = contact.phone_jsonb or []
+    return {
+        "displayName": " ".join(part for part in (contact.first_name, contact.last_name) if part),
+        "email": emails[0].get("email", "") if emails else "",
+        "phoneNumber": phones[0].get("number", "") if phones else "",
+    }
+
+
+async def count_pending(db: AsyncSession, entity_type: str, max_attempts: int) -> int:
+    """Modifiche in attesa di invio (per il dry run)"""
+    result = await db.execute(
+        select(func.count()).select_from(sync_outbox).where(
+            sync_outbox.c.entity_type == entity_type,
+            sync_outbox.c.attempts < max_attempts,
+        )
+    )
+    return result.scalar_one()
+
+
+async def drain_contact_outbox(
+    db: AsyncSession,
+    client: DynamicsBCClient,
+    links: SyncLinkCache,
+    batch_size: int,
+    max_attempts: int,
+    claim_timeout: int = 300,
+    pushed_hash: Optional[PushedHash] = None,
+) -> Dict[str, Any]:
+    """
+    Invia a BC i contatti modificati a batch, finché l'outbox è vuota o un
+    batch ha errori (riprovati al prossimo giro).
+    
+    Nessuna transazione resta aperta durante la chiamata a BC: le righe
+    vengono prese (claimed_at) e committate prima dell'invio, gli esiti
+    scritti in una transazione successiva. Righe prese da un worker morto
+    tornano disponibili dopo `claim_timeout` secondi.
+    
+    Ogni cliente viene scritto nella company BC da cui è stato letto
+    (external_data), i contatti mai sincronizzati in `client.company_id`.
+    
+    Args:
+        pushed_hash: hash in ingresso del cliente restituito da BC, salvato
+            nel link: la sync successiva riconosce come invariato ciò che è
+            appena stato inviato (senza, il link resta senza hash e il
+            contatto viene riallineato alla prossima sync in ingresso)
+    
+    Returns:
+        Contatori created/updated/conflicts/dropped/failed ed errori
+    """
+    result: Dict[str, Any] = {"created": 0, "updated": 0, "conflicts": 0, "dropped": 0, "failed": 0, "errors": []}
+    
+    while True:
+        claimed = await _claim(db, batch_size, max_attempts, claim_timeout)
+        await db.commit()
+        if not claimed:
+            break
+        
+        batch = await _prepare_push(db, claimed, result, client.company_id)
+        # Fine della transazione di lettura prima della chiamata HTTP
+        await db.commit()
+        
+        try:
+            pushed = await client.push_customers(batch.writes) if batch.writes else []
+        except DynamicsBCError as e:
+            # Richiesta $batch fallita per intero: nessuna riga inviata
+            await _record_failure(db, [row.id for row in claimed], str(e))
+            await db.commit()
+            result["failed"] += len(claimed)
+            result["errors"].append({"entity": "connection", "error": str(e)})
+            break
+        
+        try:
+            failed = await _apply_push(db, links, batch, pushed, result, pushed_hash)
+            await db.commit()
+        except SQLAlchemyError:
+            # Le righe restano prese fino a claim_timeout, poi vengono
+            # reinviate (con l'ETag vecchio: 412 e riallineamento da BC)
+            await db.rollback()
+            links.invalidate(BC_SOURCE, LINK_ENTITY_TYPE, batch.external_ids(pushed))
+            raise
+        
+        if failed or len(claimed) < batch_size:
+            break
+    
+    logger.info(
+        "outbox.drained",
+        entity=LINK_ENTITY_TYPE,
+        **{key: value for key, value in result.items() if key != "errors"},
+    )
+    return result
+
+
+@dataclass
+class _PushBatch:
+    """Contatti prelevati dall'outbox e pronti per l'invio"""
+    outbox_ids: Dict[int, List[int]]  # contatto → righe outbox
+    linked: Dict[int, Any]  # contatto → link BC
+    writes: List[DynamicsBCCustomerWrite] = field(default_factory=list)
+    done: List[int] = field(default_factory=list)  # righe outbox completate
+    
+    def external_ids(self, pushed: List[DynamicsBCBatchResult]) -> List[str]:
+        """Clienti BC scritti con successo (esistenti o appena creati)"""
+        return [
+            write.customer_id or (result.body or {}).get("id")
+            for write, result in zip(self.writes, pushed)
+            if result.success
+        ]
+
+
+async def _claim(db: AsyncSession, batch_size: int, max_attempts: int, claim_timeout: int) -> List[Any]:
+    """Prende un batch di righe libere (o abbandonate) marcandole con claimed_at"""
+    available = (
+        select(sync_outbox.c.id)
+        .where(
+            sync_outbox.c.entity_type == LINK_ENTITY_TYPE,
+            sync_outbox.c.attempts < max_attempts,
+            or_(
+                sync_outbox.c.claimed_at.is_(None),
+                sync_outbox.c.claimed_at < func.now() - timedelta(seconds=claim_timeout),
+            ),
+        )
+        .order_by(sync_outbox.c.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(sync_outbox)
+        .where(sync_outbox.c.id.in_(available.scalar_subquery()))
+        .values(claimed_at=func.now())
+        .returning(sync_outbox.c.id, sync_outbox.c.record_id)
+    )
+    return sorted(result.all(), key=lambda row: row.id)
+
+
+async def _prepare_push(
+    db: AsyncSession,
+    claimed: List[Any],
+    result: Dict[str, Any],
+    default_company_id: Optional[str],
+) -> _PushBatch:
+    """Legge lo stato attuale dei contatti prelevati e prepara le scritture BC"""
+    # Più modifiche della stessa riga: un solo invio
+    outbox_ids: Dict[int, List[int]] = {}
+    for row in claimed:
+        outbox_ids.setdefault(row.record_id, []).append(row.id)
+    record_ids = list(outbox_ids)
+    
+    rows = await db.execute(
+        select(
+            contacts.c.id,
+            contacts.c.first_name,
+            contacts.c.last_name,
+            contacts.c.email_jsonb,
+            contacts.c.phone_jsonb,
+            contacts.c.external_source,
+            contacts.c.external_id,
+            contacts.c.external_data,
+        ).where(contacts.c.id.in_(record_ids))
+    )
+    current = {row.id: row for row in rows}
+    batch = _PushBatch(outbox_ids=outbox_ids, linked={
+        row.crm_id: row
+        for row in await db.execute(
+            select(sync_links.c.crm_id, sync_links.c.external_id, sync_links.c.version).where(
+                sync_links.c.source == BC_SOURCE,
+                sync_links.c.entity_type == LINK_ENTITY_TYPE,
+                sync_links.c.crm_id.in_(record_ids),
+            )
+        )
+    })
+    
+    for contact_id in record_ids:
+        contact = current.get(contact_id)
+        if (
+            contact is None
+            or contact.external_source not in (None, BC_SOURCE)
+            or (contact.external_data or {}).get("deleted_at")
+        ):
+            # Eliminato nel frattempo, di un altro sistema esterno o
+            # eliminato in BC (riconciliazione)
+            result["dropped"] += 1
+            batch.done.extend(outbox_ids[contact_id])
+            continue
+        link = batch.linked.get(contact_id)
+        batch.writes.append(DynamicsBCCustomerWrite(
+            ref=str(contact_id),
+            customer_id=link.external_id if link else contact.external_id,
+            etag=link.version if link else None,
+            company_id=(contact.external_data or {}).get(BC_COMPANY_KEY) or default_company_id,
+            data=contact_to_bc(contact),
+        ))
+    return batch
+
+
+async def _apply_push(
+    db: AsyncSession,
+    links: SyncLinkCache,
+    batch: _PushBatch,
+    pushed: List[DynamicsBCBatchResult],
+    result: Dict[str, Any],
+    pushed_hash: Optional[PushedHash],
+) -> int:
+    """Scrive gli esiti dell'invio (link, id esterni, outbox); ritorna le righe fallite"""
+    # Link e id esterni aggiornati qui non devono tornare in outbox
+    await mark_sync_source(db, BC_SOURCE)
+    
+    new_links: Dict[str, SyncLink] = {}
+    failures: Dict[int, str] = {}
+    for write, outcome in zip(batch.writes, pushed):
+        contact_id = int(write.ref)
+        if outcome.success:
+            external_id = write.customer_id or (outcome.body or {}).get("id")
+            # Hash dello stato inviato, non quello dell'ultima lettura: un
+            # ritorno in BC ai valori precedenti deve essere visto come modifica
+            state_hash = pushed_hash(outcome.body, write.company_id) if pushed_hash and outcome.body else None
+            new_links[external_id] = SyncLink(crm_id=contact_id, version=outcome.etag, hash=state_hash)
+            if write.customer_id:
+                result["updated"] += 1
+            else:
+                result["created"] += 1
+                await db.execute(
+                    update(contacts)
+                    .where(contacts.c.id == contact_id)
+                    .values(external_source=BC_SOURCE, external_id=external_id)
+                )
+        elif outcome.conflict:
+            # Modificato in BC dopo l'ultima lettura: vince BC, la prossima
+            # sync in ingresso riallinea il contatto
+            result["conflicts"] += 1
+            logger.warning("outbox.conflict", contact_id=contact_id, customer_id=write.customer_id)
+        else:
+            failures[contact_id] = outcome.error or f"HTTP {outcome.status}"
+            result["failed"] += 1
+            result["errors"].append({"entity": "contact", "id": contact_id, "error": failures[contact_id]})
+            continue
+        batch.done.extend(batch.outbox_ids[contact_id])
+    
+    if new_links:
+        await links.save(db, BC_SOURCE, LINK_ENTITY_TYPE, new_links)
+    if batch.done:
+        await db.execute(sync_outbox.delete().where(sync_outbox.c.id.in_(batch.done)))
+    for contact_id, error in failures.items():
+        await _record_failure(db, batch.outbox_ids[contact_id], error)
+    return len(failures)
+
+
+async def _record_failure(db: AsyncSession, outbox_ids: List[int], error: str):
+    """
+    Incrementa i tentativi e libera le righe: dopo SYNC_OUTBOX_MAX_ATTEMPTS
+    la riga resta per ispezione
+    """
+    await db.execute(
+        update(sync_outbox)
+        .where(sync_outbox.c.id.in_(outbox_ids))
+        .values(attempts=sync_outbox.c.attempts + 1, last_error=error, claimed_at=None)
+    )
+
+
+async def listen_outbox(
+    engine: AsyncEngine,
+    drain: Callable[[], Awaitable[Any]],
+    poll_seconds: float,
+    retry_min_seconds: float = LISTEN_RETRY_MIN_SECONDS,
+    retry_max_seconds: float = LISTEN_RETRY_MAX_SECONDS,
+):
+    """
+    Svuota l'outbox a ogni notifica su 'sync_outbox' e comunque ogni
+    `poll_seconds` (notifiche perse durante riconnessioni, retry).
+    Se la connessione LISTEN cade si riconnette con backoff esponenziale
+    (da `retry_min_seconds` a `retry_max_seconds`, azzerato a connessione
+    riuscita). Gira finché il task non viene cancellato.
+    """
+    delay = retry_min_seconds
+    while True:
+        listener = _OutboxListener()
+        try:
+            async with engine.connect() as connection:
+                await listener.start(connection)
+                delay = retry_min_seconds
+                await listener.run(drain, poll_seconds)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("outbox.listen_lost", channel=OUTBOX_CHANNEL, error=str(e), retry_in=delay)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, retry_max_seconds)
+
+
+class _OutboxListener:
+    """LISTEN su una connessione asyncpg: notifiche e chiusura svegliano il loop"""
+    
+    def __init__(self):
+        self.wakeup = asyncio.Event()
+        self.raw = None
+    
+    def _notified(self, *args):
+        self.wakeup.set()
+    
+    async def start(self, connection):
+        self.raw = (await connection.get_raw_connection()).driver_connection
+        await self.raw.add_listener(OUTBOX_CHANNEL, self._notified)
+        # Connessione chiusa dal server o dalla rete: si esce subito dall'attesa
+        self.raw.add_termination_listener(self._notified)
+    
+    async def run(self, drain: Callable[[], Awaitable[Any]], poll_seconds: float):
+        logger.info("outbox.listening", channel=OUTBOX_CHANNEL, poll_seconds=poll_seconds)
+        try:
+            while True:
+                self.wakeup.clear()
+                try:
+                    await drain()
+                except Exception as e:
+                    logger.error("outbox.drain_failed", error=str(e), exc_info=True)
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                if self.raw.is_closed():
+                    raise ConnectionError("LISTEN connection closed")
+        finally:
+            if not self.raw.is_closed():
+                await self.raw.remove_listener(OUTBOX_CHANNEL, self._notified)
+                self.raw.remove_termination_listener(self._notified)
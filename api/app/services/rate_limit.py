@@ -0,0 +1,163 @@
+"""
+Rate limiting adattivo per API esterne.
+
+Combina un token bucket (richieste/secondo) con un limite di concorrenza
+AIMD: la concorrenza cresce di uno per ogni "finestra" di risposte
+riuscite e si dimezza ad ogni throttling (429/503), mentre Retry-After
+mette in pausa tutte le richieste verso lo stesso endpoint.
+"""
+
+import asyncio
+import time
+import weakref
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Dict, Optional
+
+import structlog
+
+logger = structlog.get_logger()
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Converte l'header Retry-After (secondi o data HTTP) in secondi"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket: `rate` richieste/secondo con burst fino a `capacity`"""
+    
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def pause(self, seconds: float):
+        """Blocca tutte le acquisizioni per `seconds` (Retry-After)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limite di concorrenza AIMD (additive increase, multiplicative decrease)"""
+    
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 10, decrease_factor: float = 0.5):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_factor = decrease_factor
+        self.limit = float(min(max(initial, minimum), maximum))
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+    
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+    
+    async def release(self, throttled: bool = False):
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            else:
+                # +1 ogni `limit` successi, cioè circa +1 per round trip
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class RequestSlot:
+    """Slot di una richiesta; segnala throttling al limiter all'uscita"""
+    
+    def __init__(self):
+        self.throttled = False
+        self.retry_after: Optional[float] = None
+    
+    def mark_throttled(self, retry_after: Optional[float] = None):
+        self.throttled = True
+        self.retry_after = retry_after
+
+
+class AdaptiveRateLimiter:
+    """Token bucket + concorrenza AIMD per un singolo endpoint/tenant"""
+    
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+    ):
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrencyLimiter(
+            initial=max_concurrency,
+            minimum=min_concurrency,
+            maximum=max_concurrency,
+        )
+    
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[RequestSlot]:
+        await self.concurrency.acquire()
+        slot = RequestSlot()
+        try:
+            await self.bucket.acquire()
+            yield slot
+        finally:
+            if slot.throttled:
+                self.bucket.pause(slot.retry_after or 1.0)
+                logger.warning(
+                    "rate_limit.throttled",
+                    retry_after=slot.retry_after,
+                    concurrency=round(self.concurrency.limit, 2),
+                )
+            await self.concurrency.release(throttled=slot.throttled)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "concurrency_limit": round(self.concurrency.limit, 2),
+            "in_flight": self.concurrency.in_flight,
+        }
+
+
+# Un limiter per (event loop, chiave): le primitive asyncio sono legate al loop
+_limiters: "weakref.WeakKeyDictionary[Any, Dict[str, AdaptiveRateLimiter]]" = weakref.WeakKeyDictionary()
+
+
+def get_rate_limiter(
+    key: str,
+    rate: float,
+    burst: int,
+    max_concurrency: int,
+    min_concurrency: int = 1,
+) -> AdaptiveRateLimiter:
+    """Restituisce il limiter condiviso per `key` (es. base URL del tenant)"""
+    loop = asyncio.get_running_loop()
+    limiters = _limiters.setdefault(loop, {})
+    if key not in limiters:
+        limiters[key] = AdaptiveRateLimiter(rate, burst, max_concurrency, min_concurrency)
+    return limiters[key]
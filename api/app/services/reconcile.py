@@ -0,0 +1,162 @@
+"""
+Riconciliazione a bucket di hash (stile Merkle) tra sync_links e BC.
+
+Le sync incrementali su lastModifiedDateTime non vedono i record
+eliminati in BC, e uno scaricamento completo solo per trovarli costa
+quanto un import. Qui i record vengono ripartiti in bucket per hash
+dell'external_id e per ogni bucket si confrontano numero di record e
+somma dei digest di (external_id, versione):
+
+1. lato CRM un solo GROUP BY su sync_links (nessuna riga trasferita)
+2. lato BC un elenco leggero ($select=id: solo id ed ETag)
+3. solo per i bucket diversi si confrontano i singoli record, rileggendo
+   l'elenco BC e tenendo in memoria solo quei bucket
+
+La somma dei digest non dipende dall'ordine, quindi lo stesso riepilogo
+si calcola in SQL e in Python (le due implementazioni devono coincidere).
+La versione confrontata è l'ETag BC salvato in sync_links.version.
+"""
+
+import hashlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import BigInteger, bindparam, cast, delete, func, literal_column, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import contacts, sync_links
+
+# (numero record, somma dei digest)
+BucketSummary = Tuple[int, int]
+
+_BUCKET_SQL = "mod(('x' || substr(md5(external_id), 1, 8))::bit(32)::bigint, :buckets)"
+_DIGEST_SQL = "('x' || substr(md5(external_id || ':' || coalesce(version, '')), 1, 15))::bit(60)::bigint"
+
+
+def bucket_of(external_id: str, buckets: int) -> int:
+    """Bucket di un record (come _BUCKET_SQL)"""
+    return int(hashlib.md5(external_id.encode()).hexdigest()[:8], 16) % buckets
+
+
+def record_digest(external_id: str, version: Optional[str]) -> int:
+    """Digest di (external_id, versione) su 60 bit (come _DIGEST_SQL)"""
+    return int(hashlib.md5(f"{external_id}:{version or ''}".encode()).hexdigest()[:15], 16)
+
+
+@dataclass
+class BucketTree:
+    """Riepilogo per bucket accumulato record per record (lato BC)"""
+    buckets: int
+    summary: Dict[int, BucketSummary] = field(default_factory=dict)
+    
+    def add(self, external_id: str, version: Optional[str]):
+        bucket = bucket_of(external_id, self.buckets)
+        count, total = self.summary.get(bucket, (0, 0))
+        self.summary[bucket] = (count + 1, total + record_digest(external_id, version))
+    
+    def differing(self, other: Dict[int, BucketSummary]) -> Set[int]:
+        """Bucket con conteggio o somma diversi (presenti da una sola parte inclusi)"""
+        return {
+            bucket for bucket in self.summary.keys() | other.keys()
+            if self.summary.get(bucket) != other.get(bucket)
+        }
+
+
+@dataclass(frozen=True)
+class LinkedRecord:
+    """Record collegato lato CRM"""
+    crm_id: int
+    version: Optional[str]
+
+
+async def crm_bucket_summary(
+    db: AsyncSession,
+    source: str,
+    entity_type: str,
+    buckets: int,
+) -> Dict[int, BucketSummary]:
+    """Riepilogo per bucket dei link CRM con una sola query aggregata"""
+    result = await db.execute(
+        text(
+            f"SELECT {_BUCKET_SQL} AS bucket, count(*) AS records, sum({_DIGEST_SQL}) AS digest "
+            f"FROM sync_links WHERE source = :source AND entity_type = :entity_type "
+            f"GROUP BY 1"
+        ),
+        {"source": source, "entity_type": entity_type, "buckets": buckets},
+    )
+    return {row.bucket: (row.records, int(row.digest)) for row in result}
+
+
+async def crm_bucket_records(
+    db: AsyncSession,
+    source: str,
+    entity_type: str,
+    buckets: int,
+    bucket_ids: Iterable[int],
+) -> Dict[str, LinkedRecord]:
+    """Link CRM dei soli bucket indicati"""
+    result = await db.execute(
+        text(
+            f"SELECT external_id, crm_id, version FROM sync_links "
+            f"WHERE source = :source AND entity_type = :entity_type "
+            f"AND {_BUCKET_SQL} = ANY(:bucket_ids)"
+        ).bindparams(bindparam("bucket_ids", type_=ARRAY(BigInteger))),
+        {"source": source, "entity_type": entity_type, "buckets": buckets, "bucket_ids": sorted(bucket_ids)},
+    )
+    return {row.external_id: LinkedRecord(row.crm_id, row.version) for row in result}
+
+
+def diff_records(
+    crm: Dict[str, LinkedRecord],
+    external: Dict[str, Optional[str]],
+) -> Tuple[List[str], List[str], List[str]]:
+    """
+    Confronta i record dei bucket diversi.
+    
+    Args:
+        crm: external_id → link CRM
+        external: external_id → versione nel sistema esterno
+    
+    Returns:
+        (solo nel sistema esterno, versione diversa, solo nel CRM)
+    """
+    missing = sorted(external.keys() - crm.keys())
+    changed = sorted(
+        external_id for external_id in external.keys() & crm.keys()
+        if external[external_id] != crm[external_id].version
+    )
+    gone = sorted(crm.keys() - external.keys())
+    return missing, changed, gone
+
+
+async def archive_contacts(db: AsyncSession, source: str, entity_type: str, gone: Dict[str, LinkedRecord]) -> int:
+    """
+    Contatti eliminati nel sistema esterno: restano nel CRM con
+    external_data.deleted_at e senza link (la outbox non li invia più)
+    """
+    if not gone:
+        return 0
+    await db.execute(
+        update(contacts)
+        .where(contacts.c.id.in_([record.crm_id for record in gone.values()]))
+        .values(external_data=func.coalesce(contacts.c.external_data, cast({}, JSONB)).op("||")(
+            func.jsonb_build_object(literal_column("'deleted_at'"), func.now())
+        ))
+    )
+    await db.execute(
+        delete(sync_links).where(
+            sync_links.c.source == source,
+            sync_links.c.entity_type == entity_type,
+            sync_links.c.external_id.in_(list(gone)),
+        )
+    )
+    return len(gone)
+
+
+async def delete_contacts(db: AsyncSession, gone: Dict[str, LinkedRecord]) -> int:
+    """Contatti eliminati nel sistema esterno: eliminati anche nel CRM (i link dal trigger)"""
+    if not gone:
+        return 0
+    await db.execute(delete(contacts).where(contacts.c.id.in_([record.crm_id for record in gone.values()])))
+    return len(gone)
@@ -5,19 +5,120 @@ Gestisce logica di mapping, conflitti e trasformazioni.
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, insert, update, delete
-from typing import List, Dict, Any, Optional, Type
-from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from typing import AsyncIterator, Callable, List, Dict, Any, Optional, Sequence, Set, Tuple, Type, Union
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import Table
+from contextlib import asynccontextmanager
+import asyncio
+import uuid
+from datetime import datetime, timezone
 import structlog
 
+from app.config import get_settings
+
 from app.models.schemas import (
-    SyncSource, SyncDirection, EntityType,
+    SyncSource, SyncDirection, EntityType, LoadMode, DedupMode,
     ContactSync, CompanySync,
     DynamicsBCCustomer, DynamicsBCVendor,
 )
-from app.services.dynamics_bc import DynamicsBCClient, DynamicsBCError
+from app.services.bulk_load import CONTACTS_MERGE, DryRunDiff, MergeSpec, StagedMerge
+from app.services.checkpoints import StreamProgress, clear_checkpoint, has_checkpoint, load_checkpoint, save_checkpoint
+from app.services.company_index import CompanyIndex
+from app.services.company_writer import LINK_ENTITY_TYPE as COMPANY_LINK_ENTITY_TYPE, apply_companies, plan_companies
+from app.services.contact_writer import FILL_COLUMNS, LINK_ENTITY_TYPE, SYNC_UPDATE_COLUMNS, UPSERT_UPDATE_COLUMNS, upsert_contacts
+from app.services.dedup import REPORT_LIMIT, DuplicateMatch, find_duplicates, link_duplicates, merge_duplicates
+from app.services.reconcile import (
+    BucketTree, archive_contacts, bucket_of, crm_bucket_records, crm_bucket_summary, delete_contacts, diff_records,
+)
+from app.models.tables import companies, contacts
+from app.services.content_hash import content_hash
+from app.services.field_mapping import (
+    CompiledMapping, MappingError, Rule, SourceModels, compile_mapping, load_mapping, merge_rules, normalize_spec,
+)
+from app.services.link_cache import SyncLinkCache
+from app.services.outbox import BC_COMPANY_KEY, PushedHash, count_pending, drain_contact_outbox, mark_sync_source
+from app.services.sync_pipeline import SyncPipeline
+from app.services.watermarks import load_watermarks, parse_timestamp, save_watermark, watermark_filter
+from app.services.dynamics_bc import DynamicsBCClient, DynamicsBCError, select_fields
 
 logger = structlog.get_logger()
 
+# Mapping di default BC Customer → CRM Contact (regole di field_mapping).
+# displayName viene diviso in first_name/last_name; le regole custom
+# salvate in sync_mappings sostituiscono quelle sulla stessa colonna.
+DEFAULT_BC_CONTACT_RULES: List[Rule] = [
+    {"target": "first_name", "source": "displayName", "split": "first"},
+    {"target": "last_name", "source": "displayName", "split": "rest"},
+    {"target": "email_jsonb", "source": "email", "type": "Work"},
+    {"target": "phone_jsonb", "source": "phoneNumber", "type": "Work"},
+]
+
+# Campi BC senza colonna in contacts, scaricati comunque per external_data
+BC_CONTACT_EXTERNAL_FIELDS = ("addressLine1", "addressLine2", "city", "country")
+
+# Campi BC usati per collegare il contatto a un'azienda (CompanyIndex)
+BC_COMPANY_MATCH_FIELDS = ("taxRegistrationNumber", "email", "displayName")
+
+# Mapping di default BC Vendor / Customer di tipo Company → CRM Company.
+# BC restituisce "" per i campi vuoti: NULL non sovrascrive i valori CRM.
+# tax_identifier serve anche alla deduplica per partita IVA.
+DEFAULT_BC_COMPANY_RULES: List[Rule] = [
+    {"target": "name", "source": "displayName"},
+    {"target": "phone_number", "source": "phoneNumber", "normalize": "empty_to_none"},
+    {"target": "address", "source": "addressLine1", "normalize": "empty_to_none"},
+    {"target": "city", "source": "city", "normalize": "empty_to_none"},
+    {"target": "country", "source": "country", "normalize": "empty_to_none"},
+    {"target": "website", "source": "website", "normalize": "empty_to_none"},
+    {"target": "tax_identifier", "source": "taxRegistrationNumber", "normalize": "empty_to_none"},
+]
+BC_COMPANY_CUSTOMER_TYPE = "Company"
+
+# Entità con mapping configurabile: tabella CRM, modelli esterni (per le
+# aziende fornitori e clienti, solo campi comuni), regole di default
+MAPPING_TARGETS: Dict[Tuple[SyncSource, EntityType], Tuple[Table, SourceModels, List[Rule]]] = {
+    (SyncSource.DYNAMICS_BC, EntityType.CONTACT): (contacts, DynamicsBCCustomer, DEFAULT_BC_CONTACT_RULES),
+    (SyncSource.DYNAMICS_BC, EntityType.COMPANY): (
+        companies, (DynamicsBCVendor, DynamicsBCCustomer), DEFAULT_BC_COMPANY_RULES,
+    ),
+}
+
+# Dipendenze tra tipi entità: un tipo parte solo dopo quelli da cui
+# dipende (se richiesti nello stesso job), es. contatti dopo le aziende
+# a cui fanno riferimento, deal dopo aziende e contatti
+ENTITY_DEPENDENCIES: Dict[EntityType, Set[EntityType]] = {
+    EntityType.CONTACT: {EntityType.COMPANY, EntityType.TAG},
+    EntityType.DEAL: {EntityType.COMPANY, EntityType.CONTACT},
+    EntityType.TASK: {EntityType.CONTACT},
+    EntityType.NOTE: {EntityType.CONTACT, EntityType.DEAL},
+}
+
+
+def sync_levels(entity_types: List[EntityType]) -> List[List[EntityType]]:
+    """
+    Ordina i tipi richiesti in livelli: ogni livello dipende solo dai
+    precedenti, i tipi dello stesso livello sono indipendenti.
+    """
+    requested = list(dict.fromkeys(entity_types))
+    remaining = set(requested)
+    levels = []
+    while remaining:
+        level = [
+            entity_type for entity_type in requested
+            if entity_type in remaining and not (ENTITY_DEPENDENCIES.get(entity_type, set()) & remaining)
+        ]
+        if not level:
+            raise ValueError(f"Circular entity dependencies: {sorted(e.value for e in remaining)}")
+        levels.append(level)
+        remaining -= set(level)
+    return levels
+
+
+# Esclusi dal hash di contenuto: timestamp di sync e campi BC che cambiano
+# senza modifiche ai dati mappati
+CONTACT_HASH_EXCLUDE = ("first_seen", "last_seen", "last_synced_at")
+BC_VOLATILE_FIELDS = ("etag", "last_modified")
+
 
 class SyncEngine:
     """
@@ -25,9 +126,93 @@ class SyncEngine:
     Supporta multipli source e direzioni.
     """
     
-    def __init__(self, db: AsyncSession):
+    def __init__(
+        self,
+        db: AsyncSession,
+        contact_mapping: Optional[Any] = None,
+        session_factory: Optional[Callable[[], AsyncSession]] = None,
+        job_key: Optional[str] = None,
+    ):
         self.db = db
+        # Se presente, ogni batch è scritto in una sessione propria
+        # (necessario per più writer concorrenti nella pipeline)
+        self.session_factory = session_factory
+        # Chiave stabile tra i retry del job (es. task id Celery): abilita
+        # checkpoint per batch e ripresa dall'ultimo checkpoint
+        self.job_key = job_key
+        self._checkpoint_lock = asyncio.Lock()
         self._clients: Dict[SyncSource, Any] = {}
+        # Regole custom esplicite; senza, quelle salvate in sync_mappings
+        self.contact_mapping = normalize_spec(contact_mapping) if contact_mapping else None
+        self._mappings: Dict[Tuple[SyncSource, EntityType], CompiledMapping] = {}
+        # external_id → contacts.id/hash, caricati con una query per batch
+        self.links = SyncLinkCache(get_settings().SYNC_LINK_CACHE_SIZE)
+        # Aziende CRM per chiave, caricate alla prima entità che le usa
+        self._company_index: Optional[CompanyIndex] = None
+        # Engine del job per quelli creati da _fork (indice aziende condiviso)
+        self._parent: Optional["SyncEngine"] = None
+        # Record esterni nuovi già presenti nel CRM (email, telefono, nome)
+        self.dedup_mode = DedupMode(get_settings().SYNC_DEDUP_MODE)
+    
+    def compile_mapping(
+        self,
+        source: SyncSource,
+        entity_type: EntityType,
+        custom: Optional[List[Rule]] = None,
+    ) -> CompiledMapping:
+        """
+        Compila regole di default + custom per source/entità.
+        
+        Raises:
+            MappingError: entità senza mapping configurabile o regole non valide
+        """
+        if (source, entity_type) not in MAPPING_TARGETS:
+            raise MappingError([f"No configurable mapping for {source.value} {entity_type.value}"])
+        table, model, defaults = MAPPING_TARGETS[(source, entity_type)]
+        return compile_mapping(merge_rules(defaults, custom or []), table, model)
+    
+    async def active_mapping(self, source: SyncSource, entity_type: EntityType) -> CompiledMapping:
+        """Mapping attivo (compilato una volta per engine): esplicito, salvato o di default"""
+        key = (source, entity_type)
+        if key not in self._mappings:
+            custom = self.contact_mapping if entity_type == EntityType.CONTACT else None
+            if custom is None:
+                custom = await load_mapping(self.db, source.value, entity_type.value)
+            self._mappings[key] = self.compile_mapping(source, entity_type, custom)
+        return self._mappings[key]
+    
+    def contact_select(self, mapping: CompiledMapping) -> List[str]:
+        """
+        Campi BC da scaricare per i contatti: quelli letti dal mapping più
+        external_data, e il tipo per escludere i clienti azienda
+        """
+        match_fields = BC_COMPANY_MATCH_FIELDS if self.resolves_companies(mapping) else ()
+        return select_fields(
+            DynamicsBCCustomer,
+            [*mapping.source_fields, *BC_CONTACT_EXTERNAL_FIELDS, *match_fields, "type"],
+        )
+    
+    def company_select(self, mapping: CompiledMapping, model: Type[BaseModel]) -> List[str]:
+        """Campi BC da scaricare per le aziende: quelli letti dal mapping, e il tipo per i clienti"""
+        extra = ("type",) if model is DynamicsBCCustomer else ()
+        return select_fields(model, [*mapping.source_fields, *extra])
+    
+    def mapping_select(self, entity_type: EntityType, mapping: CompiledMapping) -> List[str]:
+        """Campi BC scaricati con un mapping (per le aziende: quelli dei clienti)"""
+        if entity_type == EntityType.COMPANY:
+            return self.company_select(mapping, DynamicsBCCustomer)
+        return self.contact_select(mapping)
+    
+    def resolves_companies(self, mapping: CompiledMapping) -> bool:
+        """company_id dall'indice aziende, se il mapping non lo imposta già"""
+        return get_settings().SYNC_COMPANY_RESOLUTION_ENABLED and "company_id" not in mapping.targets
+    
+    async def company_index(self) -> CompanyIndex:
+        """Indice aziende del run: una query, poi aggiornato in memoria dalle sync aziende"""
+        owner = self._parent or self
+        if owner._company_index is None:
+            owner._company_index = await CompanyIndex.load(self.db)
+        return owner._company_index
     
     async def sync(
         self,
@@ -36,10 +221,14 @@ class SyncEngine:
         entity_types: List[EntityType],
         dry_run: bool = False,
         filters: Optional[Dict[str, Any]] = None,
+        load_mode: LoadMode = LoadMode.INCREMENTAL,
     ) -> Dict[str, Any]:
         """
         Esegui sincronizzazione completa.
         
+        load_mode=BULK carica via COPY + MERGE (import iniziali),
+        INCREMENTAL con un upsert per batch.
+        
         Returns:
             Dict con statistiche e errori
         """
@@ -59,30 +248,79 @@ class SyncEngine:
             direction=direction,
             entities=entity_types,
             dry_run=dry_run,
+            load_mode=load_mode,
         )
         
         try:
-            # Sincronizza per ogni tipo entità
-            for entity_type in entity_types:
-                entity_result = await self._sync_entity_type(
-                    source=source,
-                    direction=direction,
-                    entity_type=entity_type,
-                    dry_run=dry_run,
-                    filters=filters,
-                )
+            # Livelli del grafo delle dipendenze: i tipi dello stesso livello
+            # sono indipendenti e girano in parallelo, ognuno con la sua sessione
+            failed_types: Set[EntityType] = set()
+            for level in sync_levels(entity_types):
+                runnable = []
+                for entity_type in level:
+                    blocked_by = ENTITY_DEPENDENCIES.get(entity_type, set()) & failed_types
+                    if blocked_by:
+                        failed_types.add(entity_type)
+                        results["success"] = False
+                        results["errors"].append({
+                            "type": "dependency",
+                            "entity": entity_type.value,
+                            "error": f"Skipped: dependency failed ({', '.join(sorted(e.value for e in blocked_by))})",
+                        })
+                    else:
+                        runnable.append(entity_type)
+                
+                async def run(entity_type: EntityType) -> Dict[str, Any]:
+                    return await self._sync_entity_isolated(
+                        source=source,
+                        direction=direction,
+                        entity_type=entity_type,
+                        dry_run=dry_run,
+                        filters=filters,
+                        load_mode=load_mode,
+                    )
+                
+                if self.session_factory:
+                    entity_results = await asyncio.gather(
+                        *(run(entity_type) for entity_type in runnable),
+                        return_exceptions=True,
+                    )
+                else:
+                    # Una sola sessione condivisa: niente concorrenza
+                    entity_results = []
+                    for entity_type in runnable:
+                        try:
+                            entity_results.append(await run(entity_type))
+                        except Exception as e:
+                            entity_results.append(e)
                 
-                results["created"] += entity_result.get("created", 0)
-                results["updated"] += entity_result.get("updated", 0)
-                results["skipped"] += entity_result.get("skipped", 0)
-                results["failed"] += entity_result.get("failed", 0)
-                results["stats"][entity_type.value] = entity_result
-                results["errors"].extend(entity_result.get("errors", []))
+                for entity_type, entity_result in zip(runnable, entity_results):
+                    if isinstance(entity_result, Exception):
+                        logger.error("sync.entity_failed", entity=entity_type.value, error=str(entity_result))
+                        failed_types.add(entity_type)
+                        results["success"] = False
+                        results["errors"].append({
+                            "type": "fatal",
+                            "entity": entity_type.value,
+                            "error": str(entity_result),
+                        })
+                        continue
+                    
+                    results["created"] += entity_result.get("created", 0)
+                    results["updated"] += entity_result.get("updated", 0)
+                    results["skipped"] += entity_result.get("skipped", 0)
+                    results["failed"] += entity_result.get("failed", 0)
+                    results["stats"][entity_type.value] = entity_result
+                    results["errors"].extend(entity_result.get("errors", []))
             
             # Determina successo
-            if results["failed"] > 0:
+            if results["success"] and results["failed"] > 0:
                 results["success"] = results["created"] + results["updated"] > 0
             
+            # Job interrotto con checkpoint salvati: un retry riprende da lì
+            if self.job_key and not dry_run:
+                results["resumable"] = await has_checkpoint(self.db, self.job_key)
+        
         except Exception as e:
             logger.error("sync.failed", error=str(e), exc_info=True)
             results["success"] = False
@@ -101,6 +339,34 @@ class SyncEngine:
         
         return results
     
+    async def _sync_entity_isolated(self, **kwargs) -> Dict[str, Any]:
+        """Sincronizza un tipo entità nella propria sessione (se c'è session_factory)"""
+        if self.session_factory is None:
+            return await self._sync_entity_type(**kwargs)
+        
+        async with self.session_factory() as session:
+            return await self._fork(session)._sync_entity_type(**kwargs)
+    
+    def _fork(self, session: AsyncSession) -> "SyncEngine":
+        """
+        Engine per un tipo entità con sessione propria (sync concorrenti).
+        
+        Stato nuovo per tutto ciò che è legato alla sessione o all'entità
+        (client, lock dei checkpoint, dedup). Condivisi di proposito, e
+        usati solo dal loop asyncio del job (nessun thread):
+        - contact_mapping e _mappings: regole compilate una volta per job
+        - links: cache dei link, chiavi separate per entity_type; annullata
+          per batch su rollback (vedi _write_contacts/_write_companies)
+        - indice aziende: caricato e aggiornato sull'engine padre
+          (company_index), così i contatti vedono le aziende appena scritte
+        """
+        engine = SyncEngine(session, session_factory=self.session_factory, job_key=self.job_key)
+        engine.contact_mapping = self.contact_mapping
+        engine._mappings = self._mappings
+        engine.links = self.links
+        engine._parent = self
+        return engine
+    
     async def _sync_entity_type(
         self,
         source: SyncSource,
@@ -108,6 +374,7 @@ class SyncEngine:
         entity_type: EntityType,
         dry_run: bool,
         filters: Optional[Dict[str, Any]],
+        load_mode: LoadMode = LoadMode.INCREMENTAL,
     ) -> Dict[str, Any]:
         """Sincronizza singolo tipo entità"""
         
@@ -115,7 +382,9 @@ class SyncEngine:
         
         if source == SyncSource.DYNAMICS_BC:
             if entity_type == EntityType.CONTACT:
-                return await self._sync_dynamics_bc_contacts(direction, dry_run, filters)
+                if (filters or {}).get("reconcile") and direction != SyncDirection.OUTBOUND:
+                    return await self._reconcile_dynamics_bc_contacts(dry_run)
+                return await self._sync_dynamics_bc_contacts(direction, dry_run, filters, load_mode)
             elif entity_type == EntityType.COMPANY:
                 return await self._sync_dynamics_bc_companies(direction, dry_run, filters)
         
@@ -128,6 +397,7 @@ class SyncEngine:
         direction: SyncDirection,
         dry_run: bool,
         filters: Optional[Dict[str, Any]],
+        load_mode: LoadMode = LoadMode.INCREMENTAL,
     ) -> Dict[str, Any]:
         """Sincronizza contatti da/a Dynamics BC"""
         result = {"created": 0, "updated": 0, "skipped": 0, "failed": 0, "errors": []}
@@ -135,84 +405,720 @@ class SyncEngine:
         if direction in [SyncDirection.INBOUND, SyncDirection.BIDIRECTIONAL]:
             # BC → CRM
             async with DynamicsBCClient() as client:
-                # Determina data ultima sync
-                modified_since = None
-                if filters and filters.get("last_sync"):
-                    modified_since = filters["last_sync"]
+                settings = get_settings()
                 
-                # Fetch customers
-                try:
-                    customers = await client.get_customers(modified_since=modified_since)
-                    logger.info("dynamics_bc.fetched_customers", count=len(customers))
+                # Mapping compilato una volta per job (MappingError → entità fallita)
+                mapping = await self.active_mapping(SyncSource.DYNAMICS_BC, EntityType.CONTACT)
+                update_columns, fill_columns, company_index = await self._contact_write_options(mapping)
+                
+                # Data ultima sync: filters.last_sync esplicito, altrimenti
+                # high-water mark salvato per company meno la finestra di
+                # overlap; filters.full_sync forza lo scaricamento completo
+                filters = filters or {}
+                last_sync = parse_timestamp(filters.get("last_sync"))
+                stored_watermarks: Dict[str, datetime] = {}
+                if last_sync is None and not filters.get("full_sync"):
+                    stored_watermarks = await load_watermarks(
+                        self.db, SyncSource.DYNAMICS_BC.value, EntityType.CONTACT.value
+                    )
+                
+                # Ripresa dall'ultimo checkpoint di un tentativo precedente del job
+                checkpointing = bool(self.job_key) and not dry_run
+                checkpoint = None
+                if checkpointing:
+                    checkpoint = await self._load_checkpoint(
+                        EntityType.CONTACT, CONTACTS_MERGE, bulk=load_mode == LoadMode.BULK
+                    )
+                
+                # Per company: filtro, righe applicate senza buchi e massimo
+                # lastModifiedDateTime scaricato
+                progress = StreamProgress()
+                if checkpoint:
+                    progress = StreamProgress.from_state(
+                        checkpoint["companies"], rewind=settings.DYNAMICS_BC_PAGE_SIZE
+                    )
+                    # Contatori da zero: la pagina riletta e i batch applicati
+                    # oltre la posizione salvata sarebbero contati due volte
+                    result["resumed_from"] = {
+                        company_id: company.position for company_id, company in progress.companies.items()
+                    }
+                
+                # Pipeline fetch → transform → write su code limitate: lo
+                # stream dei customers (per ogni company, risolta una sola
+                # volta) prosegue mentre i batch di SYNC_BATCH_SIZE righe
+                # vengono scritti con un upsert oppure, in bulk, copiati
+                # nello staging e applicati alla fine con un MERGE; in
+                # dry_run copiati in una tabella temporanea e confrontati
+                loader = None
+                preview = None
+                batch_size = settings.SYNC_BATCH_SIZE
+                if dry_run:
+                    preview = await self._dry_run_preview(mapping, fill_columns)
+                    batch_size = settings.SYNC_BULK_COPY_BATCH_SIZE
+                elif load_mode == LoadMode.BULK:
+                    loader = StagedMerge(
+                        self.db,
+                        CONTACTS_MERGE.with_columns(mapping.targets, fill=fill_columns),
+                        run_id=uuid.UUID(checkpoint["run_id"]) if checkpoint else None,
+                        staged=checkpoint["staged"] if checkpoint else 0,
+                    )
+                    batch_size = settings.SYNC_BULK_COPY_BATCH_SIZE
+                
+                # Writer paralleli solo con una sessione per batch (lo staging
+                # bulk e la tabella temporanea del dry_run usano self.db)
+                write_workers = 1
+                if self.session_factory and not (loader or preview):
+                    write_workers = settings.SYNC_PIPELINE_WRITE_WORKERS
+                
+                synced_at = datetime.now(timezone.utc)
+                stream_complete = False
+                
+                async def customers():
+                    nonlocal stream_complete
+                    try:
+                        for company_id in await client.get_company_ids():
+                            company = progress.companies.get(company_id)
+                            if company is None:
+                                company = progress.start(company_id, last_sync or watermark_filter(
+                                    stored_watermarks.get(company_id),
+                                    settings.SYNC_WATERMARK_OVERLAP_SECONDS,
+                                ))
+                            elif company.done:
+                                continue  # Completata in un tentativo precedente
+                            
+                            # Stesso filtro del tentativo precedente e $skip sulla posizione
+                            start = company.position
+                            parse_errors = client.stats["parse_errors"]
+                            async for customer in client.iter_customers(
+                                modified_since=company.since,
+                                company_id=company_id,
+                                select=self.contact_select(mapping),
+                                skip=start,
+                            ):
+                                # Le righe scartate in decodifica occupano comunque uno slot
+                                if client.stats["parse_errors"] > parse_errors:
+                                    progress.skip(company_id, client.stats["parse_errors"] - parse_errors)
+                                    parse_errors = client.stats["parse_errors"]
+                                progress.observe(company_id, customer.last_modified)
+                                # Clienti di tipo Company: sono aziende (sync company), non contatti
+                                if customer.type == BC_COMPANY_CUSTOMER_TYPE:
+                                    progress.skip(company_id, 1)
+                                    continue
+                                yield company_id, progress.next_slot(company_id), customer
+                            progress.skip(company_id, client.stats["parse_errors"] - parse_errors)
+                            company.exhausted = True
+                            logger.info(
+                                "dynamics_bc.fetched_customers",
+                                company_id=company_id,
+                                count=company.next_slot - start,
+                                skip=start,
+                                modified_since=company.since.isoformat() if company.since else None,
+                            )
+                        stream_complete = True
                     
-                    for customer in customers:
-                        try:
-                            sync_result = await self._upsert_contact_from_bc(customer, dry_run)
-                            if sync_result == "created":
-                                result["created"] += 1
-                            elif sync_result == "updated":
-                                result["updated"] += 1
-                            else:
-                                result["skipped"] += 1
-                        except Exception as e:
-                            result["failed"] += 1
-                            result["errors"].append({
-                                "entity": "contact",
-                                "external_id": customer.id,
-                                "error": str(e),
-                            })
+                    except DynamicsBCError as e:
+                        # Le righe già scaricate vengono comunque scritte
+                        result["errors"].append({
+                            "entity": "connection",
+                            "error": str(e),
+                        })
                 
-                except DynamicsBCError as e:
-                    result["errors"].append({
-                        "entity": "connection",
-                        "error": str(e),
-                    })
+                def transform(item) -> Optional[tuple]:
+                    company_id, slot, customer = item
+                    try:
+                        return company_id, slot, self._contact_row_from_bc(
+                            customer, synced_at, mapping, company_index, bc_company_id=company_id,
+                        )
+                    except Exception as e:
+                        result["failed"] += 1
+                        result["errors"].append({
+                            "entity": "contact",
+                            "external_id": customer.id,
+                            "error": str(e),
+                        })
+                        progress.complete([(company_id, slot)])
+                        return None
+                
+                async def write(items: List[tuple]):
+                    await self._write_contacts(
+                        [row for _, _, row in items], dry_run, result, loader or preview, update_columns, fill_columns
+                    )
+                    # Anche le righe fallite avanzano la posizione: sono nei
+                    # contatori e l'high-water mark non avanza
+                    progress.complete((company_id, slot) for company_id, slot, _ in items)
+                    if checkpointing:
+                        await self._save_checkpoint(EntityType.CONTACT, progress, loader)
+                
+                pipeline = SyncPipeline(
+                    batch_size=batch_size,
+                    queue_size=settings.SYNC_PIPELINE_QUEUE_SIZE,
+                    transform_workers=settings.SYNC_PIPELINE_TRANSFORM_WORKERS,
+                    write_workers=write_workers,
+                )
+                result["pipeline"] = await pipeline.run(customers(), transform, write)
+                
+                # Fetch interrotto con checkpoint salvato: lo staging bulk resta
+                # per il retry del job invece di essere applicato a metà
+                resume_later = checkpointing and not stream_complete
+                if loader and not resume_later:
+                    await self._merge_staged(loader, result)
+                if preview:
+                    await self._finish_preview(preview, result)
+                
+                # Righe BC scartate in decodifica (validazione fallita)
+                result["failed"] += client.stats["parse_errors"]
+                result["errors"].extend(
+                    {"entity": "contact", **error} for error in client.parse_errors
+                )
+                
+                # L'high-water mark avanza solo se tutte le righe scaricate sono
+                # state applicate (le righe BC non sono ordinate per data) e
+                # solo per le company lette fino in fondo
+                if not dry_run and result["failed"] == 0:
+                    result["watermarks"] = await self._save_watermarks(
+                        EntityType.CONTACT, progress.completed_high_water()
+                    )
+                
+                if checkpointing and not resume_later:
+                    await self._clear_checkpoint(EntityType.CONTACT)
+                
+                # Richieste, throttling e retry verso BC
+                result["http"] = client.http_stats
+                result["links"] = {**self.links.stats, "cached": len(self.links)}
+                if company_index is not None:
+                    result["companies"] = {**company_index.stats, "indexed": len(company_index)}
         
         if direction in [SyncDirection.OUTBOUND, SyncDirection.BIDIRECTIONAL]:
-            # CRM → BC (da implementare)
-            pass
+            # CRM → BC: solo i contatti modificati, catturati in sync_outbox
+            outbound = await self.push_contact_changes(dry_run)
+            result["outbound"] = outbound
+            if dry_run:
+                result["skipped"] += outbound["pending"]
+            else:
+                result["created"] += outbound["created"]
+                result["updated"] += outbound["updated"]
+                result["failed"] += outbound["failed"]
+                result["errors"].extend(outbound.pop("errors"))
+        
+        return result
+    
+    async def _contact_write_options(
+        self,
+        mapping: CompiledMapping,
+    ) -> Tuple[Tuple[str, ...], Tuple[str, ...], Optional[CompanyIndex]]:
+        """Colonne aggiornate, colonne fill e indice aziende per il mapping attivo"""
+        update_columns = (*mapping.targets, *SYNC_UPDATE_COLUMNS)
+        # Aziende risolte in memoria: nessuna query per batch
+        if self.resolves_companies(mapping):
+            return update_columns, FILL_COLUMNS, await self.company_index()
+        return update_columns, (), None
+    
+    async def _dry_run_preview(self, mapping: CompiledMapping, fill_columns: Tuple[str, ...]) -> DryRunDiff:
+        """Tabella temporanea per il diff del dry_run (nella sessione del job)"""
+        preview = DryRunDiff(
+            self.db,
+            CONTACTS_MERGE.with_columns(mapping.targets, fill=fill_columns),
+            ignore=SYNC_UPDATE_COLUMNS,
+            sample_size=get_settings().SYNC_DRY_RUN_SAMPLE_SIZE,
+        )
+        await preview.create()
+        return preview
+    
+    async def _finish_preview(self, preview: DryRunDiff, result: Dict[str, Any]):
+        """Contatori previsti del dry_run dal diff calcolato nel database"""
+        try:
+            report = await preview.diff()
+            await preview.drop()
+        except SQLAlchemyError as e:
+            # Rollback: anche la tabella temporanea, creata nella transazione, sparisce
+            await self.db.rollback()
+            logger.error("sync.dry_run_diff_failed", staged=preview.staged, error=str(e))
+            result["failed"] += preview.staged
+            result["errors"].append({
+                "entity": "contact",
+                "error": f"Dry run diff failed: {e}",
+            })
+            return
         
+        result["created"] += report.created
+        result["updated"] += report.updated
+        result["skipped"] += report.unchanged
+        result["diff"] = report.as_dict()
+    
+    async def _reconcile_dynamics_bc_contacts(self, dry_run: bool) -> Dict[str, Any]:
+        """
+        Controllo di consistenza CRM ↔ BC (filters.reconcile): confronto a
+        bucket di hash (vedi app.services.reconcile), poi rilettura con
+        $batch e scrittura dei soli record diversi; quelli eliminati in BC
+        vengono archiviati, eliminati o solo segnalati (SYNC_RECONCILE_DELETED).
+        """
+        result = {"created": 0, "updated": 0, "skipped": 0, "failed": 0, "errors": []}
+        settings = get_settings()
+        source = SyncSource.DYNAMICS_BC.value
+        entity = EntityType.CONTACT.value
+        buckets = settings.SYNC_RECONCILE_BUCKETS
+        
+        async with DynamicsBCClient() as client:
+            mapping = await self.active_mapping(SyncSource.DYNAMICS_BC, EntityType.CONTACT)
+            update_columns, fill_columns, company_index = await self._contact_write_options(mapping)
+            
+            # Livello 1: riepilogo CRM (una query) prima dell'elenco BC, così un
+            # record creato durante l'elenco risulta al più "solo in BC"
+            crm_summary = await crm_bucket_summary(self.db, source, entity, buckets)
+            tree = BucketTree(buckets)
+            try:
+                company_ids = await client.get_company_ids()
+                for company_id in company_ids:
+                    async for record in client.iter_customer_versions(company_id):
+                        if record.type != BC_COMPANY_CUSTOMER_TYPE:
+                            tree.add(record.id, record.etag)
+            except DynamicsBCError as e:
+                # Elenco incompleto: nessuna azione, i record mancanti sembrerebbero eliminati
+                result["errors"].append({"entity": "connection", "error": str(e)})
+                return result
+            
+            differing = tree.differing(crm_summary)
+            stats = result["reconcile"] = {
+                "buckets": buckets,
+                "differing_buckets": len(differing),
+                "external_records": sum(count for count, _ in tree.summary.values()),
+                "crm_records": sum(count for count, _ in crm_summary.values()),
+            }
+            if not differing:
+                result["http"] = client.http_stats
+                return result
+            
+            # Livello 2: record dei soli bucket diversi, da entrambe le parti
+            external: Dict[str, Optional[str]] = {}
+            owners: Dict[str, str] = {}
+            try:
+                for company_id in company_ids:
+                    async for record in client.iter_customer_versions(company_id):
+                        if record.type != BC_COMPANY_CUSTOMER_TYPE and bucket_of(record.id, buckets) in differing:
+                            external[record.id] = record.etag
+                            owners[record.id] = company_id
+            except DynamicsBCError as e:
+                result["errors"].append({"entity": "connection", "error": str(e)})
+                return result
+            crm = await crm_bucket_records(self.db, source, entity, buckets, differing)
+            missing, changed, gone = diff_records(crm, external)
+            stats.update(missing=len(missing), changed=len(changed), gone=len(gone))
+            
+            # Rilettura dei record diversi: i mancanti nell'elenco vanno
+            # confermati (404 in ogni company) prima di considerarli eliminati
+            select = self.contact_select(mapping)
+            fetched: Dict[str, Any] = {}
+            not_found: Dict[str, int] = {}
+            try:
+                by_company: Dict[str, List[str]] = {}
+                for external_id in (*missing, *changed):
+                    by_company.setdefault(owners[external_id], []).append(external_id)
+                for company_id, external_ids in by_company.items():
+                    fetched.update(await client.fetch_customers(external_ids, company_id, select=select))
+                unconfirmed = list(gone)
+                for company_id in company_ids:
+                    if not unconfirmed:
+                        break
+                    found = await client.fetch_customers(unconfirmed, company_id, select=select)
+                    for external_id, customer in found.items():
+                        if customer is None:
+                            not_found[external_id] = not_found.get(external_id, 0) + 1
+                        else:
+                            fetched[external_id] = customer
+                            owners[external_id] = company_id
+                    unconfirmed = [external_id for external_id in unconfirmed if external_id not in fetched]
+            except DynamicsBCError as e:
+                result["errors"].append({"entity": "connection", "error": str(e)})
+            
+            synced_at = datetime.now(timezone.utc)
+            rows = [
+                self._contact_row_from_bc(customer, synced_at, mapping, company_index, bc_company_id=owners[external_id])
+                for external_id, customer in fetched.items()
+                if customer is not None and customer.type != BC_COMPANY_CUSTOMER_TYPE
+            ]
+            preview = await self._dry_run_preview(mapping, fill_columns) if dry_run and rows else None
+            for start in range(0, len(rows), settings.SYNC_BATCH_SIZE):
+                await self._write_contacts(
+                    rows[start:start + settings.SYNC_BATCH_SIZE],
+                    dry_run, result, preview, update_columns, fill_columns,
+                )
+            if preview:
+                await self._finish_preview(preview, result)
+            
+            deleted = {
+                external_id: crm[external_id]
+                for external_id, count in not_found.items() if count == len(company_ids)
+            }
+            stats["deleted"] = len(deleted)
+            await self._apply_deleted(deleted, dry_run, result)
+            
+            result["failed"] += client.stats["parse_errors"]
+            result["errors"].extend({"entity": "contact", **error} for error in client.parse_errors)
+            result["http"] = client.http_stats
+        
+        logger.info("sync.reconciled", entity=entity, dry_run=dry_run, **stats)
         return result
     
-    async def _upsert_contact_from_bc(
-        self, 
-        customer: DynamicsBCCustomer, 
-        dry_run: bool
-    ) -> str:
+    async def _apply_deleted(self, deleted: Dict[str, Any], dry_run: bool, result: Dict[str, Any]):
+        """Contatti eliminati in BC: archiviati, eliminati o solo segnalati"""
+        action = get_settings().SYNC_RECONCILE_DELETED
+        stats = result["reconcile"]
+        stats["deleted_action"] = action
+        if not deleted or dry_run or action == "report":
+            stats["deleted_ids"] = sorted(deleted)[:REPORT_LIMIT]
+            return
+        
+        try:
+            if action == "delete":
+                await delete_contacts(self.db, deleted)
+            else:
+                await archive_contacts(self.db, SyncSource.DYNAMICS_BC.value, EntityType.CONTACT.value, deleted)
+            await self.db.commit()
+        except SQLAlchemyError as e:
+            await self.db.rollback()
+            result["failed"] += len(deleted)
+            result["errors"].append({"entity": "contact", "external_ids": sorted(deleted), "error": str(e)})
+            return
+        # Link rimossi: la cache non deve più vederli
+        for external_id in deleted:
+            self.links.discard(SyncSource.DYNAMICS_BC.value, LINK_ENTITY_TYPE, external_id)
+    
+    async def push_contact_changes(self, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Invia a BC i contatti modificati nel CRM (sync_outbox), a batch
+        fino a svuotare l'outbox. In dry run conta solo le modifiche in attesa.
         """
-        Inserisce o aggiorna contatto da Dynamics BC.
+        settings = get_settings()
+        if dry_run:
+            return {"pending": await count_pending(self.db, EntityType.CONTACT.value, settings.SYNC_OUTBOX_MAX_ATTEMPTS)}
         
-        Returns:
-            "created", "updated", o "skipped"
+        mapping = await self.active_mapping(SyncSource.DYNAMICS_BC, EntityType.CONTACT)
+        _, _, company_index = await self._contact_write_options(mapping)
+        async with DynamicsBCClient() as client:
+            # Ogni cliente viene scritto nella company BC da cui è stato letto
+            # (external_data); i contatti nuovi in quella configurata/di default
+            client.company_id = await client.resolve_company_id()
+            return await drain_contact_outbox(
+                self.db,
+                client,
+                self.links,
+                batch_size=settings.SYNC_OUTBOX_BATCH_SIZE,
+                max_attempts=settings.SYNC_OUTBOX_MAX_ATTEMPTS,
+                claim_timeout=settings.SYNC_OUTBOX_CLAIM_TIMEOUT_SECONDS,
+                pushed_hash=self._pushed_contact_hash(mapping, company_index),
+            )
+    
+    def _pushed_contact_hash(
+        self,
+        mapping: CompiledMapping,
+        company_index: Optional[CompanyIndex],
+    ) -> PushedHash:
+        """
+        Hash in ingresso del cliente restituito da BC dopo un invio: calcolato
+        sugli stessi campi ($select), con lo stesso mapping e la stessa
+        company della sync in ingresso, che quindi non riscrive ciò che è
+        appena stato inviato
         """
-        # Mappa BC Customer → CRM Contact
-        contact_data = {
-            "first_name": self._extract_first_name(customer.display_name),
-            "last_name": self._extract_last_name(customer.display_name),
-            "email": customer.email,
-            "phone": customer.phone,
-            "address": customer.address,
-            "city": customer.city,
-            "country": customer.country,
+        fields = set(self.contact_select(mapping)) | {"@odata.etag"}
+        
+        def pushed_hash(body: Dict[str, Any], bc_company_id: str) -> Optional[str]:
+            try:
+                customer = DynamicsBCCustomer.model_validate({k: v for k, v in body.items() if k in fields})
+            except ValidationError:
+                return None
+            row = self._contact_row_from_bc(
+                customer, datetime.now(timezone.utc), mapping, company_index, bc_company_id=bc_company_id,
+            )
+            return row["external_hash"]
+        
+        return pushed_hash
+    
+    def _contact_row_from_bc(
+        self,
+        customer: DynamicsBCCustomer,
+        synced_at: datetime,
+        mapping: CompiledMapping,
+        company_index: Optional[CompanyIndex] = None,
+        bc_company_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Mappa BC Customer → riga della tabella contacts (con external_hash).
+        La company BC di provenienza resta in external_data: la sync in
+        uscita scrive il cliente in quella company.
+        """
+        row = {
+            **mapping(customer),
+            "first_seen": synced_at,
+            "last_seen": synced_at,
+            "external_source": SyncSource.DYNAMICS_BC.value,
             "external_id": customer.id or customer.number,
-            "source": SyncSource.DYNAMICS_BC,
-            "last_sync_at": datetime.utcnow(),
-            "raw_data": customer.model_dump(),
+            # Indirizzo, città e paese non hanno colonne in contacts (il tipo
+            # serve solo a filtrare, fuori dal hash)
+            "external_data": {
+                **customer.model_dump(mode="json", exclude_none=True, exclude={"type"}),
+                **({BC_COMPANY_KEY: bc_company_id} if bc_company_id else {}),
+            },
+            "external_version": customer.etag,
+            "last_synced_at": synced_at,
         }
+        hash_exclude = (*CONTACT_HASH_EXCLUDE, "external_version")
+        if company_index is not None:
+            row["company_id"] = company_index.resolve(
+                vat=customer.vat_registration_no,
+                email=customer.email,
+                name=customer.display_name,
+            )
+            # Senza azienda il hash resta quello di prima della risoluzione
+            if row["company_id"] is None:
+                hash_exclude += ("company_id",)
+        row["external_hash"] = content_hash(
+            {
+                **row,
+                "external_data": {
+                    k: v for k, v in row["external_data"].items() if k not in BC_VOLATILE_FIELDS
+                },
+            },
+            exclude=hash_exclude,
+        )
+        return row
+    
+    async def _write_contacts(
+        self,
+        rows: List[Dict[str, Any]],
+        dry_run: bool,
+        result: Dict[str, Any],
+        loader: Optional[StagedMerge] = None,
+        update_columns: Tuple[str, ...] = UPSERT_UPDATE_COLUMNS,
+        fill_columns: Tuple[str, ...] = (),
+    ):
+        """
+        Scrive un batch di contatti con un solo upsert e aggiorna i contatori.
+        Commit per batch: un errore invalida solo il batch corrente.
+        Con `loader` (load_mode bulk) il batch viene solo copiato nello staging;
+        in dry_run nella tabella temporanea del diff, se c'è.
+        """
+        if not rows:
+            return
         
         if dry_run:
-            logger.debug("sync.dry_run", contact=contact_data)
-            return "skipped"
+            logger.debug("sync.dry_run", contacts=len(rows))
+            if loader:
+                await loader.stage(rows)
+            else:
+                result["skipped"] += len(rows)
+            return
+        
+        async with self._write_session(shared=loader is not None) as db:
+            try:
+                # Righe ricevute da BC: i trigger non le accodano in outbox
+                await mark_sync_source(db, SyncSource.DYNAMICS_BC.value)
+                if loader:
+                    await self._match_duplicates(db, rows, result, bulk=True)
+                    await loader.stage(rows)
+                    await db.commit()
+                    return
+                
+                to_merge: List[DuplicateMatch] = []
+                
+                async def dedup(unlinked: List[Dict[str, Any]]):
+                    to_merge.extend(await self._match_duplicates(db, unlinked, result))
+                
+                created, updated, unchanged = await upsert_contacts(
+                    db, rows, self.links, update_columns, fill_columns, before_insert=dedup
+                )
+                if to_merge:
+                    result["dedup"]["merged"] += await merge_duplicates(db, [
+                        (match.contact_id, self.links.get(SyncSource.DYNAMICS_BC.value, LINK_ENTITY_TYPE, match.external_id).crm_id)
+                        for match in to_merge
+                    ])
+                await db.commit()
+            except SQLAlchemyError as e:
+                await db.rollback()
+                self.links.invalidate(SyncSource.DYNAMICS_BC.value, LINK_ENTITY_TYPE, (row["external_id"] for row in rows))
+                error = e
+            else:
+                error = None
+        
+        if error:
+            logger.error("sync.upsert_contacts_failed", rows=len(rows), error=str(error))
+            result["failed"] += len(rows)
+            result["errors"].append({
+                "entity": "contact",
+                "external_ids": [row["external_id"] for row in rows],
+                "error": str(error),
+            })
+            return
+        
+        result["created"] += created
+        result["updated"] += updated
+        result["skipped"] += unchanged
+        logger.info("sync.upsert_contacts", created=created, updated=updated, unchanged=unchanged)
+    
+    async def _match_duplicates(
+        self,
+        db: AsyncSession,
+        rows: List[Dict[str, Any]],
+        result: Dict[str, Any],
+        bulk: bool = False,
+    ) -> List[DuplicateMatch]:
+        """
+        Cerca i duplicati CRM delle righe senza link (una query per batch)
+        e li collega secondo dedup_mode. Con `bulk` le righe sono tutte
+        quelle del chunk e i link vengono caricati qui; il contatto
+        sincronizzato esiste solo dopo il MERGE, quindi i duplicati vengono
+        collegati anche in modalità merge.
+        
+        Returns:
+            Match da unire con merge_contacts dopo l'upsert (modalità merge)
+        """
+        if self.dedup_mode == DedupMode.OFF:
+            return []
+        stats = result.setdefault("dedup", {
+            "mode": self.dedup_mode.value,
+            "candidates": 0,
+            "matched": 0,
+            "ambiguous": 0,
+            "linked": 0,
+            "merged": 0,
+        })
         
-        # TODO: Implementare query SQL su tabella contacts
-        # Per ora logghiamo
-        logger.info("sync.upsert_contact", external_id=contact_data["external_id"])
+        source = rows[0]["external_source"]
+        if bulk:
+            await self.links.warm(db, source, LINK_ENTITY_TYPE, (row["external_id"] for row in rows))
+            rows = [row for row in rows if self.links.get(source, LINK_ENTITY_TYPE, row["external_id"]) is None]
         
-        # Query: cerca per external_id
-        # Se esiste: UPDATE
-        # Se non esiste: INSERT
+        report = self.dedup_mode == DedupMode.REPORT
+        matches = await find_duplicates(db, rows, stats, lock=not report)
+        if report:
+            reported = stats.setdefault("matches", [])
+            reported.extend(match.as_dict() for match in matches[:REPORT_LIMIT - len(reported)])
+            return []
+        if self.dedup_mode == DedupMode.MERGE and not bulk:
+            return matches
+        stats["linked"] += await link_duplicates(db, source, matches)
+        return []
+    
+    async def _save_watermarks(
+        self,
+        entity_type: EntityType,
+        high_water: Dict[str, datetime],
+    ) -> Dict[str, str]:
+        """Salva gli high-water mark per company (mai all'indietro)"""
+        if not high_water:
+            return {}
+        try:
+            for company_id, value in high_water.items():
+                await save_watermark(self.db, SyncSource.DYNAMICS_BC.value, company_id, entity_type.value, value)
+            await self.db.commit()
+        except SQLAlchemyError as e:
+            await self.db.rollback()
+            logger.error("sync.watermark_failed", entity=entity_type.value, error=str(e))
+            return {}
+        return {company_id: value.isoformat() for company_id, value in high_water.items()}
+    
+    async def _load_checkpoint(
+        self,
+        entity_type: EntityType,
+        spec: MergeSpec,
+        bulk: bool,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Checkpoint del job per l'entità, se riprendibile: scartato se la
+        modalità di caricamento è cambiata o lo staging bulk è incompleto
+        (tabella UNLOGGED svuotata da un crash di Postgres).
+        """
+        state = await load_checkpoint(self.db, self.job_key, SyncSource.DYNAMICS_BC.value, entity_type.value)
+        if not state:
+            return None
+        
+        staged_run = None
+        if state.get("run_id"):
+            staged_run = StagedMerge(self.db, spec, run_id=uuid.UUID(state["run_id"]))
+        
+        if bulk != (staged_run is not None):
+            reason = "load_mode changed"
+        elif staged_run and await staged_run.count_staged() < state["staged"]:
+            reason = "staged rows lost"
+        else:
+            if staged_run:
+                # Righe copiate dopo l'ultimo checkpoint: ricopiate, vince l'ultima (seq)
+                state["staged"] = await staged_run.count_staged()
+            logger.info(
+                "sync.checkpoint_resumed",
+                job_key=self.job_key,
+                entity=entity_type.value,
+                companies=state["companies"],
+            )
+            return state
+        
+        logger.warning("sync.checkpoint_discarded", job_key=self.job_key, entity=entity_type.value, reason=reason)
+        if staged_run:
+            await staged_run.discard()
+        await self.db.commit()
+        return None
+    
+    async def _save_checkpoint(
+        self,
+        entity_type: EntityType,
+        progress: StreamProgress,
+        loader: Optional[StagedMerge] = None,
+    ):
+        """Salva le posizioni del job dopo un batch (errori solo loggati)"""
+        # Serializzato tra i writer: lo stato salvato non torna mai indietro
+        async with self._checkpoint_lock:
+            state = {
+                "companies": progress.state(),
+                "run_id": str(loader.run_id) if loader else None,
+                "staged": loader.staged if loader else 0,
+            }
+            async with self._write_session(shared=loader is not None) as db:
+                try:
+                    await save_checkpoint(db, self.job_key, SyncSource.DYNAMICS_BC.value, entity_type.value, state)
+                    await db.commit()
+                except SQLAlchemyError as e:
+                    await db.rollback()
+                    logger.warning("sync.checkpoint_failed", entity=entity_type.value, error=str(e))
+    
+    async def _clear_checkpoint(self, entity_type: EntityType):
+        """Elimina il checkpoint dell'entità a sync completata"""
+        try:
+            await clear_checkpoint(self.db, self.job_key, SyncSource.DYNAMICS_BC.value, entity_type.value)
+            await self.db.commit()
+        except SQLAlchemyError as e:
+            await self.db.rollback()
+            logger.warning("sync.checkpoint_clear_failed", entity=entity_type.value, error=str(e))
+    
+    @asynccontextmanager
+    async def _write_session(self, shared: bool = False) -> AsyncIterator[AsyncSession]:
+        """Sessione per un batch: propria se c'è session_factory, altrimenti self.db"""
+        if shared or self.session_factory is None:
+            yield self.db
+            return
+        async with self.session_factory() as session:
+            yield session
+    
+    async def _merge_staged(self, loader: StagedMerge, result: Dict[str, Any]):
+        """Applica lo staging del run con un solo MERGE (load_mode bulk)"""
+        try:
+            await mark_sync_source(self.db, SyncSource.DYNAMICS_BC.value)
+            created, updated, unchanged = await loader.merge()
+            await self.db.commit()
+        except SQLAlchemyError as e:
+            await self.db.rollback()
+            logger.error("sync.merge_contacts_failed", staged=loader.staged, error=str(e))
+            result["failed"] += loader.staged
+            result["errors"].append({
+                "entity": "contact",
+                "error": f"Bulk merge failed: {e}",
+            })
+            # Lo staging del run non serve più
+            await loader.discard()
+            await self.db.commit()
+            return
         
-        return "created"  # Mock
+        result["created"] += created
+        result["updated"] += updated
+        result["skipped"] += unchanged
     
     async def _sync_dynamics_bc_companies(
         self,
@@ -220,12 +1126,183 @@ class SyncEngine:
         dry_run: bool,
         filters: Optional[Dict[str, Any]],
     ) -> Dict[str, Any]:
-        """Sincronizza aziende da BC (vendors come potenziali partner)"""
+        """
+        Sincronizza aziende da BC: fornitori e clienti di tipo Company, con
+        lo stesso stream a pagine e la stessa pipeline dei contatti, scritti
+        per batch e deduplicati per partita IVA (vedi app.services.company_writer).
+        """
         result = {"created": 0, "updated": 0, "skipped": 0, "failed": 0, "errors": []}
         
-        # Simile a contatti ma con vendors
+        if direction == SyncDirection.OUTBOUND:
+            # CRM → BC solo per i contatti
+            logger.warning("sync.direction_not_implemented", entity=EntityType.COMPANY.value, direction=direction)
+            return result
+        
+        async with DynamicsBCClient() as client:
+            settings = get_settings()
+            source = SyncSource.DYNAMICS_BC.value
+            index = await self.company_index()
+            
+            # Come per i contatti: filters.last_sync, altrimenti high-water mark
+            # per company (uno per fornitori e clienti insieme) meno l'overlap
+            filters = filters or {}
+            last_sync = parse_timestamp(filters.get("last_sync"))
+            stored_watermarks: Dict[str, datetime] = {}
+            if last_sync is None and not filters.get("full_sync"):
+                stored_watermarks = await load_watermarks(self.db, source, EntityType.COMPANY.value)
+            
+            progress = StreamProgress()
+            stats = result["companies"] = {"vendors": 0, "customers": 0, "vat_matches": 0}
+            mapping = await self.active_mapping(SyncSource.DYNAMICS_BC, EntityType.COMPANY)
+            vendor_select = self.company_select(mapping, DynamicsBCVendor)
+            customer_select = self.company_select(mapping, DynamicsBCCustomer)
+            
+            async def records():
+                try:
+                    for company_id in await client.get_company_ids():
+                        company = progress.start(company_id, last_sync or watermark_filter(
+                            stored_watermarks.get(company_id),
+                            settings.SYNC_WATERMARK_OVERLAP_SECONDS,
+                        ))
+                        streams = (
+                            ("vendors", client.iter_vendors(
+                                modified_since=company.since, company_id=company_id, select=vendor_select,
+                            )),
+                            ("customers", client.iter_customers(
+                                modified_since=company.since, company_id=company_id, select=customer_select,
+                            )),
+                        )
+                        for kind, stream in streams:
+                            async for record in stream:
+                                progress.observe(company_id, record.last_modified)
+                                # Clienti persona: sono contatti, non aziende
+                                if kind == "customers" and record.type != BC_COMPANY_CUSTOMER_TYPE:
+                                    continue
+                                stats[kind] += 1
+                                yield company_id, progress.next_slot(company_id), record
+                        company.exhausted = True
+                
+                except DynamicsBCError as e:
+                    result["errors"].append({
+                        "entity": "connection",
+                        "error": str(e),
+                    })
+            
+            def transform(item) -> Optional[tuple]:
+                company_id, slot, record = item
+                try:
+                    return company_id, slot, self._company_row_from_bc(record, mapping)
+                except Exception as e:
+                    result["failed"] += 1
+                    result["errors"].append({
+                        "entity": "company",
+                        "external_id": record.id,
+                        "error": str(e),
+                    })
+                    progress.complete([(company_id, slot)])
+                    return None
+            
+            async def write(items: List[tuple]):
+                await self._write_companies([row for _, _, row in items], dry_run, result, index, mapping.targets)
+                progress.complete((company_id, slot) for company_id, slot, _ in items)
+            
+            # Un solo writer: le aziende create da un batch devono essere
+            # nell'indice prima del successivo (stessa IVA → stessa azienda)
+            pipeline = SyncPipeline(
+                batch_size=settings.SYNC_BATCH_SIZE,
+                queue_size=settings.SYNC_PIPELINE_QUEUE_SIZE,
+                transform_workers=settings.SYNC_PIPELINE_TRANSFORM_WORKERS,
+                write_workers=1,
+            )
+            result["pipeline"] = await pipeline.run(records(), transform, write)
+            
+            result["failed"] += client.stats["parse_errors"]
+            result["errors"].extend(
+                {"entity": "company", **error} for error in client.parse_errors
+            )
+            
+            if not dry_run and result["failed"] == 0:
+                result["watermarks"] = await self._save_watermarks(
+                    EntityType.COMPANY, progress.completed_high_water()
+                )
+            
+            result["http"] = client.http_stats
+            result["links"] = {**self.links.stats, "cached": len(self.links)}
+        
         return result
     
+    def _company_row_from_bc(
+        self,
+        record: Union[DynamicsBCVendor, DynamicsBCCustomer],
+        mapping: CompiledMapping,
+    ) -> Dict[str, Any]:
+        """Mappa BC Vendor / Customer di tipo Company → riga companies (con external_hash)"""
+        row = {
+            **mapping(record),
+            "external_source": SyncSource.DYNAMICS_BC.value,
+            "external_id": record.id or record.number,
+            "external_version": record.etag,
+        }
+        row["external_hash"] = content_hash(row, exclude=("external_version",))
+        return row
+    
+    async def _write_companies(
+        self,
+        rows: List[Dict[str, Any]],
+        dry_run: bool,
+        result: Dict[str, Any],
+        index: CompanyIndex,
+        columns: Sequence[str],
+    ):
+        """
+        Scrive un batch di aziende e aggiorna i contatori (commit per batch).
+        In dry_run si calcola solo il piano: le aziende nuove non entrano
+        nell'indice, quindi la stessa IVA in batch diversi conta più volte.
+        """
+        if not rows:
+            return
+        
+        source = SyncSource.DYNAMICS_BC.value
+        written: List[Any] = []
+        async with self._write_session() as db:
+            try:
+                plan = await plan_companies(db, rows, self.links, index)
+                if not dry_run:
+                    written = await apply_companies(db, plan, self.links, source, columns)
+                    await db.commit()
+            except SQLAlchemyError as e:
+                await db.rollback()
+                self.links.invalidate(source, COMPANY_LINK_ENTITY_TYPE, (row["external_id"] for row in rows))
+                error = e
+            else:
+                error = None
+        
+        if error:
+            logger.error("sync.upsert_companies_failed", rows=len(rows), error=str(error))
+            result["failed"] += len(rows)
+            result["errors"].append({
+                "entity": "company",
+                "external_ids": [row["external_id"] for row in rows],
+                "error": str(error),
+            })
+            return
+        
+        # Solo dopo il commit: i batch successivi e i contatti le trovano per IVA
+        for company in written:
+            index.add(company.id, company.name, company.website, company.tax_identifier)
+        
+        result["created"] += plan.created
+        result["updated"] += plan.updated
+        result["skipped"] += plan.unchanged
+        result["companies"]["vat_matches"] += plan.vat_matches
+        logger.info(
+            "sync.upsert_companies",
+            created=plan.created,
+            updated=plan.updated,
+            unchanged=plan.unchanged,
+            dry_run=dry_run,
+        )
+    
     async def preview(
         self,
         source: SyncSource,
@@ -239,7 +1316,8 @@ class SyncEngine:
         
         if source == SyncSource.DYNAMICS_BC and entity_type == EntityType.CONTACT:
             async with DynamicsBCClient() as client:
-                customers = await client.get_customers(top=10)
+                mapping = await self.active_mapping(source, entity_type)
+                customers = await client.get_customers(top=10, select=self.contact_select(mapping))
                 for customer in customers:
                     preview_data.append({
                         "external_id": customer.id or customer.number,
@@ -254,42 +1332,31 @@ class SyncEngine:
     async def validate_mapping(
         self,
         source: SyncSource,
-        mapping: Dict[str, str],
+        mapping: Any,
+        entity_type: EntityType = EntityType.CONTACT,
     ) -> Dict[str, Any]:
         """
-        Valida un mapping campi personalizzato.
+        Valida un mapping campi personalizzato compilandolo (regole o
+        vecchio dict {campo esterno: campo CRM}) contro le colonne reali.
         
         Returns:
-            Dict con valid, errors, warnings
+            Dict con valid, errors, warnings e select (campi BC che verrebbero scaricati)
         """
         validation = {
             "valid": True,
             "errors": [],
             "warnings": [],
+            "select": [],
         }
         
-        # Campi validi per CRM
-        valid_crm_fields = {
-            "first_name", "last_name", "email", "phone", "title",
-            "company_id", "address", "city", "country", "gender",
-        }
+        try:
+            compiled = self.compile_mapping(source, entity_type, normalize_spec(mapping))
+        except MappingError as e:
+            validation["valid"] = False
+            validation["errors"] = e.errors
+            return validation
         
-        for source_field, target_field in mapping.items():
-            if target_field not in valid_crm_fields:
-                validation["warnings"].append(
-                    f"Target field '{target_field}' not in standard CRM fields"
-                )
+        if source == SyncSource.DYNAMICS_BC:
+            validation["select"] = self.mapping_select(entity_type, compiled)
         
         return validation
-    
-    # ============== HELPERS ==============
-    
-    def _extract_first_name(self, full_name: str) -> str:
-        """Estrae nome da display name"""
-        parts = full_name.split(maxsplit=1)
-        return parts[0] if parts else full_name
-    
-    def _extract_last_name(self, full_name: str) -> str:
-        """Estrae cognome da display name"""
-        parts = full_name.split(maxsplit=1)
-        return parts[1] if len(parts) > 1 else ""
@@ -0,0 +1,170 @@
+"""
+Pipeline asyncio per la sync: fetch → transform → write.
+
+Gli stadi sono collegati da code limitate (asyncio.Queue con maxsize):
+mentre il writer scrive un batch su Postgres il fetch continua a
+scaricare pagine da BC, e se il writer è più lento le code si riempiono
+e il fetch si ferma (backpressure), così la memoria resta limitata a
+circa 2 × queue_size righe più i batch in scrittura.
+"""
+
+import asyncio
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Generic, List, Optional, TypeVar
+
+import structlog
+
+logger = structlog.get_logger()
+
+S = TypeVar("S")
+R = TypeVar("R")
+
+_DONE = object()  # Fine stream per i worker a valle
+
+
+@dataclass
+class StageStats:
+    """Statistiche di uno stadio"""
+    workers: int = 1
+    items: int = 0
+    busy_seconds: float = 0.0  # Tempo speso nel lavoro dello stadio
+    blocked_seconds: float = 0.0  # Attesa su coda a valle piena (backpressure)
+    max_queue_depth: int = 0  # Profondità massima osservata della coda in uscita
+
+
+class SyncPipeline(Generic[S, R]):
+    """
+    Esegue fetch, transform e write in parallelo su code limitate.
+    
+    - source: iteratore asincrono dei record esterni (stadio fetch)
+    - transform: record → riga (None per scartarla), sincrona
+    - write: scrive un batch di righe; chiamata da `write_workers` worker
+    """
+    
+    def __init__(
+        self,
+        batch_size: int,
+        queue_size: int,
+        transform_workers: int = 1,
+        write_workers: int = 1,
+    ):
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.transform_workers = max(transform_workers, 1)
+        self.write_workers = max(write_workers, 1)
+        self.stats: Dict[str, StageStats] = {
+            "fetch": StageStats(),
+            "transform": StageStats(workers=self.transform_workers),
+            "write": StageStats(workers=self.write_workers),
+        }
+        self.batches = 0
+    
+    async def run(
+        self,
+        source: AsyncIterator[S],
+        transform: Callable[[S], Optional[R]],
+        write: Callable[[List[R]], Awaitable[None]],
+    ) -> Dict[str, Any]:
+        """Esegue la pipeline fino ad esaurimento della sorgente"""
+        fetched: asyncio.Queue = asyncio.Queue(self.queue_size)
+        transformed: asyncio.Queue = asyncio.Queue(self.queue_size)
+        started = time.monotonic()
+        
+        async def fetch_stage():
+            stats = self.stats["fetch"]
+            iterator = source.__aiter__()
+            while True:
+                begin = time.monotonic()
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    stats.busy_seconds += time.monotonic() - begin
+                stats.items += 1
+                await self._put(fetched, item, stats)
+            for _ in range(self.transform_workers):
+                await fetched.put(_DONE)
+        
+        remaining_transformers = self.transform_workers
+        
+        async def transform_stage():
+            nonlocal remaining_transformers
+            stats = self.stats["transform"]
+            while (item := await fetched.get()) is not _DONE:
+                begin = time.monotonic()
+                row = transform(item)
+                stats.busy_seconds += time.monotonic() - begin
+                if row is not None:
+                    stats.items += 1
+                    await self._put(transformed, row, stats)
+            
+            # L'ultimo transformer chiude lo stream dei writer
+            remaining_transformers -= 1
+            if remaining_transformers == 0:
+                for _ in range(self.write_workers):
+                    await transformed.put(_DONE)
+        
+        async def write_stage():
+            stats = self.stats["write"]
+            batch: List[R] = []
+            while True:
+                item = await transformed.get()
+                if item is not _DONE:
+                    batch.append(item)
+                if batch and (item is _DONE or len(batch) >= self.batch_size):
+                    begin = time.monotonic()
+                    await write(batch)
+                    stats.busy_seconds += time.monotonic() - begin
+                    stats.items += len(batch)
+                    self.batches += 1
+                    batch = []
+                if item is _DONE:
+                    return
+        
+        tasks = [
+            asyncio.create_task(fetch_stage()),
+            *(asyncio.create_task(transform_stage()) for _ in range(self.transform_workers)),
+            *(asyncio.create_task(write_stage()) for _ in range(self.write_workers)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            # Errore in uno stadio: ferma gli altri (altrimenti resterebbero
+            # bloccati su code che nessuno svuota più)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        
+        report = self.report(time.monotonic() - started)
+        logger.info("sync_pipeline.completed", **report)
+        return report
+    
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        """Statistiche per stadio, da includere nelle stats del job"""
+        return {
+            "elapsed_seconds": round(elapsed, 3),
+            "batches": self.batches,
+            "batch_size": self.batch_size,
+            "queue_size": self.queue_size,
+            "stages": {
+                name: {
+                    **asdict(stats),
+                    "busy_seconds": round(stats.busy_seconds, 3),
+                    "blocked_seconds": round(stats.blocked_seconds, 3),
+                }
+                for name, stats in self.stats.items()
+            },
+        }
+    
+    @staticmethod
+    async def _put(queue: asyncio.Queue, item: Any, stats: StageStats):
+        """Accoda misurando il tempo di attesa per coda piena"""
+        if queue.full():
+            begin = time.monotonic()
+            await queue.put(item)
+            stats.blocked_seconds += time.monotonic() - begin
+        else:
+            queue.put_nowait(item)
+        stats.max_queue_depth = max(stats.max_queue_depth, queue.qsize())
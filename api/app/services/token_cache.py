@@ -0,0 +1,183 @@
+"""
+Cache condivisa dei token OAuth2 per i connettori esterni.
+
+Il token è cachato in-process e, opzionalmente, su Redis (REDIS_URL) così
+che tutti i worker Celery riusino lo stesso token. Il refresh è
+single-flight: chiamanti concorrenti attendono un solo refresh invece di
+colpire tutti il token endpoint.
+"""
+
+import asyncio
+import json
+import time
+import weakref
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import structlog
+
+from app.config import get_settings
+
+logger = structlog.get_logger()
+
+# Restituisce (access_token, expires_in secondi)
+TokenFetcher = Callable[[], Awaitable[Tuple[str, int]]]
+
+REDIS_KEY_PREFIX = "atomic:oauth_token:"
+
+
+@dataclass
+class CachedToken:
+    """Token OAuth con scadenza assoluta (epoch)"""
+    access_token: str
+    expires_at: float
+    
+    def is_valid(self, margin: float) -> bool:
+        return time.time() < self.expires_at - margin
+
+
+class TokenCache:
+    """Cache token con refresh single-flight per chiave (tenant/client)"""
+    
+    def __init__(self, redis_url: Optional[str] = None, refresh_margin: int = 300):
+        self.redis_url = redis_url
+        self.refresh_margin = refresh_margin
+        self._tokens: Dict[str, CachedToken] = {}
+        # Lock e client Redis sono legati all'event loop (Celery ne crea uno per task)
+        self._locks: "weakref.WeakKeyDictionary[Any, Dict[str, asyncio.Lock]]" = weakref.WeakKeyDictionary()
+        self._redis_clients: "weakref.WeakKeyDictionary[Any, Any]" = weakref.WeakKeyDictionary()
+    
+    @staticmethod
+    def make_key(tenant_id: str, client_id: str, scope: str) -> str:
+        """Chiave cache (senza segreti)"""
+        return f"{tenant_id}:{client_id}:{scope}"
+    
+    async def get_token(self, key: str, fetcher: TokenFetcher) -> str:
+        """Restituisce un token valido, rinnovandolo una sola volta se scaduto"""
+        token = self._tokens.get(key)
+        if token and token.is_valid(self.refresh_margin):
+            return token.access_token
+        
+        async with self._lock(key):
+            # Un altro chiamante potrebbe aver già rinnovato mentre attendevamo
+            token = self._tokens.get(key)
+            if token and token.is_valid(self.refresh_margin):
+                return token.access_token
+            
+            token = await self._load_shared(key)
+            if not token:
+                token = await self._refresh(key, fetcher)
+            
+            self._tokens[key] = token
+            return token.access_token
+    
+    async def invalidate(self, key: str, access_token: Optional[str] = None):
+        """Scarta il token (es. dopo un 401); se indicato, solo se ancora quello"""
+        token = self._tokens.get(key)
+        if token and (access_token is None or token.access_token == access_token):
+            self._tokens.pop(key, None)
+        
+        redis = self._get_redis()
+        if redis is None:
+            return
+        try:
+            shared = await self._load_shared(key)
+            if shared and (access_token is None or shared.access_token == access_token):
+                await redis.delete(REDIS_KEY_PREFIX + key)
+        except Exception as e:
+            logger.warning("token_cache.redis_error", op="invalidate", error=str(e))
+    
+    # ============== INTERNALS ==============
+    
+    def _lock(self, key: str) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        locks = self._locks.setdefault(loop, {})
+        if key not in locks:
+            locks[key] = asyncio.Lock()
+        return locks[key]
+    
+    def _get_redis(self):
+        """Client Redis per il loop corrente, None se non configurato"""
+        if not self.redis_url:
+            return None
+        
+        loop = asyncio.get_running_loop()
+        client = self._redis_clients.get(loop)
+        if client is None:
+            import redis.asyncio as aioredis
+            client = aioredis.from_url(self.redis_url, decode_responses=True)
+            self._redis_clients[loop] = client
+        return client
+    
+    async def _load_shared(self, key: str) -> Optional[CachedToken]:
+        """Legge il token condiviso da Redis (se abilitato e ancora valido)"""
+        redis = self._get_redis()
+        if redis is None:
+            return None
+        
+        try:
+            raw = await redis.get(REDIS_KEY_PREFIX + key)
+        except Exception as e:
+            logger.warning("token_cache.redis_error", op="get", error=str(e))
+            return None
+        
+        if not raw:
+            return None
+        
+        try:
+            data = json.loads(raw)
+            token = CachedToken(str(data["access_token"]), float(data["expires_at"]))
+        except (ValueError, TypeError, KeyError) as e:
+            # Valore illeggibile (scritto da un'altra versione, troncato): si
+            # elimina e si rinnova il token come se non ci fosse
+            logger.warning("token_cache.invalid_entry", key=key, error=str(e))
+            try:
+                await redis.delete(REDIS_KEY_PREFIX + key)
+            except Exception as e:
+                logger.warning("token_cache.redis_error", op="delete", error=str(e))
+            return None
+        return token if token.is_valid(self.refresh_margin) else None
+    
+    async def _refresh(self, key: str, fetcher: TokenFetcher) -> CachedToken:
+        """Rinnova il token; con Redis un solo worker alla volta lo richiede"""
+        redis = self._get_redis()
+        if redis is None:
+            return await self._fetch(key, fetcher)
+        
+        from redis.exceptions import RedisError
+        
+        try:
+            async with redis.lock(REDIS_KEY_PREFIX + key + ":lock", timeout=30, blocking_timeout=30):
+                shared = await self._load_shared(key)
+                if shared:
+                    return shared
+                
+                token = await self._fetch(key, fetcher)
+                ttl = max(int(token.expires_at - time.time()), 1)
+                await redis.set(
+                    REDIS_KEY_PREFIX + key,
+                    json.dumps({"access_token": token.access_token, "expires_at": token.expires_at}),
+                    ex=ttl,
+                )
+                return token
+        
+        except RedisError as e:
+            # Redis non disponibile: degrada a cache solo in-process
+            logger.warning("token_cache.redis_error", op="refresh", error=str(e))
+            return await self._fetch(key, fetcher)
+    
+    async def _fetch(self, key: str, fetcher: TokenFetcher) -> CachedToken:
+        access_token, expires_in = await fetcher()
+        logger.info("token_cache.refreshed", key=key, expires_in=expires_in)
+        return CachedToken(access_token, time.time() + expires_in)
+
+
+@lru_cache()
+def get_token_cache() -> TokenCache:
+    """Restituisce la cache token di processo"""
+    settings = get_settings()
+    return TokenCache(
+        redis_url=settings.REDIS_URL if settings.TOKEN_CACHE_REDIS_ENABLED else None,
+        refresh_margin=settings.TOKEN_CACHE_REFRESH_MARGIN_SECONDS,
+    )
@@ -0,0 +1,104 @@
+"""
+High-water mark delle sync incrementali.
+
+Per ogni (source, company, entity type) si salva il massimo
+lastModifiedDateTime applicato con successo; la sync successiva filtra
+su quel valore meno una finestra di sicurezza (record salvati in BC con
+timestamp leggermente nel passato, clock skew). Le righe rilette nella
+finestra vengono scartate dal confronto hash.
+"""
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.tables import sync_watermarks
+
+
+def parse_timestamp(value) -> Optional[datetime]:
+    """Accetta datetime o stringa ISO 8601 (anche con 'Z'); naive = UTC"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+async def load_watermarks(db: AsyncSession, source: str, entity_type: str) -> Dict[str, datetime]:
+    """High-water mark per company"""
+    result = await db.execute(
+        select(sync_watermarks.c.company_id, sync_watermarks.c.high_water).where(
+            sync_watermarks.c.source == source,
+            sync_watermarks.c.entity_type == entity_type,
+        )
+    )
+    return {row.company_id: row.high_water for row in result}
+
+
+def watermark_filter(high_water: Optional[datetime], overlap_seconds: int) -> Optional[datetime]:
+    """Filtro $filter per la prossima sync: high-water meno la finestra di overlap"""
+    if high_water is None:
+        return None
+    return high_water - timedelta(seconds=overlap_seconds)
+
+
+async def save_watermark(
+    db: AsyncSession,
+    source: str,
+    company_id: str,
+    entity_type: str,
+    high_water: datetime,
+):
+    """Avanza l'high-water mark (mai all'indietro)"""
+    stmt = pg_insert(sync_watermarks).values(
+        source=source,
+        company_id=company_id or "",
+        entity_type=entity_type,
+        high_water=high_water,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[sync_watermarks.c.source, sync_watermarks.c.company_id, sync_watermarks.c.entity_type],
+        set_={
+            "high_water": func.greatest(sync_watermarks.c.high_water, stmt.excluded.high_water),
+            "updated_at": func.now(),
+        },
+    )
+    await db.execute(stmt)
+
+
+async def list_watermarks(
+    db: AsyncSession,
+    source: Optional[str] = None,
+    entity_type: Optional[str] = None,
+) -> List[Dict]:
+    """Tutti gli high-water mark (filtrabili), per l'API"""
+    query = select(sync_watermarks).order_by(
+        sync_watermarks.c.source, sync_watermarks.c.entity_type, sync_watermarks.c.company_id
+    )
+    if source:
+        query = query.where(sync_watermarks.c.source == source)
+    if entity_type:
+        query = query.where(sync_watermarks.c.entity_type == entity_type)
+    result = await db.execute(query)
+    return [dict(row._mapping) for row in result]
+
+
+async def reset_watermarks(
+    db: AsyncSession,
+    source: str,
+    entity_type: Optional[str] = None,
+    company_id: Optional[str] = None,
+) -> int:
+    """Elimina gli high-water mark: la prossima sync rilegge tutto"""
+    query = delete(sync_watermarks).where(sync_watermarks.c.source == source)
+    if entity_type:
+        query = query.where(sync_watermarks.c.entity_type == entity_type)
+    if company_id is not None:
+        query = query.where(sync_watermarks.c.company_id == company_id)
+    result = await db.execute(query)
+    return result.rowcount
@@ -27,17 +27,45 @@ celery_app.conf.update(
     enable_utc=True,
     task_track_started=True,
     task_time_limit=3600,  # 1 ora max per task
+    # Limite soft: la sync si interrompe con i checkpoint salvati e il
+    # retry riprende da lì (il limite hard uccide il processo)
+    task_soft_time_limit=3540,
+    # Task riconsegnato (stesso id, quindi stessi checkpoint) se il worker
+    # muore o viene riavviato durante l'esecuzione
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
     worker_prefetch_multiplier=1,
     beat_schedule={},  # Popolato dinamicamente
 )
 
-# Schedule automatica se abilitata
+
+
+def _crontab(expression: str) -> crontab:
+    """Espressione cron standard (minuto ora giorno mese giorno_settimana)"""
+    minute, hour, day_of_month, month_of_year, day_of_week = expression.split()
+    return crontab(
+        minute=minute,
+        hour=hour,
+        day_of_month=day_of_month,
+        month_of_year=month_of_year,
+        day_of_week=day_of_week,
+    )
+
+
+# Schedule automatiche se abilitate
 if settings.AUTO_SYNC_ENABLED:
-    celery_app.conf.beat_schedule = {
-        "sync-dynamics-bc": {
-            "task": "app.tasks.sync_jobs.run_dynamics_bc_sync",
-            "schedule": crontab(),  # Parse da settings.AUTO_SYNC_CRON
-        },
+    celery_app.conf.beat_schedule["sync-dynamics-bc"] = {
+        "task": "app.tasks.sync_jobs.run_dynamics_bc_sync",
+        "schedule": _crontab(settings.AUTO_SYNC_CRON),
+    }
+
+# Controllo di consistenza periodico: eliminazioni e derive non viste
+# dalle sync incrementali
+if settings.AUTO_RECONCILE_ENABLED:
+    celery_app.conf.beat_schedule["reconcile-dynamics-bc"] = {
+        "task": "app.tasks.sync_jobs.run_dynamics_bc_sync",
+        "schedule": _crontab(settings.AUTO_RECONCILE_CRON),
+        "kwargs": {"direction": "inbound", "entity_types": ["contact"], "filters": {"reconcile": True}},
     }
 
 
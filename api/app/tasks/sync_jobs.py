@@ -3,17 +3,45 @@ Celery tasks per sincronizzazione.
 """
 
 from celery import Task
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+import asyncio
 import structlog
 
 from app.tasks.scheduler import celery_app
-from app.database import SyncSessionLocal
+from app.database import AsyncSessionLocal, async_engine
 from app.services.sync_engine import SyncEngine
 from app.models.schemas import SyncSource, SyncDirection, EntityType
 
 logger = structlog.get_logger()
 
 
+async def _run_sync(
+    direction: SyncDirection,
+    entity_types: List[EntityType],
+    filters: Optional[Dict[str, Any]],
+    job_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Esegue la sync nel loop del task (SyncEngine è async).
+    Con job_key la sync salva checkpoint per batch e riprende da quelli
+    di un tentativo precedente con la stessa chiave.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            engine = SyncEngine(db, session_factory=AsyncSessionLocal, job_key=job_key)
+            return await engine.sync(
+                source=SyncSource.DYNAMICS_BC,
+                direction=direction,
+                entity_types=entity_types,
+                dry_run=False,
+                filters=filters,
+            )
+    finally:
+        # Le connessioni asyncpg sono legate al loop: asyncio.run ne crea
+        # uno nuovo ad ogni task, quindi il pool non va riusato
+        await async_engine.dispose()
+
+
 class DatabaseTask(Task):
     """Task base con accesso al database"""
     _db = None
@@ -38,7 +66,11 @@ def run_dynamics_bc_sync(
     Args:
         direction: "inbound", "outbound", "bidirectional"
         entity_types: Lista ["contact", "company", ...]
-        filters: Dict con filtri (es: {"last_sync": "2024-01-01"})
+        filters: Dict con filtri (es: {"last_sync": "2024-01-01"}); senza
+            last_sync la sync parte dagli high-water mark salvati
+    
+    I retry mantengono il task id, usato come chiave dei checkpoint: un
+    tentativo successivo riprende dall'ultimo batch applicato.
     """
     entity_types = entity_types or ["contact", "company"]
     
@@ -50,24 +82,12 @@ def run_dynamics_bc_sync(
     )
     
     try:
-        # Crea sessione DB
-        db = SyncSessionLocal()
-        
-        # Inizializza engine
-        engine = SyncEngine(db)
-        
         # Converte stringhe in enum
         entity_enums = [EntityType(et) for et in entity_types]
         direction_enum = SyncDirection(direction)
         
         # Esegui sync
-        result = engine.sync(
-            source=SyncSource.DYNAMICS_BC,
-            direction=direction_enum,
-            entity_types=entity_enums,
-            dry_run=False,
-            filters=filters,
-        )
+        result = asyncio.run(_run_sync(direction_enum, entity_enums, filters, job_key=self.request.id))
         
         logger.info(
             "celery_task.completed",
@@ -76,11 +96,6 @@ def run_dynamics_bc_sync(
             updated=result.get("updated"),
             failed=result.get("failed"),
         )
-        
-        return {
-            "status": "success" if result.get("success") else "partial",
-            **result
-        }
     
     except Exception as exc:
         logger.error(
@@ -92,8 +107,20 @@ def run_dynamics_bc_sync(
         # Retry con backoff
         raise self.retry(exc=exc, countdown=60 * (self.request.retries + 1))
     
-    finally:
-        db.close()
+    # Interrotto (es. BC non raggiungibile) con checkpoint salvati: il retry
+    # riprende dall'ultimo batch invece di riscaricare tutto
+    if result.get("resumable") and self.request.retries < self.max_retries:
+        logger.warning(
+            "celery_task.resuming",
+            task="run_dynamics_bc_sync",
+            retry=self.request.retries,
+        )
+        raise self.retry(countdown=60 * (self.request.retries + 1))
+    
+    return {
+        "status": "success" if result.get("success") else "partial",
+        **result
+    }
 
 
 @celery_app.task(base=DatabaseTask, bind=True)
@@ -102,15 +129,17 @@ def test_connection(self, source: str):
     from app.services.dynamics_bc import DynamicsBCClient
     
     if source == "dynamics_bc":
-        client = DynamicsBCClient()
-        result = client.test_connection()
-        return result
+        async def run():
+            async with DynamicsBCClient() as client:
+                return await client.test_connection()
+        
+        return asyncio.run(run())
     
     return {"error": f"Unknown source: {source}"}
 
 
 @celery_app.task
-cleanup_old_logs(days: int = 30):
+def cleanup_old_logs(days: int = 30):
     """Pulizia log vecchi"""
     logger.info("cleanup.started", days=days)
     # Implementa pulizia se necessario
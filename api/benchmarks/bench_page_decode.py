@@ -0,0 +1,91 @@
+"""
+Micro-benchmark decodifica pagine OData BC.
+
+Confronta il percorso precedente (response.json() + model_validate per
+riga con try/except) con PageDecoder: parsing del body con orjson (json
+se non installato) e validate_python dell'intera pagina, rivalidando solo
+le righe valide se qualcuna è scartata.
+
+Uso (dalla cartella api/):
+    python -m benchmarks.bench_page_decode --rows 1000 --pages 50
+"""
+
+import argparse
+import json
+import time
+
+from app.models.schemas import DynamicsBCCustomer
+from app.services.odata import PageDecoder
+
+
+def make_page(rows: int, invalid_every: int = 0) -> bytes:
+    """Pagina sintetica con campi tipici di un customer BC"""
+    value = []
+    for i in range(rows):
+        row = {
+            "@odata.etag": f'W/"JzQ0O{i}"',
+            "id": f"00000000-0000-0000-0000-{i:012d}",
+            "number": f"C{i:05d}",
+            "displayName": f"Customer {i} S.r.l.",
+            "type": "Company",
+            "addressLine1": f"Via Roma {i}",
+            "city": "Milano",
+            "country": "IT",
+            "postalCode": "20100",
+            "phoneNumber": f"+39 02 {i:07d}",
+            "email": f"customer{i}@example.com",
+            "website": f"www.customer{i}.example",
+            "taxRegistrationNumber": f"IT{i:011d}",
+            "currencyCode": "EUR",
+            "blocked": " ",
+            "balanceDue": 1234.5,
+            "lastModifiedDateTime": "2024-05-01T10:20:30.123Z",
+        }
+        if invalid_every and i % invalid_every == 0:
+            row["displayName"] = None
+        value.append(row)
+    return json.dumps({"@odata.context": "https://bc/$metadata#customers", "value": value}).encode()
+
+
+def decode_legacy(content: bytes):
+    """Percorso originale: json + validazione riga per riga"""
+    data = json.loads(content)
+    customers = []
+    for item in data.get("value", []):
+        try:
+            customers.append(DynamicsBCCustomer.model_validate(item))
+        except Exception:
+            pass
+    return customers
+
+
+def bench(label: str, func, content: bytes, pages: int, rows: int):
+    func(content)  # warm-up
+    start = time.perf_counter()
+    for _ in range(pages):
+        func(content)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {pages * rows / elapsed:>12,.0f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="righe per pagina")
+    parser.add_argument("--pages", type=int, default=50, help="pagine decodificate per misura")
+    parser.add_argument("--invalid-every", type=int, default=100, help="una riga non valida ogni N (0 = nessuna)")
+    args = parser.parse_args()
+    
+    decoder = PageDecoder(DynamicsBCCustomer)
+    clean = make_page(args.rows)
+    dirty = make_page(args.rows, args.invalid_every)
+    
+    print(f"{args.pages} pagine x {args.rows} righe")
+    bench("legacy (pagina valida)", decode_legacy, clean, args.pages, args.rows)
+    bench("decoder (pagina valida)", decoder.decode, clean, args.pages, args.rows)
+    if args.invalid_every:
+        bench(f"legacy (1 errore/{args.invalid_every})", decode_legacy, dirty, args.pages, args.rows)
+        bench(f"decoder (1 errore/{args.invalid_every})", decoder.decode, dirty, args.pages, args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+# Emulatore locale Business Central
@@ -0,0 +1,609 @@
+"""
+Emulatore locale di Dynamics 365 Business Central (API v2.0 OData).
+
+Permette di eseguire DynamicsBCClient e SyncEngine senza un tenant reale,
+per benchmark e test di regressione del throughput di sync.
+
+Supporta:
+- token endpoint OAuth2 (client credentials)
+- /companies, /customers, /vendors (lista, singolo, POST, PATCH con If-Match)
+- $filter su lastModifiedDateTime (gt/ge/lt/le, combinati con and)
+- $top/$skip/$select e server-driven paging con @odata.nextLink
+- proprietà reali di customer/vendor v2.0: come BC, $select o body con
+  nomi sconosciuti rispondono 400
+- $batch JSON con atomicityGroup (change set tutto o niente)
+- latenza configurabile e iniezione di 429 con Retry-After
+- dataset sintetici fino a milioni di righe, generati al volo per indice
+
+Avvio (dalla cartella api/):
+    python -m emulator.bc_emulator --port 8100 --customers 1000000
+
+Configurazione client:
+    ATOMIC_API_DYNAMICS_BC_BASE_URL=http://localhost:8100/api/v2.0
+    ATOMIC_API_DYNAMICS_BC_TOKEN_URL=http://localhost:8100/{tenant}/oauth2/v2.0/token
+"""
+
+import argparse
+import asyncio
+import bisect
+import copy
+import math
+import os
+import random
+import re
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+from app.models.schemas import BC_CUSTOMER_PROPERTIES, BC_VENDOR_PROPERTIES
+
+API_PREFIX = "/api/v2.0"
+BASE_TIME = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+FIRST_NAMES = ["Mario", "Giulia", "Luca", "Anna", "Marco", "Sara", "Paolo", "Elena", "Andrea", "Chiara"]
+LAST_NAMES = ["Rossi", "Bianchi", "Verdi", "Russo", "Ferrari", "Esposito", "Romano", "Colombo", "Ricci", "Greco"]
+COMPANY_WORDS = ["Alfa", "Beta", "Delta", "Nord", "Sud", "Tecno", "Edil", "Agri", "Logistica", "Servizi"]
+CITIES = ["Milano", "Roma", "Torino", "Napoli", "Bologna", "Firenze", "Genova", "Verona", "Bari", "Padova"]
+
+# Risposte: (status, headers, body)
+EmulatorResponse = Tuple[int, Dict[str, str], Optional[Dict[str, Any]]]
+
+
+class ODataError(Exception):
+    """Errore restituito nel formato OData di BC"""
+
+    def __init__(self, status: int, code: str, message: str):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.message = message
+
+    def response(self) -> EmulatorResponse:
+        return self.status, {}, {"error": {"code": self.code, "message": self.message}}
+
+
+@dataclass
+class EmulatorConfig:
+    """Parametri dell'emulatore (CLI o variabili BC_EMULATOR_*)"""
+    companies: int = 1
+    customers: int = 10_000
+    vendors: int = 1_000
+    latency_min_ms: float = 0.0
+    latency_max_ms: float = 0.0
+    throttle_rate: float = 0.0  # Probabilità di rispondere 429
+    retry_after: int = 1
+    max_page_size: int = 20_000  # Oltre, BC restituisce un nextLink
+    modified_step_seconds: int = 60  # Distanza lastModifiedDateTime tra righe sintetiche
+    seed: int = 42
+
+    @classmethod
+    def from_env(cls) -> "EmulatorConfig":
+        def env(name: str, default: Any) -> Any:
+            value = os.environ.get(f"BC_EMULATOR_{name}")
+            return type(default)(value) if value is not None else default
+
+        defaults = cls()
+        return cls(**{
+            name: env(name.upper(), getattr(defaults, name))
+            for name in defaults.__dataclass_fields__
+        })
+
+
+@dataclass
+class EntitySet:
+    """Collection sintetica (customers/vendors) di una company"""
+    kind: str  # "customer" o "vendor"
+    company_index: int
+    size: int
+    step: int
+    # Righe sintetiche modificate (indice → riga) e righe create via POST
+    overrides: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    created: List[Dict[str, Any]] = field(default_factory=list)
+    _overridden_sorted: List[int] = field(default_factory=list)
+
+    # ============== GENERAZIONE ==============
+
+    @property
+    def properties(self) -> frozenset:
+        """Proprietà dell'entità BC API v2.0 (le stesse ammesse dal client)"""
+        return BC_CUSTOMER_PROPERTIES if self.kind == "customer" else BC_VENDOR_PROPERTIES
+
+    def check_properties(self, names) -> None:
+        """Come BC: 400 se una proprietà richiesta o scritta non esiste"""
+        for name in names:
+            if not name.startswith("@") and name not in self.properties:
+                raise ODataError(
+                    400, "BadRequest", f"Could not find a property named '{name}' on type 'Microsoft.NAV.{self.kind}'."
+                )
+
+    def row_id(self, index: int) -> str:
+        kind_code = 1 if self.kind == "customer" else 2
+        return f"{self.company_index:08x}-{kind_code:04x}-4000-8000-{index:012x}"
+
+    def index_of(self, row_id: str) -> Optional[int]:
+        match = re.fullmatch(r"([0-9a-f]{8})-([0-9a-f]{4})-4000-8000-([0-9a-f]{12})", row_id.lower())
+        if not match:
+            return None
+        index = int(match.group(3), 16)
+        return index if index < self.size else None
+
+    def synthetic_row(self, index: int) -> Dict[str, Any]:
+        """Riga deterministica per indice (nessun dataset in memoria)"""
+        is_person = self.kind == "customer" and index % 3 == 0
+        if is_person:
+            name = f"{FIRST_NAMES[index % 10]} {LAST_NAMES[(index // 10) % 10]}"
+        else:
+            name = f"{COMPANY_WORDS[index % 10]} {COMPANY_WORDS[(index // 10) % 10]} {index} S.r.l."
+        slug = f"{self.kind[0]}{index}"
+        prefix = "C" if self.kind == "customer" else "V"
+        modified = BASE_TIME + timedelta(seconds=index * self.step)
+
+        row = {
+            "@odata.etag": f'W/"{index}-1"',
+            "id": self.row_id(index),
+            "number": f"{prefix}{index:07d}",
+            "displayName": name,
+            "email": f"info@{slug}.example.com",
+            "phoneNumber": f"+39 02 {index:07d}",
+            "addressLine1": f"Via Roma {index % 300 + 1}",
+            "addressLine2": "",
+            "city": CITIES[(index // 7) % 10],
+            "postalCode": f"{20100 + index % 900:05d}",
+            "country": "IT",
+            "website": "" if is_person else f"www.{slug}.example.com",
+            "taxRegistrationNumber": "" if is_person else f"IT{index:011d}",
+            "blocked": " ",
+            "lastModifiedDateTime": _iso(modified),
+        }
+        if self.kind == "customer":
+            row["type"] = "Person" if is_person else "Company"
+        return row
+
+    def get(self, index: int) -> Dict[str, Any]:
+        return self.overrides.get(index) or self.synthetic_row(index)
+
+    # ============== QUERY ==============
+
+    def query(
+        self,
+        modified_range: Tuple[Optional[datetime], bool, Optional[datetime], bool],
+        skip: int,
+        top: int,
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Restituisce (righe, ci_sono_altre) per il filtro su lastModifiedDateTime.
+        Righe sintetiche non modificate prima (ordine per indice), poi
+        righe modificate/create che soddisfano il filtro.
+        """
+        lo, hi = self._synthetic_bounds(modified_range)
+        excluded_lo = bisect.bisect_left(self._overridden_sorted, lo)
+        excluded_hi = bisect.bisect_left(self._overridden_sorted, hi)
+        synthetic_count = (hi - lo) - (excluded_hi - excluded_lo)
+
+        rows: List[Dict[str, Any]] = []
+        position = skip
+        while len(rows) < top and position < synthetic_count:
+            index = self._nth_untouched(lo, position)
+            rows.append(self.synthetic_row(index))
+            position += 1
+
+        extra = [row for row in self._touched_rows() if _in_range(row, modified_range)]
+        extra_skip = max(skip - synthetic_count, 0)
+        if len(rows) < top:
+            rows.extend(extra[extra_skip:extra_skip + top - len(rows)])
+
+        return rows, skip + len(rows) < synthetic_count + len(extra)
+
+    def _synthetic_bounds(self, modified_range) -> Tuple[int, int]:
+        """Intervallo di indici [lo, hi) con lastModifiedDateTime nel range"""
+        start, start_inclusive, end, end_inclusive = modified_range
+        lo, hi = 0, self.size
+        if start is not None:
+            offset = (start - BASE_TIME).total_seconds() / self.step
+            lo = max(lo, math.ceil(offset) if start_inclusive else math.floor(offset) + 1)
+        if end is not None:
+            offset = (end - BASE_TIME).total_seconds() / self.step
+            hi = min(hi, math.floor(offset) + 1 if end_inclusive else math.ceil(offset))
+        lo = min(lo, self.size)
+        return lo, max(lo, hi)
+
+    def _nth_untouched(self, lo: int, n: int) -> int:
+        """Indice della n-esima riga sintetica non modificata a partire da lo"""
+        index = lo + n
+        while True:
+            skipped = (
+                bisect.bisect_right(self._overridden_sorted, index)
+                - bisect.bisect_left(self._overridden_sorted, lo)
+            )
+            candidate = lo + n + skipped
+            if candidate == index:
+                return index
+            index = candidate
+
+    def _touched_rows(self) -> List[Dict[str, Any]]:
+        return [self.overrides[i] for i in self._overridden_sorted] + self.created
+
+    # ============== SCRITTURA ==============
+
+    def find(self, row_id: str) -> Tuple[Optional[int], Optional[Dict[str, Any]]]:
+        index = self.index_of(row_id)
+        if index is not None:
+            return index, self.get(index)
+        for position, row in enumerate(self.created):
+            if row["id"] == row_id:
+                return -(position + 1), row
+        return None, None
+
+    def update(self, row_id: str, changes: Dict[str, Any], if_match: Optional[str]) -> Dict[str, Any]:
+        key, row = self.find(row_id)
+        if row is None:
+            raise ODataError(404, "BadRequest_ResourceNotFound", f"{self.kind} {row_id} not found")
+        if if_match and if_match != "*" and if_match != row["@odata.etag"]:
+            raise ODataError(412, "Request_EntityChanged", "Another user has already changed the record.")
+
+        self.check_properties(changes)
+        updated = {**row, **_writable(changes)}
+        version = int(row["@odata.etag"].strip('W/"').rsplit("-", 1)[1]) + 1
+        updated["@odata.etag"] = f'W/"{row["id"][-12:]}-{version}"'
+        updated["lastModifiedDateTime"] = _iso(datetime.now(timezone.utc))
+
+        if key is not None and key >= 0:
+            if key not in self.overrides:
+                bisect.insort(self._overridden_sorted, key)
+            self.overrides[key] = updated
+        else:
+            self.created[-key - 1] = updated
+        return updated
+
+    def create(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        if not data.get("displayName"):
+            raise ODataError(400, "BadRequest", "displayName is required")
+        self.check_properties(data)
+        row_id = str(uuid.uuid4())
+        prefix = "C" if self.kind == "customer" else "V"
+        row = {
+            **self.synthetic_row(0),
+            "id": row_id,
+            "number": f"{prefix}N{len(self.created) + 1:06d}",
+            "email": "",
+            "phoneNumber": "",
+            "website": "",
+            "taxRegistrationNumber": "",
+            **_writable(data),
+            "@odata.etag": f'W/"{row_id[-12:]}-1"',
+            "lastModifiedDateTime": _iso(datetime.now(timezone.utc)),
+        }
+        self.created.append(row)
+        return row
+
+    def snapshot(self):
+        return copy.deepcopy((self.overrides, self.created, self._overridden_sorted))
+
+    def restore(self, state):
+        self.overrides, self.created, self._overridden_sorted = state
+
+
+class BCEmulator:
+    """Stato e routing delle richieste OData"""
+
+    ENTITY_PATH = re.compile(
+        r"^companies\((?P<company>[^)]+)\)/(?P<collection>customers|vendors)(?:\((?P<id>[^)]+)\))?$"
+    )
+
+    def __init__(self, config: EmulatorConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.stats = {"requests": 0, "throttled": 0, "batches": 0}
+        self.companies = [
+            {
+                "id": f"{i:08x}-0000-4000-8000-000000000000",
+                "name": f"CRONUS {i}",
+                "displayName": f"CRONUS Company {i}",
+            }
+            for i in range(1, config.companies + 1)
+        ]
+        self.entity_sets: Dict[Tuple[str, str], EntitySet] = {}
+        for i, company in enumerate(self.companies, start=1):
+            self.entity_sets[(company["id"], "customers")] = EntitySet("customer", i, config.customers, config.modified_step_seconds)
+            self.entity_sets[(company["id"], "vendors")] = EntitySet("vendor", i, config.vendors, config.modified_step_seconds)
+
+    async def simulate_network(self) -> Optional[EmulatorResponse]:
+        """Latenza configurata ed eventuale 429"""
+        if self.config.latency_max_ms > 0:
+            delay = self.random.uniform(self.config.latency_min_ms, self.config.latency_max_ms)
+            await asyncio.sleep(delay / 1000)
+        if self.config.throttle_rate and self.random.random() < self.config.throttle_rate:
+            self.stats["throttled"] += 1
+            return (
+                429,
+                {"Retry-After": str(self.config.retry_after)},
+                {"error": {"code": "Application_TooManyRequests", "message": "Too many requests"}},
+            )
+        return None
+
+    def handle(
+        self,
+        method: str,
+        path: str,
+        params: Dict[str, str],
+        headers: Dict[str, str],
+        body: Optional[Dict[str, Any]],
+        base_url: str,
+    ) -> EmulatorResponse:
+        """Esegue una richiesta (anche se proveniente da un $batch)"""
+        try:
+            path = path.strip("/")
+            if path == "companies" and method == "GET":
+                return 200, {}, {"value": self.companies}
+
+            match = self.ENTITY_PATH.match(path)
+            if not match:
+                raise ODataError(404, "BadRequest_NotFound", f"No resource at {path}")
+
+            entity_set = self.entity_sets.get((match.group("company"), match.group("collection")))
+            if entity_set is None:
+                raise ODataError(404, "BadRequest_NotFound", "Company not found")
+
+            row_id = match.group("id")
+            if row_id is None and method == "GET":
+                return self._list(entity_set, path, params, base_url)
+            if row_id is None and method == "POST":
+                row = entity_set.create(body or {})
+                return 201, {"ETag": row["@odata.etag"]}, row
+            if row_id is not None and method == "GET":
+                _, row = entity_set.find(row_id)
+                if row is None:
+                    raise ODataError(404, "BadRequest_ResourceNotFound", f"{row_id} not found")
+                return 200, {"ETag": row["@odata.etag"]}, _project(row, _select_fields(entity_set, params.get("$select")))
+            if row_id is not None and method == "PATCH":
+                if_match = headers.get("if-match")
+                if not if_match:
+                    raise ODataError(428, "Request_PreconditionRequired", "If-Match header required")
+                row = entity_set.update(row_id, body or {}, if_match)
+                return 200, {"ETag": row["@odata.etag"]}, row
+
+            raise ODataError(405, "BadRequest_MethodNotAllowed", f"{method} not allowed on {path}")
+
+        except ODataError as e:
+            return e.response()
+
+    def _list(self, entity_set: EntitySet, path: str, params: Dict[str, str], base_url: str) -> EmulatorResponse:
+        fields = _select_fields(entity_set, params.get("$select"))
+        skip = int(params.get("$skip", 0))
+        requested_top = int(params["$top"]) if "$top" in params else None
+        top = min(requested_top or self.config.max_page_size, self.config.max_page_size)
+        modified_range = _parse_filter(params.get("$filter"))
+
+        rows, has_more = entity_set.query(modified_range, skip, top)
+        body: Dict[str, Any] = {
+            "@odata.context": f"{base_url}/$metadata#{path.split('/')[-1]}",
+            "value": [_project(row, fields) for row in rows],
+        }
+
+        # Server-driven paging: pagina limitata dal server, non da $top
+        remaining = None if requested_top is None else requested_top - len(rows)
+        if has_more and len(rows) == top and (remaining is None or remaining > 0):
+            next_params = {**params, "$skip": skip + len(rows)}
+            if remaining is not None:
+                next_params["$top"] = remaining
+            body["@odata.nextLink"] = f"{base_url}/{path}?{urlencode(next_params)}"
+
+        return 200, {}, body
+
+    def batch(self, requests: List[Dict[str, Any]], base_url: str) -> Dict[str, Any]:
+        """Esegue un $batch JSON; i change set (atomicityGroup) sono tutto o niente"""
+        self.stats["batches"] += 1
+        responses: List[Dict[str, Any]] = []
+
+        groups: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        order: List[Optional[str]] = []
+        for request in requests:
+            group = request.get("atomicityGroup") or f"__single_{request.get('id')}"
+            if group not in groups:
+                groups[group] = []
+                order.append(group)
+            groups[group].append(request)
+
+        for group in order:
+            # Rollback solo per i change set, e solo delle collection che scrivono
+            states = {}
+            if not group.startswith("__single_"):
+                states = {key: self.entity_sets[key].snapshot() for key in self._written_sets(groups[group])}
+            group_responses = []
+            failed = False
+            for request in groups[group]:
+                url = request.get("url", "")
+                path, _, query = url.partition("?")
+                params = dict(p.split("=", 1) for p in query.split("&") if "=" in p)
+                headers = {k.lower(): v for k, v in (request.get("headers") or {}).items()}
+                status, response_headers, body = self.handle(
+                    request.get("method", "GET").upper(), path, params, headers, request.get("body"), base_url
+                )
+                group_responses.append({
+                    "id": request.get("id"),
+                    "status": status,
+                    "headers": response_headers,
+                    "body": body,
+                })
+                if status >= 400 and not group.startswith("__single_"):
+                    failed = True
+                    break
+
+            if failed:
+                # Rollback del change set: le operazioni già applicate falliscono
+                for key, state in states.items():
+                    self.entity_sets[key].restore(state)
+                failed_ids = {r["id"] for r in group_responses if r["status"] >= 400}
+                for request in groups[group]:
+                    if request.get("id") not in failed_ids:
+                        group_responses = [r for r in group_responses if r["id"] != request.get("id")]
+                        group_responses.append({
+                            "id": request.get("id"),
+                            "status": 424,
+                            "headers": {},
+                            "body": {"error": {"code": "FailedDependency", "message": "Change set failed"}},
+                        })
+            responses.extend(group_responses)
+
+        return {"responses": responses}
+
+    def _written_sets(self, requests: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        """Collection esistenti toccate dalle richieste di scrittura di un change set"""
+        keys = []
+        for request in requests:
+            if request.get("method", "GET").upper() == "GET":
+                continue
+            match = self.ENTITY_PATH.match(request.get("url", "").partition("?")[0].strip("/"))
+            key = match and (match.group("company"), match.group("collection"))
+            if key in self.entity_sets and key not in keys:
+                keys.append(key)
+        return keys
+
+
+# ============== HELPERS ==============
+
+def _iso(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.") + f"{value.microsecond // 1000:03d}Z"
+
+
+def _parse_datetime(value: str) -> datetime:
+    return datetime.fromisoformat(value.strip().strip("'").replace("Z", "+00:00"))
+
+
+def _parse_filter(expression: Optional[str]):
+    """Supporta solo lastModifiedDateTime {gt|ge|lt|le} <data> [and ...]"""
+    start = end = None
+    start_inclusive = end_inclusive = False
+    if not expression:
+        return start, start_inclusive, end, end_inclusive
+
+    for clause in re.split(r"\s+and\s+", expression.strip(), flags=re.IGNORECASE):
+        match = re.fullmatch(r"lastModifiedDateTime\s+(gt|ge|lt|le)\s+(\S+)", clause.strip(), re.IGNORECASE)
+        if not match:
+            raise ODataError(400, "BadRequest_NotSupported", f"Unsupported $filter clause: {clause}")
+        op, value = match.group(1).lower(), _parse_datetime(match.group(2))
+        if op in ("gt", "ge"):
+            start, start_inclusive = value, op == "ge"
+        else:
+            end, end_inclusive = value, op == "le"
+    return start, start_inclusive, end, end_inclusive
+
+
+def _in_range(row: Dict[str, Any], modified_range) -> bool:
+    start, start_inclusive, end, end_inclusive = modified_range
+    modified = _parse_datetime(row["lastModifiedDateTime"])
+    if start is not None and (modified < start or (modified == start and not start_inclusive)):
+        return False
+    if end is not None and (modified > end or (modified == end and not end_inclusive)):
+        return False
+    return True
+
+
+def _select_fields(entity_set: EntitySet, select: Optional[str]) -> Optional[set]:
+    """Campi di $select, validati contro le proprietà dell'entità"""
+    if not select:
+        return None
+    fields = {f.strip() for f in select.split(",")}
+    entity_set.check_properties(fields)
+    return fields
+
+
+def _project(row: Dict[str, Any], fields: Optional[set]) -> Dict[str, Any]:
+    if fields is None:
+        return row
+    return {k: v for k, v in row.items() if k in fields or k.startswith("@")}
+
+
+def _writable(data: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in data.items() if k not in ("id", "number", "lastModifiedDateTime") and not k.startswith("@")}
+
+
+# ============== APP ==============
+
+def create_app(config: Optional[EmulatorConfig] = None) -> FastAPI:
+    """Crea l'app FastAPI dell'emulatore"""
+    emulator = BCEmulator(config or EmulatorConfig.from_env())
+    app = FastAPI(title="Business Central Emulator")
+    app.state.emulator = emulator
+
+    def to_response(result: EmulatorResponse) -> Response:
+        status, headers, body = result
+        if body is None:
+            return Response(status_code=status, headers=headers)
+        return JSONResponse(body, status_code=status, headers=headers)
+
+    @app.post("/{tenant}/oauth2/v2.0/token")
+    async def token(tenant: str, request: Request):
+        # Form urlencoded parsato a mano: evita la dipendenza python-multipart
+        form = dict(parse_qsl((await request.body()).decode()))
+        if form.get("grant_type") != "client_credentials" or not form.get("client_id"):
+            return JSONResponse({"error": "invalid_request"}, status_code=400)
+        return {
+            "token_type": "Bearer",
+            "expires_in": 3599,
+            "access_token": f"emulator-{tenant}-{uuid.uuid4().hex}",
+        }
+
+    @app.get("/_emulator/stats")
+    async def stats():
+        return {
+            **emulator.stats,
+            "config": emulator.config.__dict__,
+            "modified_rows": sum(len(s.overrides) + len(s.created) for s in emulator.entity_sets.values()),
+        }
+
+    @app.api_route(API_PREFIX + "/{path:path}", methods=["GET", "POST", "PATCH", "DELETE"])
+    async def odata(path: str, request: Request):
+        emulator.stats["requests"] += 1
+        if not request.headers.get("authorization", "").startswith("Bearer "):
+            return JSONResponse({"error": {"code": "Unauthorized", "message": "Missing bearer token"}}, status_code=401)
+
+        throttled = await emulator.simulate_network()
+        if throttled:
+            return to_response(throttled)
+
+        base_url = str(request.base_url).rstrip("/") + API_PREFIX
+        body = await request.json() if await request.body() else None
+
+        if path == "$batch" and request.method == "POST":
+            return JSONResponse(emulator.batch((body or {}).get("requests", []), base_url))
+
+        headers = {k.lower(): v for k, v in request.headers.items()}
+        return to_response(emulator.handle(
+            request.method, path, dict(request.query_params), headers, body, base_url
+        ))
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Business Central OData emulator")
+    defaults = EmulatorConfig.from_env()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--companies", type=int, default=defaults.companies)
+    parser.add_argument("--customers", type=int, default=defaults.customers, help="clienti per company")
+    parser.add_argument("--vendors", type=int, default=defaults.vendors, help="fornitori per company")
+    parser.add_argument("--latency-min-ms", type=float, default=defaults.latency_min_ms)
+    parser.add_argument("--latency-max-ms", type=float, default=defaults.latency_max_ms)
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate, help="probabilità 429 (0-1)")
+    parser.add_argument("--retry-after", type=int, default=defaults.retry_after)
+    parser.add_argument("--max-page-size", type=int, default=defaults.max_page_size)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    args = parser.parse_args()
+
+    config = EmulatorConfig(**{
+        name: getattr(args, name) for name in EmulatorConfig.__dataclass_fields__ if hasattr(args, name)
+    })
+
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
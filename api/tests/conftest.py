@@ -0,0 +1,52 @@
+"""
+Fixture comuni.
+
+I test che richiedono Postgres girano solo con ATOMIC_API_TEST_DATABASE_URL
+(es. il database locale di `supabase start`) e vengono saltati altrimenti.
+Ogni test usa una connessione in transazione annullata alla fine, quindi le
+funzioni caricate dalle migrazioni e le tabelle temporanee non restano.
+"""
+
+import os
+import re
+from pathlib import Path
+from typing import List
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "supabase" / "migrations"
+
+_FUNCTION = re.compile(r"CREATE OR REPLACE FUNCTION .*?\$function\$\s*;", re.DOTALL)
+
+
+def migration_functions(name: str) -> List[str]:
+    """Statement CREATE OR REPLACE FUNCTION di una migrazione, nell'ordine del file"""
+    return _FUNCTION.findall((MIGRATIONS_DIR / name).read_text())
+
+
+@pytest.fixture
+async def pg():
+    """Connessione Postgres in una transazione annullata a fine test"""
+    url = os.environ.get("ATOMIC_API_TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("ATOMIC_API_TEST_DATABASE_URL non impostata")
+    engine = create_async_engine(url)
+    try:
+        async with engine.connect() as conn:
+            transaction = await conn.begin()
+            try:
+                yield conn
+            finally:
+                await transaction.rollback()
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture
+async def dedup_functions(pg):
+    """Funzioni di normalizzazione e unione della migrazione dedup"""
+    for statement in migration_functions("20261017170000_contacts_dedup_keys.sql"):
+        await pg.execute(text(statement))
+    return pg
@@ -0,0 +1,39 @@
+"""Emulatore BC: $batch con change set tutto o niente"""
+
+from emulator.bc_emulator import BCEmulator, EmulatorConfig
+
+
+def _patch(emulator, company, row_id, name, group=None):
+    request = {
+        "id": f"{row_id}-{name}",
+        "method": "PATCH",
+        "url": f"companies({company})/customers({row_id})",
+        "headers": {"If-Match": "*"},
+        "body": {"displayName": name},
+    }
+    if group:
+        request["atomicityGroup"] = group
+    return request
+
+
+def test_batch_rolls_back_only_failed_change_sets():
+    emulator = BCEmulator(EmulatorConfig(companies=2, customers=10, vendors=10))
+    company, other = (company["id"] for company in emulator.companies)
+    customers = emulator.entity_sets[(company, "customers")]
+    
+    response = emulator.batch([
+        _patch(emulator, company, customers.row_id(1), "Single"),
+        _patch(emulator, company, customers.row_id(2), "Grouped", group="g1"),
+        _patch(emulator, company, "missing", "Grouped", group="g1"),
+        _patch(emulator, other, emulator.entity_sets[(other, "customers")].row_id(3), "Other", group="g2"),
+    ], "")
+    
+    assert [item["status"] for item in response["responses"]] == [200, 404, 424, 200]
+    assert customers.get(1)["displayName"] == "Single"
+    assert customers.get(2)["displayName"] != "Grouped"
+    assert emulator.entity_sets[(other, "customers")].get(3)["displayName"] == "Other"
+    
+    # Snapshot solo delle collection scritte dal change set
+    read = {"id": "r", "method": "GET", "url": f"companies({other})/vendors"}
+    write = _patch(emulator, company, customers.row_id(1), "x", group="g")
+    assert emulator._written_sets([read, write]) == [(company, "customers")]
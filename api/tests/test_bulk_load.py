@@ -0,0 +1,15 @@
+"""SQL del caricamento bulk (MERGE dallo staging)"""
+
+from app.services.bulk_load import CONTACTS_MERGE, StagedMerge
+
+
+def _merge() -> StagedMerge:
+    return StagedMerge(None, CONTACTS_MERGE.with_columns(["first_name", "last_name"], fill=["company_id"]))
+
+
+def test_links_refresh_version_of_unchanged_rows():
+    sql = _merge()._links_sql()
+    assert "l.version AS link_version" in sql
+    assert "WHERE s.link_hash IS DISTINCT FROM s.external_hash OR (s.external_version IS NOT NULL" in sql
+    assert "s.external_version IS DISTINCT FROM s.link_version" in sql
+
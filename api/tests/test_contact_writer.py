@@ -0,0 +1,131 @@
+"""Upsert dei contatti: i contatti CRM adottati dalla deduplica non perdono dati"""
+
+from types import SimpleNamespace
+
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+from app.services.contact_writer import FILL_COLUMNS, UPSERT_UPDATE_COLUMNS, upsert_contacts
+from app.services.link_cache import SyncLink, SyncLinkCache
+
+SOURCE = "dynamics_bc"
+
+
+def _row(external_id: str, **values):
+    return {
+        "first_name": "Mario",
+        "last_name": "Rossi",
+        "email_jsonb": [{"email": "mario.rossi@acme.it", "type": "Work"}],
+        "phone_jsonb": [],
+        "company_id": None,
+        "external_source": SOURCE,
+        "external_id": external_id,
+        "external_data": {"id": external_id},
+        "last_synced_at": None,
+        "external_hash": f"hash-{external_id}",
+        "external_version": f'W/"{external_id}"',
+        **values,
+    }
+
+
+class RecordingSession:
+    """Sessione finta: registra gli statement, l'upsert restituisce righe aggiornate"""
+    
+    def __init__(self):
+        self.statements = []
+    
+    async def execute(self, statement, params=None):
+        sql = str(statement.compile(dialect=postgresql.dialect()))
+        self.statements.append(sql)
+        rows = []
+        if sql.startswith("INSERT INTO contacts"):
+            rows = [
+                SimpleNamespace(id=index, external_id=value, inserted=False)
+                for index, (key, value) in enumerate(statement.compile().params.items())
+                if key.startswith("external_id")
+            ]
+        return SimpleNamespace(all=lambda: rows)
+
+
+class PreloadedLinks(SyncLinkCache):
+    """Cache senza query: i link del test sono già caricati"""
+    
+    async def warm(self, db, source, entity_type, external_ids):
+        return None
+    
+    async def save(self, db, source, entity_type, links):
+        for external_id, link in links.items():
+            self.put(source, entity_type, external_id, link)
+
+
+def _upserts(session: RecordingSession):
+    return [sql for sql in session.statements if sql.startswith("INSERT INTO contacts")]
+
+
+async def test_adopted_contact_keeps_crm_values():
+    session = RecordingSession()
+    await upsert_contacts(session, [_row("a")], PreloadedLinks(10), fill_columns=FILL_COLUMNS)
+    
+    [sql] = _upserts(session)
+    assert "email_jsonb = public.union_email_jsonb(contacts.email_jsonb, excluded.email_jsonb)" in sql
+    assert "phone_jsonb = public.union_phone_jsonb(contacts.phone_jsonb, excluded.phone_jsonb)" in sql
+    assert "first_name = coalesce(contacts.first_name, excluded.first_name)" in sql
+    assert "company_id = coalesce(contacts.company_id, excluded.company_id)" in sql
+    assert "external_data = excluded.external_data" in sql
+
+
+async def test_linked_contact_follows_mapping():
+    links = PreloadedLinks(10)
+    links.put(SOURCE, "contact", "a", SyncLink(crm_id=1, hash="old"))
+    session = RecordingSession()
+    await upsert_contacts(session, [_row("a"), _row("b")], links, update_columns=UPSERT_UPDATE_COLUMNS)
+    
+    linked, adopted = _upserts(session)
+    assert "email_jsonb = excluded.email_jsonb" in linked
+    assert "first_name = excluded.first_name" in linked
+    assert "union_email_jsonb" in adopted
+
+
+async def test_adopted_contact_with_two_emails(dedup_functions):
+    pg = dedup_functions
+    # Tabelle temporanee: pg_temp precede public nella risoluzione dei nomi
+    await pg.execute(text(
+        "CREATE TEMP TABLE contacts (id bigserial primary key, first_name text, last_name text, "
+        "email_jsonb jsonb, phone_jsonb jsonb, company_id bigint, external_source text, "
+        "external_id text, external_data jsonb, last_synced_at timestamptz, "
+        "unique (external_source, external_id)) ON COMMIT DROP"
+    ))
+    await pg.execute(text(
+        "CREATE TEMP TABLE sync_links (id bigserial primary key, source text not null, "
+        "entity_type text not null, external_id text not null, crm_id bigint not null, "
+        "version text, hash text, synced_at timestamptz, "
+        "unique (source, entity_type, external_id)) ON COMMIT DROP"
+    ))
+    # Contatto inserito a mano, già collegato dalla deduplica (external_id assegnato)
+    await pg.execute(text(
+        "INSERT INTO contacts (first_name, last_name, email_jsonb, phone_jsonb, company_id, external_source, external_id) "
+        "VALUES ('Mario', 'Rossi', CAST(:emails AS jsonb), '[]', 7, :source, 'a')"
+    ), {
+        "emails": '[{"email": "Mario.Rossi@acme.it", "type": "Work"}, {"email": "mario@casa.it", "type": "Home"}]',
+        "source": SOURCE,
+    })
+    
+    row = _row(
+        "a",
+        first_name="MARIO",
+        last_name=None,
+        email_jsonb=[{"email": "mario.rossi@acme.it ", "type": "Other"}, {"email": "m.rossi@acme.it", "type": "Work"}],
+        phone_jsonb=[{"number": "+39 02 1234567", "type": "Work"}],
+    )
+    created, updated, unchanged = await upsert_contacts(
+        pg, [row], SyncLinkCache(10), fill_columns=FILL_COLUMNS,
+    )
+    
+    assert (created, updated, unchanged) == (0, 1, 0)
+    contact = (await pg.execute(text("SELECT * FROM contacts WHERE external_id = 'a'"))).one()
+    assert (contact.first_name, contact.last_name, contact.company_id) == ("Mario", "Rossi", 7)
+    assert [item["email"] for item in contact.email_jsonb] == ["Mario.Rossi@acme.it", "mario@casa.it", "m.rossi@acme.it"]
+    assert contact.phone_jsonb == [{"number": "+39 02 1234567", "type": "Work"}]
+    assert contact.external_data == {"id": "a"}
+    link = (await pg.execute(text("SELECT crm_id, hash FROM sync_links WHERE external_id = 'a'"))).one()
+    assert link == (contact.id, "hash-a")
@@ -0,0 +1,60 @@
+"""Chiavi di deduplica: le normalizzazioni Python coincidono con le funzioni SQL"""
+
+import pytest
+from sqlalchemy import text
+
+from app.services.dedup import name_key, normalize_email, normalize_phone
+
+EMAILS = [
+    None,
+    "",
+    "   ",
+    "mario.rossi@acme.it",
+    " Mario.Rossi@ACME.it ",
+    "\tmario@acme.it",
+]
+
+PHONES = [
+    None,
+    "",
+    "12345",
+    "123456",
+    "02 1234567",
+    " +39 02 1234567",
+    "0039 02 1234567",
+    "+1 (555) 123-4567",
+    "+0039 02 1234567",
+    "335/123.45.67",
+    "ext. 12",
+]
+
+NAMES = [
+    (None, None, 7),
+    ("", " ", 7),
+    ("Mario", None, None),
+    (" Mario ", "ROSSI", 7),
+    (None, "Rossi", 7),
+    ("Mario", "", 7),
+    ("Anna Maria", "De Luca", 12),
+]
+
+
+@pytest.mark.parametrize("email", EMAILS)
+async def test_normalize_email_matches_sql(dedup_functions, email):
+    sql = await dedup_functions.scalar(text("SELECT public.normalize_email(:email)"), {"email": email})
+    assert normalize_email(email) == sql
+
+
+@pytest.mark.parametrize("number", PHONES)
+async def test_normalize_phone_matches_sql(dedup_functions, number):
+    sql = await dedup_functions.scalar(text("SELECT public.normalize_phone(:number)"), {"number": number})
+    assert normalize_phone(number) == sql
+
+
+@pytest.mark.parametrize("first_name, last_name, company_id", NAMES)
+async def test_name_key_matches_sql(dedup_functions, first_name, last_name, company_id):
+    sql = await dedup_functions.scalar(
+        text("SELECT public.contact_name_key(:first_name, :last_name, CAST(:company_id AS bigint))"),
+        {"first_name": first_name, "last_name": last_name, "company_id": company_id},
+    )
+    assert name_key(first_name, last_name, company_id) == sql
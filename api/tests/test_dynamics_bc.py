@@ -0,0 +1,115 @@
+"""Client BC: errori di rete, rinnovo del token dopo un 401, $select validato"""
+
+import httpx
+import pytest
+
+from app.config import get_settings
+from app.models.schemas import DynamicsBCCustomer, DynamicsBCCustomerWrite, DynamicsBCVendor
+from app.services.dynamics_bc import (
+    BC_MODEL_PROPERTIES,
+    DynamicsBCClient,
+    DynamicsBCConnectionError,
+    DynamicsBCError,
+    model_aliases,
+    select_fields,
+)
+from emulator.bc_emulator import BCEmulator, EmulatorConfig
+
+TOKEN_PATH = "/oauth2/v2.0/token"
+
+
+def _client(handler, tenant: str) -> DynamicsBCClient:
+    client = DynamicsBCClient(
+        tenant_id=tenant,
+        client_id="client",
+        client_secret="secret",
+        base_url="http://bc.test/api/v2.0",
+        http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    client._backoff = lambda retry_state: 0
+    return client
+
+
+async def test_transport_error_becomes_connection_error():
+    def handler(request):
+        if request.url.path.endswith(TOKEN_PATH):
+            return httpx.Response(200, json={"access_token": "token", "expires_in": 3600})
+        raise httpx.ConnectError("connection refused", request=request)
+    
+    client = _client(handler, "tenant-transport")
+    with pytest.raises(DynamicsBCConnectionError):
+        await client._request("GET", "companies")
+    
+    attempts = get_settings().DYNAMICS_BC_MAX_RETRIES + 1
+    assert client.stats["connection_errors"] == attempts
+    assert client.stats["retries"] == attempts - 1
+    
+    # POST non idempotente: nessun retry
+    client.stats["connection_errors"] = 0
+    with pytest.raises(DynamicsBCConnectionError):
+        await client._request("POST", "companies", json={})
+    assert client.stats["connection_errors"] == 1
+
+
+async def test_token_refresh_after_401_is_counted():
+    tokens = iter(["revoked", "fresh"])
+    
+    def handler(request):
+        if request.url.path.endswith(TOKEN_PATH):
+            return httpx.Response(200, json={"access_token": next(tokens), "expires_in": 3600})
+        if request.headers["Authorization"] == "Bearer revoked":
+            return httpx.Response(401)
+        return httpx.Response(200, json={"value": []})
+    
+    client = _client(handler, "tenant-401")
+    assert await client._request("GET", "companies") == {"value": []}
+    assert client.stats["requests"] == 2
+    assert client.stats["token_refreshes"] == 1
+
+
+@pytest.mark.parametrize("model", [DynamicsBCCustomer, DynamicsBCVendor])
+def test_model_aliases_are_bc_properties(model):
+    assert set(model_aliases(model)) <= BC_MODEL_PROPERTIES[model]
+
+
+def test_select_rejects_unknown_properties():
+    assert "taxRegistrationNumber" in select_fields(DynamicsBCVendor, ["taxRegistrationNumber"])
+    with pytest.raises(DynamicsBCError, match="taxRegistrationNo"):
+        select_fields(DynamicsBCVendor, ["taxRegistrationNo"])
+
+
+@pytest.mark.parametrize("collection", ["customers", "vendors"])
+def test_emulator_rows_use_bc_properties(collection):
+    emulator = BCEmulator(EmulatorConfig(customers=10, vendors=10))
+    company = emulator.companies[0]["id"]
+    entity_set = emulator.entity_sets[(company, collection)]
+    for index in range(10):
+        row = entity_set.synthetic_row(index)
+        assert {key for key in row if not key.startswith("@")} <= entity_set.properties
+    
+    path = f"companies({company})/{collection}"
+    status, _, _ = emulator.handle("GET", path, {"$select": "id,addressLine1"}, {}, None, "")
+    assert status == 200
+    status, _, body = emulator.handle("GET", path, {"$select": "id,address"}, {}, None, "")
+    assert status == 400
+    assert "address" in body["error"]["message"]
+
+
+async def test_push_customers_writes_in_each_company():
+    client = _client(lambda request: httpx.Response(500), "tenant-push")
+    client.company_id = "default"
+    operations = []
+    
+    async def execute_batch(batch, change_set_size=None):
+        operations.extend(batch)
+        return []
+    
+    client.execute_batch = execute_batch
+    await client.push_customers([
+        DynamicsBCCustomerWrite(ref="1", customer_id="a", etag='W/"1"', company_id="c2", data={"displayName": "A"}),
+        DynamicsBCCustomerWrite(ref="2", data={"displayName": "B"}),
+    ])
+    assert [(op.method, op.url) for op in operations] == [
+        ("PATCH", "companies(c2)/customers(a)"),
+        ("POST", "companies(default)/customers"),
+    ]
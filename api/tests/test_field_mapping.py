@@ -0,0 +1,31 @@
+"""Mapping dichiarativo: aziende BC (fornitori e clienti) → companies"""
+
+import pytest
+
+from app.models.schemas import DynamicsBCCustomer, DynamicsBCVendor, EntityType, SyncSource
+from app.services.field_mapping import MappingError
+from app.services.sync_engine import SyncEngine
+
+
+def _company_mapping(custom=None):
+    return SyncEngine(None).compile_mapping(SyncSource.DYNAMICS_BC, EntityType.COMPANY, custom)
+
+
+def test_default_company_mapping_for_vendors_and_customers():
+    mapping = _company_mapping()
+    vendor = DynamicsBCVendor(displayName="Acme S.r.l.", phoneNumber="", taxRegistrationNumber="IT01234567890")
+    customer = DynamicsBCCustomer(displayName="Acme S.r.l.", city="Milano", type="Company")
+    
+    assert mapping(vendor)["phone_number"] is None
+    assert mapping(vendor)["tax_identifier"] == "IT01234567890"
+    assert mapping(customer)["city"] == "Milano"
+    assert set(mapping.targets) >= {"name", "tax_identifier"}
+
+
+def test_company_mapping_only_accepts_fields_common_to_both_models():
+    # "type" esiste solo sui clienti BC
+    with pytest.raises(MappingError, match="unknown source field 'type'"):
+        _company_mapping([{"target": "description", "source": "type"}])
+    
+    mapping = _company_mapping([{"target": "description", "source": "email"}])
+    assert "description" in mapping.targets
@@ -0,0 +1,25 @@
+"""Cache dei link: un batch annullato non lascia link mai salvati"""
+
+from app.services.link_cache import SyncLink, SyncLinkCache
+
+
+class NullSession:
+    async def execute(self, statement, params=None):
+        return None
+
+
+async def test_invalidate_drops_unpersisted_links():
+    cache = SyncLinkCache(10)
+    cache.put("dynamics_bc", "contact", "a", SyncLink(crm_id=1, hash="old"))
+    
+    await cache.save(NullSession(), "dynamics_bc", "contact", {
+        "a": SyncLink(crm_id=1, hash="new"),
+        "b": SyncLink(crm_id=2, hash="new"),
+    })
+    assert cache.get("dynamics_bc", "contact", "a").hash == "new"
+    
+    # Rollback: le chiavi del batch vengono rilette da sync_links al prossimo warm
+    cache.invalidate("dynamics_bc", "contact", ["a", "b"])
+    assert cache.get("dynamics_bc", "contact", "a") is None
+    assert cache.get("dynamics_bc", "contact", "b") is None
+    assert len(cache) == 0
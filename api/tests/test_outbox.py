@@ -0,0 +1,81 @@
+"""Listener dell'outbox: la connessione LISTEN caduta viene riaperta"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+from app.services.outbox import OUTBOX_CHANNEL, listen_outbox
+
+
+class FakeRawConnection:
+    def __init__(self):
+        self.listeners = {}
+        self.termination = []
+        self.closed = False
+    
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+    
+    async def remove_listener(self, channel, callback):
+        self.listeners.pop(channel, None)
+    
+    def add_termination_listener(self, callback):
+        self.termination.append(callback)
+    
+    def remove_termination_listener(self, callback):
+        self.termination.remove(callback)
+    
+    def is_closed(self):
+        return self.closed
+    
+    def terminate(self):
+        self.closed = True
+        for callback in self.termination:
+            callback(self)
+
+
+class FakeEngine:
+    """Prima connessione rifiutata, poi connessioni che si possono chiudere"""
+    
+    def __init__(self):
+        self.attempts = 0
+        self.raw = []
+    
+    @asynccontextmanager
+    async def connect(self):
+        self.attempts += 1
+        if self.attempts == 1:
+            raise OSError("connection refused")
+        raw = FakeRawConnection()
+        self.raw.append(raw)
+        
+        class Connection:
+            async def get_raw_connection(self):
+                return type("AdaptedConnection", (), {"driver_connection": raw})()
+        
+        yield Connection()
+
+
+async def test_listener_reconnects_after_connection_loss():
+    engine = FakeEngine()
+    drains = asyncio.Queue()
+    
+    async def drain():
+        await drains.put(engine.attempts)
+    
+    task = asyncio.create_task(listen_outbox(
+        engine, drain, poll_seconds=60, retry_min_seconds=0.01, retry_max_seconds=0.02,
+    ))
+    try:
+        assert await asyncio.wait_for(drains.get(), 1) == 2
+        assert OUTBOX_CHANNEL in engine.raw[0].listeners
+        
+        # Connessione chiusa durante l'attesa: nuovo LISTEN senza aspettare il poll
+        engine.raw[0].terminate()
+        assert await asyncio.wait_for(drains.get(), 1) == 3
+        assert OUTBOX_CHANNEL in engine.raw[1].listeners
+    finally:
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
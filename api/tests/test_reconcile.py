@@ -0,0 +1,79 @@
+"""Riconciliazione a bucket: riepilogo SQL e calcolo Python coincidono"""
+
+import hashlib
+
+from sqlalchemy import text
+
+from app.services.reconcile import BucketTree, bucket_of, crm_bucket_records, crm_bucket_summary, record_digest
+
+SOURCE = "dynamics_bc"
+BUCKETS = 16
+
+
+def _external_id(index: int) -> str:
+    return hashlib.sha1(str(index).encode()).hexdigest()
+
+
+def _links():
+    # Versioni nulle comprese: nel digest valgono come stringa vuota
+    return [
+        (_external_id(index), index, None if index % 5 == 0 else f'W/"JzQ0O{index}"')
+        for index in range(300)
+    ]
+
+
+def test_digest_fits_bigint():
+    digests = [record_digest(external_id, version) for external_id, _, version in _links()]
+    assert all(0 <= digest < 2 ** 60 for digest in digests)
+    assert {bucket_of(external_id, BUCKETS) for external_id, _, _ in _links()} == set(range(BUCKETS))
+
+
+def test_differing_buckets():
+    crm = BucketTree(BUCKETS)
+    external = BucketTree(BUCKETS)
+    for external_id, _, version in _links():
+        crm.add(external_id, version)
+        external.add(external_id, version)
+    assert external.differing(crm.summary) == set()
+    
+    changed = _links()[3][0]
+    external = BucketTree(BUCKETS)
+    for external_id, _, version in _links():
+        external.add(external_id, 'W/"nuova"' if external_id == changed else version)
+    assert external.differing(crm.summary) == {bucket_of(changed, BUCKETS)}
+
+
+async def test_bucket_summary_matches_sql(pg):
+    # Tabella temporanea: pg_temp precede public nella risoluzione dei nomi
+    await pg.execute(text(
+        "CREATE TEMP TABLE sync_links (id bigserial primary key, source text not null, "
+        "entity_type text not null, external_id text not null, crm_id bigint not null, "
+        "version text, hash text, synced_at timestamptz) ON COMMIT DROP"
+    ))
+    links = _links()
+    await pg.execute(
+        text(
+            "INSERT INTO sync_links (source, entity_type, external_id, crm_id, version) "
+            "VALUES (:source, :entity_type, :external_id, :crm_id, :version)"
+        ),
+        [
+            {"source": SOURCE, "entity_type": "contact", "external_id": external_id, "crm_id": crm_id, "version": version}
+            for external_id, crm_id, version in links
+        ] + [
+            # Altre entità: fuori dal riepilogo dei contatti
+            {"source": SOURCE, "entity_type": "company", "external_id": external_id, "crm_id": crm_id, "version": None}
+            for external_id, crm_id, _ in links[:20]
+        ],
+    )
+    
+    tree = BucketTree(BUCKETS)
+    for external_id, _, version in links:
+        tree.add(external_id, version)
+    
+    summary = await crm_bucket_summary(pg, SOURCE, "contact", BUCKETS)
+    assert summary == tree.summary
+    assert tree.differing(summary) == set()
+    
+    bucket = bucket_of(links[0][0], BUCKETS)
+    records = await crm_bucket_records(pg, SOURCE, "contact", BUCKETS, [bucket])
+    assert set(records) == {external_id for external_id, _, _ in links if bucket_of(external_id, BUCKETS) == bucket}
@@ -0,0 +1,21 @@
+"""Engine per entità (_fork): stato condiviso esplicito, il resto nuovo"""
+
+from app.services.company_index import CompanyIndex
+from app.services.sync_engine import SyncEngine
+
+
+async def test_fork_shares_only_job_state():
+    engine = SyncEngine("job-session", contact_mapping={"fields": [{"target": "title", "value": "x"}]}, session_factory=object, job_key="job")
+    engine._clients["dynamics_bc"] = object()
+    fork = engine._fork("entity-session")
+    
+    assert fork.db == "entity-session" and engine.db == "job-session"
+    assert fork.links is engine.links
+    assert fork._mappings is engine._mappings
+    assert fork.job_key == "job" and fork.session_factory is object
+    assert fork._clients == {} and fork._checkpoint_lock is not engine._checkpoint_lock
+    
+    # Indice aziende caricato da un fork: visibile all'engine del job e agli altri fork
+    engine._company_index = CompanyIndex()
+    assert await fork.company_index() is engine._company_index
+    assert await engine._fork("other-session").company_index() is engine._company_index
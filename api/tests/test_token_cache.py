@@ -0,0 +1,31 @@
+"""Cache token: un valore Redis illeggibile non blocca il rinnovo"""
+
+import pytest
+
+from app.services.token_cache import REDIS_KEY_PREFIX, TokenCache
+
+
+class FakeRedis:
+    def __init__(self, values):
+        self.values = dict(values)
+    
+    async def get(self, key):
+        return self.values.get(key)
+    
+    async def delete(self, key):
+        self.values.pop(key, None)
+
+
+@pytest.mark.parametrize("raw", ["not json", "[]", '{"access_token": "x"}', '{"access_token": "x", "expires_at": "soon"}'])
+async def test_invalid_shared_token_is_dropped(raw):
+    cache = TokenCache()
+    redis = FakeRedis({REDIS_KEY_PREFIX + "key": raw})
+    cache._get_redis = lambda: redis
+    # Il rinnovo passa da _refresh: qui senza lock Redis
+    cache._refresh = lambda key, fetcher: cache._fetch(key, fetcher)
+    
+    async def fetch():
+        return "fresh", 3600
+    
+    assert await cache.get_token("key", fetch) == "fresh"
+    assert REDIS_KEY_PREFIX + "key" not in redis.values
@@ -0,0 +1,11 @@
+-- External system references for contacts synchronized by the API service
+-- (Dynamics BC, ...). The unique index is the conflict target of the
+-- batch upsert: INSERT ... ON CONFLICT (external_source, external_id).
+-- Contacts created in the CRM keep NULLs and are not affected.
+
+alter table "public"."contacts" add column "external_source" text;
+alter table "public"."contacts" add column "external_id" text;
+alter table "public"."contacts" add column "external_data" jsonb;
+alter table "public"."contacts" add column "last_synced_at" timestamp with time zone;
+
+CREATE UNIQUE INDEX contacts_external_source_external_id_key ON public.contacts USING btree (external_source, external_id);
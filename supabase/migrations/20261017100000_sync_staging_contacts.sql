@@ -0,0 +1,24 @@
+-- Unlogged staging table for bulk loads of synchronized contacts.
+-- The API service COPYs transformed rows here (one run_id per load) and
+-- applies them to contacts with a single MERGE. Rows are deleted after
+-- the merge; being unlogged, the table is not WAL-logged and is emptied
+-- after a crash, which is fine for transient data.
+
+create unlogged table "public"."sync_staging_contacts" (
+    "seq" bigint generated by default as identity not null,
+    "run_id" uuid not null,
+    "first_name" text,
+    "last_name" text,
+    "email_jsonb" jsonb,
+    "phone_jsonb" jsonb,
+    "first_seen" timestamp with time zone,
+    "last_seen" timestamp with time zone,
+    "external_source" text not null,
+    "external_id" text not null,
+    "external_data" jsonb,
+    "last_synced_at" timestamp with time zone
+);
+
+alter table "public"."sync_staging_contacts" enable row level security;
+
+CREATE INDEX sync_staging_contacts_run_id_idx ON public.sync_staging_contacts USING btree (run_id, external_source, external_id, seq);
@@ -0,0 +1,7 @@
+-- Content hash of the mapped fields of synchronized contacts, computed by
+-- the API for each staged row. The sync skips the write when the incoming
+-- hash matches the one stored with the contact's link (sync_links), so
+-- re-syncs of unchanged data touch no rows (no WAL, trigger work or index
+-- churn).
+
+alter table "public"."sync_staging_contacts" add column "external_hash" text;
@@ -0,0 +1,51 @@
+-- Durable link between records of external systems (Dynamics BC, ...) and
+-- CRM rows. The API service resolves a whole sync batch with one indexed
+-- query on (source, entity_type, external_id); version is the external
+-- ETag and hash the content hash of the mapped fields, used to skip
+-- unchanged records.
+
+create table "public"."sync_links" (
+    "id" bigint generated by default as identity not null,
+    "source" text not null,
+    "entity_type" text not null,
+    "external_id" text not null,
+    "crm_id" bigint not null,
+    "version" text,
+    "hash" text,
+    "synced_at" timestamp with time zone not null default now(),
+    constraint "sync_links_pkey" primary key ("id")
+);
+
+alter table "public"."sync_links" enable row level security;
+
+-- Covering index for the per-batch lookup (index-only scans)
+CREATE UNIQUE INDEX sync_links_source_entity_type_external_id_key ON public.sync_links USING btree (source, entity_type, external_id) INCLUDE (crm_id, version, hash);
+
+-- Reverse lookup CRM row → external records (outbound sync)
+CREATE INDEX sync_links_entity_type_crm_id_idx ON public.sync_links USING btree (entity_type, crm_id);
+
+-- Backfill from contacts synced so far (no hash yet: the next sync
+-- rewrites them once and stores it). The ETag is in external_data as
+-- 'etag' (model field name) or '@odata.etag' (BC payload stored as is);
+-- without one the version stays null and the first push uses If-Match: *.
+insert into "public"."sync_links" (source, entity_type, external_id, crm_id, version, hash, synced_at)
+select external_source, 'contact', external_id, id,
+    coalesce(external_data->>'etag', external_data->>'@odata.etag'), null, coalesce(last_synced_at, now())
+from "public"."contacts"
+where external_source is not null and external_id is not null;
+
+alter table "public"."sync_staging_contacts" add column "external_version" text;
+
+-- Links of deleted CRM rows are removed, so the next sync recreates them
+CREATE OR REPLACE FUNCTION public.delete_sync_links()
+ RETURNS trigger
+ LANGUAGE plpgsql
+AS $function$
+begin
+    delete from public.sync_links where entity_type = TG_ARGV[0] and crm_id = old.id;
+    return old;
+end;
+$function$
+;
+
+CREATE TRIGGER contact_sync_links_deleted AFTER DELETE ON public.contacts FOR EACH ROW EXECUTE FUNCTION public.delete_sync_links('contact');
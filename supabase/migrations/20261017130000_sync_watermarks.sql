@@ -0,0 +1,14 @@
+-- Incremental sync high-water marks: the max lastModifiedDateTime applied
+-- per source, external company and entity type. The next run filters the
+-- external API on it (minus a safety overlap) and fetches only deltas.
+
+create table "public"."sync_watermarks" (
+    "source" text not null,
+    "company_id" text not null default '',
+    "entity_type" text not null,
+    "high_water" timestamp with time zone not null,
+    "updated_at" timestamp with time zone not null default now(),
+    constraint "sync_watermarks_pkey" primary key ("source", "company_id", "entity_type")
+);
+
+alter table "public"."sync_watermarks" enable row level security;
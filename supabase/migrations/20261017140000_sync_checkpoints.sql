@@ -0,0 +1,18 @@
+-- Checkpoints of long-running syncs: after each applied batch the job stores
+-- the position reached per external company (rows applied with no gaps from
+-- the start of the stream, with the lastModifiedDateTime filter in use) and
+-- its counters. A retried job (same job key, e.g. the Celery task id) resumes
+-- from here instead of re-fetching everything. Deleted when the entity
+-- completes.
+
+create table "public"."sync_checkpoints" (
+    "job_key" text not null,
+    "source" text not null,
+    "entity_type" text not null,
+    "state" jsonb not null,
+    "created_at" timestamp with time zone not null default now(),
+    "updated_at" timestamp with time zone not null default now(),
+    constraint "sync_checkpoints_pkey" primary key ("job_key", "source", "entity_type")
+);
+
+alter table "public"."sync_checkpoints" enable row level security;
@@ -0,0 +1,54 @@
+-- Change capture for outbound sync (CRM → external systems). Triggers on
+-- contacts append the id of each changed row to sync_outbox and notify the
+-- 'sync_outbox' channel; the API service drains the outbox in batches
+-- (FOR UPDATE SKIP LOCKED) and pushes the current rows, so outbound cost
+-- follows the change rate instead of the table size. A batch is claimed
+-- (claimed_at) and committed before the HTTP call, so no lock is held
+-- while waiting for the external system; claims older than the API's
+-- timeout are taken again (worker died mid-push).
+--
+-- Echo suppression: the inbound sync sets `atomic.sync_source` for its
+-- transactions (set_config(..., true)), and rows it writes are not captured.
+
+create table "public"."sync_outbox" (
+    "id" bigint generated by default as identity not null,
+    "entity_type" text not null,
+    "record_id" bigint not null,
+    "operation" text not null,
+    "attempts" integer not null default 0,
+    "last_error" text,
+    "created_at" timestamp with time zone not null default now(),
+    "claimed_at" timestamp with time zone,
+    constraint "sync_outbox_pkey" primary key ("id")
+);
+
+alter table "public"."sync_outbox" enable row level security;
+
+CREATE INDEX sync_outbox_entity_type_id_idx ON public.sync_outbox USING btree (entity_type, id);
+
+CREATE OR REPLACE FUNCTION public.capture_sync_outbox()
+ RETURNS trigger
+ LANGUAGE plpgsql
+ SECURITY DEFINER
+ SET search_path TO ''
+AS $function$
+begin
+    -- Written by a sync: already in the external system, do not send it back
+    if coalesce(current_setting('atomic.sync_source', true), '') <> '' then
+        return null;
+    end if;
+    insert into public.sync_outbox (entity_type, record_id, operation) values (TG_ARGV[0], new.id, lower(TG_OP));
+    -- Payloads are deduplicated per transaction: one notification per entity type
+    perform pg_notify('sync_outbox', TG_ARGV[0]);
+    return null;
+end;
+$function$
+;
+
+CREATE TRIGGER contact_sync_outbox_inserted AFTER INSERT ON public.contacts FOR EACH ROW EXECUTE FUNCTION public.capture_sync_outbox('contact');
+
+CREATE TRIGGER contact_sync_outbox_updated AFTER UPDATE OF first_name, last_name, email_jsonb, phone_jsonb ON public.contacts FOR EACH ROW WHEN (((old.first_name IS DISTINCT FROM new.first_name) OR (old.last_name IS DISTINCT FROM new.last_name) OR (old.email_jsonb IS DISTINCT FROM new.email_jsonb) OR (old.phone_jsonb IS DISTINCT FROM new.phone_jsonb))) EXECUTE FUNCTION public.capture_sync_outbox('contact');
+
+-- sync_links has RLS and no policies: the cleanup trigger must bypass it
+-- like the outbox capture, or deletes made by app users leave stale links
+alter function public.delete_sync_links() security definer set search_path to '';
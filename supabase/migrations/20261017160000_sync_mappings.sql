@@ -0,0 +1,25 @@
+-- Custom field mappings per source and entity type. spec.fields is a list
+-- of rules (target column, source field or constant, split, normalizers,
+-- lookup) that the API service validates against the real table columns
+-- and compiles once per sync job; missing rows mean the default mapping.
+
+create table "public"."sync_mappings" (
+    "source" text not null,
+    "entity_type" text not null,
+    "spec" jsonb not null,
+    "updated_at" timestamp with time zone not null default now(),
+    constraint "sync_mappings_pkey" primary key ("source", "entity_type")
+);
+
+alter table "public"."sync_mappings" enable row level security;
+
+-- Mappable contacts columns, so bulk loads carry custom mapping targets
+alter table "public"."sync_staging_contacts" add column "title" text;
+alter table "public"."sync_staging_contacts" add column "gender" text;
+alter table "public"."sync_staging_contacts" add column "background" text;
+alter table "public"."sync_staging_contacts" add column "status" text;
+alter table "public"."sync_staging_contacts" add column "has_newsletter" boolean;
+alter table "public"."sync_staging_contacts" add column "tags" bigint[];
+alter table "public"."sync_staging_contacts" add column "company_id" bigint;
+alter table "public"."sync_staging_contacts" add column "sales_id" bigint;
+alter table "public"."sync_staging_contacts" add column "linkedin_url" text;
@@ -0,0 +1,114 @@
+-- Blocking keys for duplicate detection during inbound sync. External
+-- records without a link are matched to existing CRM contacts by
+-- normalized email, E.164 phone or name + company instead of being
+-- inserted as duplicates. The API service looks up a whole batch with one
+-- query on these expression indexes (&& on the key arrays, = ANY on the
+-- name key); only contacts not yet linked to an external system are
+-- candidates, hence the partial indexes.
+--
+-- The normalization must match app/services/dedup.py.
+
+CREATE OR REPLACE FUNCTION public.normalize_email(email text)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+    select nullif(lower(btrim(email)), '')
+$function$
+;
+
+-- '+' or '00' prefix: international number; otherwise an Italian number
+-- (national format, leading zero kept). Fewer than 6 digits: not a phone.
+CREATE OR REPLACE FUNCTION public.normalize_phone(number text)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+    select case
+        when length(d.digits) < 6 then null
+        when btrim(number) like '+%' then '+' || d.digits
+        when d.digits like '00%' then '+' || substr(d.digits, 3)
+        else '+39' || d.digits
+    end
+    from (select regexp_replace(coalesce(number, ''), '[^0-9]', '', 'g') as digits) d
+$function$
+;
+
+CREATE OR REPLACE FUNCTION public.contact_email_keys(email_jsonb jsonb)
+ RETURNS text[]
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+    select coalesce(array_agg(distinct k.key) filter (where k.key is not null), '{}')
+    from jsonb_array_elements(case when jsonb_typeof(email_jsonb) = 'array' then email_jsonb else '[]'::jsonb end) e,
+        lateral (select public.normalize_email(e->>'email') as key) k
+$function$
+;
+
+CREATE OR REPLACE FUNCTION public.contact_phone_keys(phone_jsonb jsonb)
+ RETURNS text[]
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+    select coalesce(array_agg(distinct k.key) filter (where k.key is not null), '{}')
+    from jsonb_array_elements(case when jsonb_typeof(phone_jsonb) = 'array' then phone_jsonb else '[]'::jsonb end) e,
+        lateral (select public.normalize_phone(e->>'number') as key) k
+$function$
+;
+
+-- Same first and last name in the same company; null without a company
+CREATE OR REPLACE FUNCTION public.contact_name_key(first_name text, last_name text, company_id bigint)
+ RETURNS text
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+    select case
+        when company_id is null or coalesce(btrim(first_name), '') || coalesce(btrim(last_name), '') = '' then null
+        else lower(coalesce(btrim(first_name), '')) || '|' || lower(coalesce(btrim(last_name), '')) || '|' || company_id
+    end
+$function$
+;
+
+-- Union of two email_jsonb / phone_jsonb arrays, one item per normalized
+-- key (items without a valid key are kept as they are). Existing items come
+-- first and win on duplicates: the sync uses these when it adopts a CRM
+-- contact matched by dedup, so secondary emails and phones are not lost.
+CREATE OR REPLACE FUNCTION public.union_email_jsonb(existing jsonb, incoming jsonb)
+ RETURNS jsonb
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+    select coalesce(jsonb_agg(d.item order by d.ord), '[]'::jsonb)
+    from (
+        select distinct on (coalesce(public.normalize_email(e.item->>'email'), '#' || e.ord)) e.item, e.ord
+        from jsonb_array_elements(
+            (case when jsonb_typeof(existing) = 'array' then existing else '[]'::jsonb end)
+            || (case when jsonb_typeof(incoming) = 'array' then incoming else '[]'::jsonb end)
+        ) with ordinality e(item, ord)
+        order by coalesce(public.normalize_email(e.item->>'email'), '#' || e.ord), e.ord
+    ) d
+$function$
+;
+
+CREATE OR REPLACE FUNCTION public.union_phone_jsonb(existing jsonb, incoming jsonb)
+ RETURNS jsonb
+ LANGUAGE sql
+ IMMUTABLE PARALLEL SAFE
+AS $function$
+    select coalesce(jsonb_agg(d.item order by d.ord), '[]'::jsonb)
+    from (
+        select distinct on (coalesce(public.normalize_phone(e.item->>'number'), '#' || e.ord)) e.item, e.ord
+        from jsonb_array_elements(
+            (case when jsonb_typeof(existing) = 'array' then existing else '[]'::jsonb end)
+            || (case when jsonb_typeof(incoming) = 'array' then incoming else '[]'::jsonb end)
+        ) with ordinality e(item, ord)
+        order by coalesce(public.normalize_phone(e.item->>'number'), '#' || e.ord), e.ord
+    ) d
+$function$
+;
+
+CREATE INDEX contacts_email_keys_idx ON public.contacts USING gin (public.contact_email_keys(email_jsonb)) WHERE (external_id IS NULL);
+
+CREATE INDEX contacts_phone_keys_idx ON public.contacts USING gin (public.contact_phone_keys(phone_jsonb)) WHERE (external_id IS NULL);
+
+CREATE INDEX contacts_name_key_idx ON public.contacts USING btree (public.contact_name_key(first_name, last_name, company_id)) WHERE (external_id IS NULL);
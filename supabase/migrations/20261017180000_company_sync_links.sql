@@ -0,0 +1,7 @@
+-- Companies synchronized from Dynamics BC (vendors and customers of type
+-- Company) are linked through sync_links with entity_type 'company': the
+-- companies table has no external key, and records sharing a VAT number
+-- are linked to the same company. Links of deleted companies are removed,
+-- so the next sync recreates them.
+
+CREATE TRIGGER company_sync_links_deleted AFTER DELETE ON public.companies FOR EACH ROW EXECUTE FUNCTION public.delete_sync_links('company');